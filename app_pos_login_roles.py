@@ -1,3 +1,5 @@
+import arranque
+import precarga
 import tkinter as tk
 from tkinter import ttk, messagebox
 import sys, traceback
@@ -72,21 +74,12 @@ class VentasAppConPermisos(VentasApp):
         self.bind_all("<Control-l>", lambda e: self._logout())
         self.bind_all("<Control-L>", lambda e: self._logout())
 
-        # Aplicar permisos de pestañas
-        self._aplicar_permisos()
-
         # Ir a la pestaña inicial sugerida por rol
         self.ir_a(TAB_INICIAL_POR_ROL.get(rol, "📊 Dashboard"))
 
-    def _aplicar_permisos(self):
-        permitidas = TABS_POR_ROL.get(self.rol, set())
-        try:
-            for tab_id in list(self.nb.tabs()):
-                titulo = self.nb.tab(tab_id, "text")
-                if titulo not in permitidas:
-                    self.nb.hide(tab_id)
-        except Exception as e:
-            messagebox.showerror("Permisos", f"No se pudieron aplicar permisos.\n\n{e}")
+    def _tabs_permitidas(self):
+        # Se consulta antes de crear las pestañas: las ocultas nunca se construyen
+        return TABS_POR_ROL.get(self.rol, set())
 
     def ir_a(self, titulo_tab: str):
         try:
@@ -150,6 +143,8 @@ class LoginApp(tk.Tk):
         self.configure(bg="#e9eef3")
         self._setup_style()
         self._build_ui()
+        # Mientras se escriben las credenciales se calientan conexiones y cachés
+        self.after_idle(precarga.iniciar)
 
     def _setup_style(self):
         style = ttk.Style(self)
@@ -267,6 +262,7 @@ class LoginApp(tk.Tk):
 # Lanzadores
 # ─────────────────────────────────────────────────────────────────────
 def abrir_pos(usuario: str, rol: str):
+    arranque.marcar("login")
     app = VentasAppConPermisos(usuario, rol)
     app.mainloop()
 
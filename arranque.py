@@ -0,0 +1,39 @@
+"""
+Tiempos de arranque: desde que se importa este módulo (lo primero que hacen
+los puntos de entrada) hasta la ventana lista y el primer escaneo.
+"""
+
+import time
+import logging
+
+logger = logging.getLogger("Arranque")
+
+_inicio = time.perf_counter()
+_marcas = []   # [(evento, ms desde el inicio)]
+_vistos = set()
+
+def marcar(evento: str, una_vez: bool = True):
+    """Registrar un hito del arranque (por defecto sólo la primera vez)"""
+    if una_vez and evento in _vistos:
+        return
+    _vistos.add(evento)
+    _marcas.append((evento, (time.perf_counter() - _inicio) * 1000))
+
+def marcas():
+    return list(_marcas)
+
+def reporte() -> str:
+    """Hitos en orden, con el tiempo acumulado y el parcial de cada uno"""
+    lineas = ["Tiempos de arranque:"]
+    anterior = 0.0
+    for evento, ms in _marcas:
+        lineas.append(f"  {ms:9.1f} ms  (+{ms - anterior:7.1f})  {evento}")
+        anterior = ms
+    return "\n".join(lineas)
+
+def registrar(evento: str):
+    """marcar() y dejar el reporte completo en el log"""
+    if evento in _vistos:
+        return
+    marcar(evento)
+    logger.info(reporte())
@@ -0,0 +1,312 @@
+"""
+Índice de búsqueda de productos para autocompletado y filtros.
+
+Se construye desde el catálogo (catalogo.py) y se actualiza con cada delta.
+Combina dos estructuras sobre textos normalizados (minúsculas, sin acentos):
+
+- prefijos: arreglos ordenados de (token, id) recorridos con bisect, uno por
+  nivel de relevancia (código, inicio del nombre, palabra del nombre,
+  categoría); se corta apenas se juntan los resultados pedidos.
+- trigramas: postings trigrama -> ids para coincidencias en medio del texto.
+"""
+
+import bisect
+import heapq
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Iterable
+
+from catalogo import get_catalogo
+
+# Niveles de relevancia, en el orden en que se recorren
+_CODIGO, _NOMBRE, _PALABRA, _CATEGORIA, _SUBCADENA = range(5)
+
+def normalizar(texto) -> str:
+    """Minúsculas, sin acentos y con espacios simples"""
+    if texto is None:
+        return ""
+    texto = str(texto)
+    if texto.isascii():
+        return " ".join(texto.lower().split())
+    texto = unicodedata.normalize("NFKD", texto)
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.lower().split())
+
+def _trigramas(texto: str) -> set:
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+class IndiceBusqueda:
+    """Índice de prefijos + trigramas sobre nombre, código y categoría"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs: Dict[int, tuple] = {}   # id -> (producto, nombre, codigo, categoria, tokens)
+        self._prefijos: List[List[tuple]] = [[] for _ in range(4)]
+        self._trigramas: Dict[str, set] = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    # ------------------------------------------------------------- mantenimiento
+    def reconstruir(self, productos: Iterable[Dict[str, Any]]):
+        with self._lock:
+            self._docs = {}
+            self._prefijos = [[] for _ in range(4)]
+            self._trigramas = {}
+            for p in productos:
+                self._agregar(p, ordenado=False)
+            for arreglo in self._prefijos:
+                arreglo.sort()
+
+    def actualizar(self, productos: Iterable[Dict[str, Any]]):
+        """Alta o modificación incremental de productos"""
+        with self._lock:
+            for p in productos:
+                self._quitar(p['id'])
+                self._agregar(p, ordenado=True)
+
+    def _tokens(self, nombre: str, codigo: str, categoria: str) -> List[tuple]:
+        tokens = []
+        if codigo:
+            tokens.append((_CODIGO, codigo))
+        if nombre:
+            tokens.append((_NOMBRE, nombre))
+            tokens.extend((_PALABRA, palabra) for palabra in set(nombre.split()[1:]))
+        if categoria:
+            tokens.append((_CATEGORIA, categoria))
+        return tokens
+
+    def _agregar(self, p: Dict[str, Any], ordenado: bool):
+        pid = p['id']
+        nombre = normalizar(p.get('nombre'))
+        codigo = normalizar(p.get('codigo_barras'))
+        categoria = normalizar(p.get('categoria'))
+        tokens = self._tokens(nombre, codigo, categoria)
+        self._docs[pid] = (p, nombre, codigo, categoria, tokens)
+
+        for nivel, token in tokens:
+            if ordenado:
+                bisect.insort(self._prefijos[nivel], (token, pid))
+            else:
+                self._prefijos[nivel].append((token, pid))
+        for campo in (nombre, codigo, categoria):
+            for tri in _trigramas(campo):
+                self._trigramas.setdefault(tri, set()).add(pid)
+
+    def _quitar(self, pid: int):
+        doc = self._docs.pop(pid, None)
+        if doc is None:
+            return
+        _, nombre, codigo, categoria, tokens = doc
+        for nivel, token in tokens:
+            arreglo = self._prefijos[nivel]
+            i = bisect.bisect_left(arreglo, (token, pid))
+            if i < len(arreglo) and arreglo[i] == (token, pid):
+                del arreglo[i]
+        for campo in (nombre, codigo, categoria):
+            for tri in _trigramas(campo):
+                posting = self._trigramas.get(tri)
+                if posting is not None:
+                    posting.discard(pid)
+                    if not posting:
+                        del self._trigramas[tri]
+
+    # ------------------------------------------------------------------ consulta
+    def buscar(self, query: str, limite: Optional[int] = 10,
+               filtro: Optional[Callable[[Dict[str, Any]], bool]] = None,
+               incluir_categoria: bool = False) -> List[Dict[str, Any]]:
+        """
+        Productos que coinciden con query, mejores primero: código, inicio del
+        nombre, inicio de otra palabra, (categoría) y por último coincidencias
+        en medio del texto. limite=None devuelve todas.
+        """
+        q = normalizar(query)
+        if not q:
+            return []
+        with self._lock:
+            resultados: List[Dict[str, Any]] = []
+            vistos = set()
+
+            def completo():
+                return limite is not None and len(resultados) >= limite
+
+            niveles = (_CODIGO, _NOMBRE, _PALABRA, _CATEGORIA) if incluir_categoria \
+                else (_CODIGO, _NOMBRE, _PALABRA)
+            for nivel in niveles:
+                arreglo = self._prefijos[nivel]
+                i = bisect.bisect_left(arreglo, (q,))
+                while i < len(arreglo) and not completo():
+                    token, pid = arreglo[i]
+                    if not token.startswith(q):
+                        break
+                    i += 1
+                    if pid in vistos:
+                        continue
+                    vistos.add(pid)
+                    producto = self._docs[pid][0]
+                    if filtro is None or filtro(producto):
+                        resultados.append(producto)
+                if completo():
+                    return resultados
+
+            # Coincidencias en medio del texto (necesitan al menos un trigrama)
+            if len(q) < 3:
+                return resultados
+            postings = sorted((self._trigramas.get(tri, set()) for tri in _trigramas(q)), key=len)
+            if not postings or not postings[0]:
+                return resultados
+            candidatos = set(postings[0])
+            for posting in postings[1:]:
+                candidatos &= posting
+                if not candidatos:
+                    return resultados
+
+            extra = []
+            for pid in candidatos - vistos:
+                producto, nombre, codigo, categoria, _ = self._docs[pid]
+                if not (q in nombre or q in codigo or (incluir_categoria and q in categoria)):
+                    continue
+                if filtro is None or filtro(producto):
+                    extra.append((nombre, pid))
+            restantes = None if limite is None else limite - len(resultados)
+            extra = sorted(extra) if restantes is None else heapq.nsmallest(restantes, extra)
+            resultados.extend(self._docs[pid][0] for _, pid in extra)
+            return resultados
+
+def _orden(q: str, p: Dict[str, Any]) -> Optional[tuple]:
+    """Clave con que IndiceBusqueda.buscar ubicaría a p (sin categoría); None si no coincide"""
+    nombre = normalizar(p.get('nombre'))
+    codigo = normalizar(p.get('codigo_barras'))
+    if codigo.startswith(q):
+        return (_CODIGO, codigo, p['id'])
+    if nombre.startswith(q):
+        return (_NOMBRE, nombre, p['id'])
+    palabras = [palabra for palabra in nombre.split()[1:] if palabra.startswith(q)]
+    if palabras:
+        return (_PALABRA, min(palabras), p['id'])
+    if len(q) >= 3 and (q in nombre or q in codigo):
+        return (_SUBCADENA, nombre, p['id'])
+    return None
+
+def refinar(query: str, productos: Iterable[Dict[str, Any]],
+            limite: Optional[int] = 10) -> List[Dict[str, Any]]:
+    """
+    Filtrar y ordenar como IndiceBusqueda.buscar un conjunto ya obtenido para
+    una consulta más corta (sólo vale si ese conjunto estaba completo).
+    """
+    q = normalizar(query)
+    if not q:
+        return []
+    claves = []
+    for p in productos:
+        clave = _orden(q, p)
+        if clave is not None:
+            claves.append((clave, p))
+    claves.sort(key=lambda par: par[0])
+    if limite is not None:
+        claves = claves[:limite]
+    return [p for _, p in claves]
+
+class CacheSugerencias:
+    """
+    Resultados recientes del autocompletado por consulta (una instancia por
+    filtro). Si la consulta extiende a otra cuyo resultado estaba completo
+    (menos que el límite), se filtra ese resultado en vez de volver a buscar.
+    """
+
+    def __init__(self, limite: int = 10, capacidad: int = 64, ttl: float = 30.0):
+        self.limite = limite
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self._entradas: "OrderedDict[str, tuple]" = OrderedDict()  # q -> (momento, resultados)
+        self._version = None
+
+    def obtener(self, query: str, version: int) -> Optional[List[Dict[str, Any]]]:
+        """Resultados para query sin buscar en el índice; None si no se puede"""
+        q = normalizar(query)
+        if not q or not self._vigente(version):
+            return None
+        entrada = self._leer(q)
+        if entrada is not None:
+            return entrada
+        # Prefijo más largo ya resuelto por completo. Con menos de 3
+        # caracteres el índice no devuelve coincidencias en medio del texto,
+        # así que esos resultados sólo sirven para consultas igual de cortas.
+        for fin in range(len(q) - 1, 0, -1):
+            if fin < 3 <= len(q):
+                break
+            base = self._leer(q[:fin])
+            if base is not None and len(base) < self.limite:
+                resultados = refinar(q, base, self.limite)
+                self.guardar(q, version, resultados)
+                return resultados
+        return None
+
+    def guardar(self, query: str, version: int, resultados: List[Dict[str, Any]]):
+        q = normalizar(query)
+        if not q:
+            return
+        self._vigente(version)
+        self._entradas[q] = (time.monotonic(), list(resultados))
+        self._entradas.move_to_end(q)
+        while len(self._entradas) > self.capacidad:
+            self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        self._entradas.clear()
+
+    def _vigente(self, version: int) -> bool:
+        if version != self._version:
+            self._entradas.clear()
+            self._version = version
+            return False
+        return True
+
+    def _leer(self, q: str) -> Optional[List[Dict[str, Any]]]:
+        entrada = self._entradas.get(q)
+        if entrada is None:
+            return None
+        momento, resultados = entrada
+        if time.monotonic() - momento > self.ttl:
+            del self._entradas[q]
+            return None
+        self._entradas.move_to_end(q)
+        return resultados
+
+_indice = None
+_indice_lock = threading.Lock()
+
+def get_indice() -> IndiceBusqueda:
+    """Índice compartido, enganchado a las cargas y deltas del catálogo"""
+    global _indice
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                indice = IndiceBusqueda()
+                catalogo = get_catalogo()
+                construido = []
+
+                def _on_catalogo(filas, completo):
+                    if completo:
+                        indice.reconstruir(filas)
+                        construido.append(True)
+                    else:
+                        indice.actualizar(filas)
+
+                catalogo.suscribir(_on_catalogo)
+                productos = catalogo.productos()
+                if not construido:
+                    # El catálogo ya estaba cargado antes de suscribirnos
+                    indice.reconstruir(productos)
+                _indice = indice
+    return _indice
+
+def buscar_productos(query: str, limite: Optional[int] = 10,
+                     filtro: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                     incluir_categoria: bool = False) -> List[Dict[str, Any]]:
+    """Buscar en el catálogo aplicando antes los cambios pendientes del servidor"""
+    indice = get_indice()
+    get_catalogo().sincronizar()
+    return indice.buscar(query, limite=limite, filtro=filtro, incluir_categoria=incluir_categoria)
@@ -0,0 +1,428 @@
+"""
+Caché en memoria del catálogo de productos compartida por todo el proceso.
+
+Se carga una vez y después sólo trae las filas cuya fecha_modificacion cambió
+desde la última sincronización (o altas nuevas), así autocompletado,
+dashboard y pestañas de productos/categorías no releen la tabla entera.
+
+Además se guarda una copia local (snapshot) para que el próximo arranque
+lea el catálogo del disco y sólo pida al servidor los cambios.
+
+Las filas son repos.Fila (con __slots__, de sólo lectura) para que el
+catálogo entero ocupe varias veces menos que con un dict por producto.
+"""
+
+import atexit
+import io
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+import logging
+from typing import List, Dict, Any, Optional, Callable
+
+from config import SERVER, DATABASE
+from repos import ProductoRepo, CategoriaRepo, suscribir_cambios, clase_fila
+
+logger = logging.getLogger("Catalogo")
+
+# Segundos que una lectura puede servirse sin consultar cambios al servidor
+STALENESS_SEGUNDOS = 30.0
+
+# Copia local del catálogo para arrancar sin traerlo entero del servidor
+SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.catalogo.snapshot')
+PERSIST_SNAPSHOT = True
+SNAPSHOT_MAX_EDAD = 7 * 24 * 3600.0   # más vieja que esto se descarta
+SNAPSHOT_INTERVALO = 300.0            # segundos mínimos entre grabaciones por deltas
+
+_SNAPSHOT_MAGIA = b"KPCAT"
+_SNAPSHOT_FORMATO = 1
+_SNAPSHOT_CABECERA = struct.Struct(">5sHIQ")   # magia, formato, crc32 y largo del contenido
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    """Sólo admite los tipos que aparecen en las filas del catálogo"""
+
+    _PERMITIDOS = {("decimal", "Decimal"), ("datetime", "datetime"), ("datetime", "date")}
+
+    def find_class(self, module, name):
+        if (module, name) in self._PERMITIDOS:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"Tipo no permitido en el snapshot: {module}.{name}")
+
+def _origen() -> str:
+    return f"{SERVER}/{DATABASE}"
+
+def _escribir_snapshot(filas: List[Dict[str, Any]], firma_categorias):
+    """Filas como columnas + tuplas, con cabecera de formato y checksum (escritura atómica)"""
+    columnas = list(filas[0].keys()) if filas else []
+    datos = {
+        "origen": _origen(),
+        "guardado": time.time(),
+        "categorias": firma_categorias,
+        "columnas": columnas,
+        "filas": [tuple(p[c] for c in columnas) for p in filas],
+    }
+    contenido = pickle.dumps(datos, protocol=pickle.HIGHEST_PROTOCOL)
+    cabecera = _SNAPSHOT_CABECERA.pack(_SNAPSHOT_MAGIA, _SNAPSHOT_FORMATO,
+                                       zlib.crc32(contenido), len(contenido))
+    tmp = SNAPSHOT_FILE + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(cabecera)
+        f.write(contenido)
+    os.replace(tmp, SNAPSHOT_FILE)
+
+def _leer_snapshot() -> Optional[Dict[str, Any]]:
+    """Contenido del snapshot; None si no hay, ValueError si está corrupto o no sirve"""
+    try:
+        f = open(SNAPSHOT_FILE, 'rb')
+    except OSError:
+        return None
+    with f:
+        tamano = os.fstat(f.fileno()).st_size
+        if tamano < _SNAPSHOT_CABECERA.size:
+            raise ValueError("archivo truncado")
+        magia, formato, crc, largo = _SNAPSHOT_CABECERA.unpack(f.read(_SNAPSHOT_CABECERA.size))
+        if magia != _SNAPSHOT_MAGIA:
+            raise ValueError("no es un snapshot del catálogo")
+        if formato != _SNAPSHOT_FORMATO:
+            raise ValueError(f"formato {formato} no soportado")
+        if _SNAPSHOT_CABECERA.size + largo != tamano:
+            raise ValueError("largo inconsistente")
+        contenido = f.read(largo)
+    if zlib.crc32(contenido) != crc:
+        raise ValueError("checksum inválido")
+    try:
+        datos = _SnapshotUnpickler(io.BytesIO(contenido)).load()
+    except Exception as e:
+        raise ValueError(f"contenido ilegible: {e}")
+    if datos.get("origen") != _origen():
+        raise ValueError("snapshot de otra base de datos")
+    if time.time() - datos.get("guardado", 0) > SNAPSHOT_MAX_EDAD:
+        raise ValueError("snapshot vencido")
+    return datos
+
+def _borrar_snapshot():
+    try:
+        os.remove(SNAPSHOT_FILE)
+    except OSError:
+        pass
+
+class CatalogoCache:
+    """Catálogo de productos en memoria con refresco incremental"""
+
+    def __init__(self, staleness: float = STALENESS_SEGUNDOS):
+        self.staleness = staleness
+        self._lock = threading.RLock()
+        self._productos: Dict[int, Dict[str, Any]] = {}
+        self._por_codigo: Dict[str, Dict[str, Any]] = {}
+        self._ordenados: Optional[List[Dict[str, Any]]] = None
+        self._marca = None          # mayor fecha_modificacion vista (reloj del servidor)
+        self._max_id = 0
+        self._ultima_sync = 0.0
+        self._cargado = False
+        self._invalidado = False
+        self._version = 0
+        self._oyentes: List[Callable[[List[Dict[str, Any]], bool], None]] = []
+        self._stats = {"hits": 0, "misses": 0, "refrescos": 0, "filas_delta": 0,
+                       "codigo_hits": 0, "codigo_misses": 0}
+        self._snapshot_probado = not PERSIST_SNAPSHOT
+        self._snapshot_version = None
+        self._snapshot_momento = 0.0
+        self._firma_categorias = None
+        self._conteos = None        # (version, categorías con conteo de productos)
+        suscribir_cambios(self._on_cambio_repo)
+        atexit.register(self.guardar_snapshot, True)
+
+    # ------------------------------------------------------------------ lectura
+    def productos(self) -> List[Dict[str, Any]]:
+        """Todos los productos ordenados por nombre (no modificar las filas)"""
+        with self._lock:
+            self._asegurar_fresco()
+            if self._ordenados is None:
+                self._ordenados = sorted(self._productos.values(),
+                                         key=lambda p: (p['nombre'] or '').lower())
+            return self._ordenados
+
+    def categorias_con_conteos(self) -> List[Dict[str, Any]]:
+        """
+        CategoriaRepo.listar_con_conteos, reusado mientras no cambie la versión
+        del catálogo. Sin catálogo cargado se consulta siempre: no vale la pena
+        traer todos los productos para esto.
+        """
+        with self._lock:
+            if not self._cargado:
+                return CategoriaRepo.listar_con_conteos()
+            self._asegurar_fresco()
+            if self._conteos is None or self._conteos[0] != self._version:
+                self._conteos = (self._version, CategoriaRepo.listar_con_conteos())
+            return self._conteos[1]
+
+    def obtener(self, producto_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._asegurar_fresco()
+            return self._productos.get(producto_id)
+
+    def buscar_por_codigo(self, codigo_barras: str) -> Optional[Dict[str, Any]]:
+        """
+        Búsqueda exacta para el lector: sale del índice en memoria sin
+        consultar cambios al servidor (de eso se encargan las demás lecturas);
+        sólo si el código no está se consulta ProductoRepo.buscar_por_codigo.
+        """
+        with self._lock:
+            if not self._cargado:
+                self._stats["misses"] += 1
+                self._carga_completa()
+            producto = self._por_codigo.get(codigo_barras)
+            if producto is not None:
+                self._stats["codigo_hits"] += 1
+                return producto
+            self._stats["codigo_misses"] += 1
+
+        producto = ProductoRepo.buscar_por_codigo(codigo_barras)
+        if producto is not None:
+            with self._lock:
+                anterior = self._productos.get(producto['id'])
+                if anterior != producto:
+                    self._indexar(producto, anterior)
+                    self._cambio([producto], completo=False)
+        return producto
+
+    def buscar_por_codigo_local(self, codigo_barras: str) -> Optional[Dict[str, Any]]:
+        """
+        Sólo el índice en memoria y sin bloquear: None si el catálogo no está
+        cargado, lo está actualizando otro hilo o el código no figura.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if not self._cargado:
+                return None
+            producto = self._por_codigo.get(codigo_barras)
+            if producto is not None:
+                self._stats["codigo_hits"] += 1
+            return producto
+        finally:
+            self._lock.release()
+
+    def obtener_local(self, producto_id: int) -> Optional[Dict[str, Any]]:
+        """Como buscar_por_codigo_local, por id: sin consultar al servidor ni bloquear"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            return self._productos.get(producto_id) if self._cargado else None
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        with self._lock:
+            self._asegurar_fresco()
+            return len(self._productos)
+
+    def sincronizar(self):
+        """Cargar o aplicar cambios si la caché está vencida o invalidada"""
+        with self._lock:
+            self._asegurar_fresco()
+
+    @property
+    def version(self) -> int:
+        """Se incrementa cada vez que cambia alguna fila"""
+        return self._version
+
+    # ------------------------------------------------------------ sincronización
+    def refrescar(self, forzar: bool = False):
+        """Aplicar los cambios del servidor; forzar=True recarga todo"""
+        with self._lock:
+            if forzar or not self._cargado:
+                self._carga_completa()
+            else:
+                self._carga_delta()
+
+    def invalidar(self, completo: bool = False):
+        """La próxima lectura consulta al servidor sin esperar el staleness"""
+        with self._lock:
+            if completo:
+                self._cargado = False
+            self._invalidado = True
+
+    def suscribir(self, callback: Callable[[List[Dict[str, Any]], bool], None]):
+        """callback(filas_cambiadas, completo) tras cada carga o delta con cambios"""
+        with self._lock:
+            self._oyentes.append(callback)
+
+    def _asegurar_fresco(self):
+        if not self._cargado:
+            self._stats["misses"] += 1
+            self._carga_completa()
+        elif self._invalidado or time.monotonic() - self._ultima_sync > self.staleness:
+            self._stats["hits"] += 1
+            self._carga_delta()
+        else:
+            self._stats["hits"] += 1
+
+    def _carga_completa(self):
+        # El primer arranque intenta leer la copia local
+        if not self._snapshot_probado:
+            self._snapshot_probado = True
+            if self._carga_desde_snapshot():
+                return
+        self._carga_servidor()
+
+    def _carga_servidor(self):
+        firma = None
+        if PERSIST_SNAPSHOT:
+            try:
+                firma = ProductoRepo.firma_catalogo()
+            except Exception as e:
+                logger.warning(f"No se pudo leer la firma del catálogo: {e}")
+        # Por streaming: nunca están a la vez en memoria todas las filas del
+        # driver y todas las Fila ya armadas
+        filas = []
+        for lote in ProductoRepo.iterar_catalogo(filas="compacta", lotes=True):
+            filas.extend(lote)
+        self._instalar(filas)
+        self._firma_categorias = firma['categorias'] if firma else None
+        logger.info(f"Catálogo cargado: {len(filas)} productos")
+        self.guardar_snapshot(forzar=True)
+
+    def _carga_desde_snapshot(self) -> bool:
+        """Arrancar desde la copia local y aplicar sólo los cambios; False si no sirve"""
+        inicio = time.perf_counter()
+        try:
+            datos = _leer_snapshot()
+        except Exception as e:
+            logger.warning(f"Snapshot del catálogo descartado: {e}")
+            _borrar_snapshot()
+            return False
+        if datos is None:
+            return False
+
+        try:
+            firma = ProductoRepo.firma_catalogo()
+        except Exception as e:
+            # Sin servidor igual se puede vender con la copia local
+            logger.warning(f"Catálogo desde snapshot sin verificar (servidor no disponible): {e}")
+            firma = None
+        if firma is not None and firma['categorias'] != datos['categorias']:
+            logger.info("Snapshot del catálogo descartado: cambiaron las categorías")
+            return False
+
+        clase = clase_fila(datos['columnas'])
+        self._instalar([clase(*fila) for fila in datos['filas']])
+        self._snapshot_version = self._version
+        self._snapshot_momento = time.monotonic()
+        if firma is None:
+            self._invalidado = True
+            return True
+
+        self._firma_categorias = firma['categorias']
+        self._carga_delta()
+        # Las bajas no aparecen en el delta: se detectan por cantidad y mayor id
+        if len(self._productos) != firma['cantidad'] or self._max_id != firma['max_id']:
+            logger.info("Snapshot del catálogo desactualizado: recarga completa")
+            return False
+        logger.info(f"Catálogo cargado desde snapshot: {len(self._productos)} productos "
+                    f"en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+        return True
+
+    def _instalar(self, filas: List[Dict[str, Any]]):
+        self._productos = {p['id']: p for p in filas}
+        self._por_codigo = {p['codigo_barras']: p for p in filas if p.get('codigo_barras')}
+        self._marca = None
+        self._max_id = 0
+        for p in filas:
+            self._avanzar_marca(p)
+        self._cargado = True
+        self._marcar_sync()
+        self._cambio(filas, completo=True)
+
+    def _carga_delta(self):
+        filas = ProductoRepo.listar_catalogo(desde=self._marca, desde_id=self._max_id, filas="compacta")
+        self._stats["refrescos"] += 1
+        self._marcar_sync()
+        cambiadas = []
+        for p in filas:
+            self._avanzar_marca(p)
+            anterior = self._productos.get(p['id'])
+            if anterior != p:
+                self._indexar(p, anterior)
+                cambiadas.append(p)
+        if cambiadas:
+            self._stats["filas_delta"] += len(cambiadas)
+            self._cambio(cambiadas, completo=False)
+            self.guardar_snapshot()
+
+    def guardar_snapshot(self, forzar: bool = False):
+        """Grabar la copia local si cambió (sin forzar, como mucho cada SNAPSHOT_INTERVALO)"""
+        if not PERSIST_SNAPSHOT:
+            return
+        with self._lock:
+            if not self._cargado or self._snapshot_version == self._version:
+                return
+            if not forzar and time.monotonic() - self._snapshot_momento < SNAPSHOT_INTERVALO:
+                return
+            try:
+                _escribir_snapshot(list(self._productos.values()), self._firma_categorias)
+            except Exception as e:
+                logger.warning(f"No se pudo guardar el snapshot del catálogo: {e}")
+                return
+            self._snapshot_version = self._version
+            self._snapshot_momento = time.monotonic()
+
+    def _indexar(self, p: Dict[str, Any], anterior: Optional[Dict[str, Any]]):
+        self._productos[p['id']] = p
+        if anterior and anterior.get('codigo_barras') and \
+                self._por_codigo.get(anterior['codigo_barras']) is anterior:
+            del self._por_codigo[anterior['codigo_barras']]
+        if p.get('codigo_barras'):
+            self._por_codigo[p['codigo_barras']] = p
+
+    def _avanzar_marca(self, p: Dict[str, Any]):
+        fecha = p.get('fecha_modificacion')
+        if fecha is not None and (self._marca is None or fecha > self._marca):
+            self._marca = fecha
+        if p['id'] > self._max_id:
+            self._max_id = p['id']
+
+    def _marcar_sync(self):
+        self._ultima_sync = time.monotonic()
+        self._invalidado = False
+
+    def _cambio(self, filas: List[Dict[str, Any]], completo: bool):
+        self._ordenados = None
+        self._version += 1
+        for callback in list(self._oyentes):
+            try:
+                callback(filas, completo)
+            except Exception as e:
+                logger.error(f"Error notificando cambios del catálogo: {e}")
+
+    def _on_cambio_repo(self, tabla: str, ids: Optional[List[int]]):
+        if tabla == "productos":
+            self.invalidar()
+        elif tabla == "categorias":
+            # El nombre de categoría viene del JOIN y no mueve fecha_modificacion
+            self.invalidar(completo=True)
+
+    # ------------------------------------------------------------------ métricas
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            datos = dict(self._stats)
+            datos["productos"] = len(self._productos)
+            datos["version"] = self._version
+            datos["edad_seg"] = time.monotonic() - self._ultima_sync if self._cargado else None
+        total = datos["hits"] + datos["misses"]
+        datos["hit_ratio"] = datos["hits"] / total if total else 0.0
+        return datos
+
+_catalogo = None
+_catalogo_lock = threading.Lock()
+
+def get_catalogo() -> CatalogoCache:
+    global _catalogo
+    if _catalogo is None:
+        with _catalogo_lock:
+            if _catalogo is None:
+                _catalogo = CatalogoCache()
+    return _catalogo
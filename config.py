@@ -1,31 +1,393 @@
-import pyodbc
-
-SERVER = r'localhost\SQLEXPRESS'
-DATABASE = 'KioskoDB'
-TRUSTED = True
-USER = 'sa'
-PASSWORD = 'yourStrong(!)Password'
-
-_DRIVERS = [
-    '{ODBC Driver 18 for SQL Server}',
-    '{ODBC Driver 17 for SQL Server}',
-    '{SQL Server Native Client 11.0}',
-    '{SQL Server}'
-]
-
-def _connect(database: str) -> pyodbc.Connection:
-    last_error = None
-    for drv in _DRIVERS:
-        try:
-            if TRUSTED:
-                conn_str = f'DRIVER={drv};SERVER={SERVER};DATABASE={database};Trusted_Connection=yes;Encrypt=no;'
-            else:
-                conn_str = f'DRIVER={drv};SERVER={SERVER};DATABASE={database};UID={USER};PWD={PASSWORD};Encrypt=no;'
-            return pyodbc.connect(conn_str, timeout=5)
-        except Exception as e:
-            last_error = e
-            continue
-    raise RuntimeError(f"No se pudo conectar a SQL Server. Último error: {last_error}")
-
-def get_connection() -> pyodbc.Connection:
-    return _connect(DATABASE)
+import os
+import threading
+import time
+
+import pyodbc
+
+SERVER = r'localhost\SQLEXPRESS'
+DATABASE = 'KioskoDB'
+TRUSTED = True
+USER = 'sa'
+PASSWORD = 'yourStrong(!)Password'
+
+_DRIVERS = [
+    '{ODBC Driver 18 for SQL Server}',
+    '{ODBC Driver 17 for SQL Server}',
+    '{SQL Server Native Client 11.0}',
+    '{SQL Server}'
+]
+
+# Driver ODBC resuelto: se guarda en un archivo local para saltear el sondeo al reiniciar
+DRIVER_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.odbc_driver')
+PERSIST_DRIVER = True
+
+# Pool de conexiones
+POOL_MAX_SIZE = 5             # conexiones abiertas como máximo por proceso
+POOL_TIMEOUT = 10.0           # segundos de espera por una conexión libre
+POOL_IDLE_TIMEOUT = 300.0     # se cierran las conexiones ociosas más de esto
+POOL_HEALTHCHECK_AFTER = 30.0 # se verifica con SELECT 1 si estuvo ociosa más de esto
+
+# Reintentos ante errores transitorios
+RETRY_INTENTOS = 3            # intentos en total
+RETRY_ESPERA = 0.2            # segundos antes del primer reintento; se duplica en cada uno
+VENTA_TIMEOUT = 10            # segundos por sentencia al grabar una venta (0 = sin límite)
+
+# SQLSTATE transitorios: víctima de deadlock, vínculo caído o reseteado, timeout
+_SQLSTATE_DEADLOCK = '40001'
+_SQLSTATE_TRANSITORIOS = (_SQLSTATE_DEADLOCK, '08S01', '08001', '08003', '08007', 'HYT00', 'HYT01')
+
+_driver_resuelto = None
+_driver_lock = threading.Lock()
+
+def _conn_str(drv: str, database: str) -> str:
+    if TRUSTED:
+        return f'DRIVER={drv};SERVER={SERVER};DATABASE={database};Trusted_Connection=yes;Encrypt=no;'
+    return f'DRIVER={drv};SERVER={SERVER};DATABASE={database};UID={USER};PWD={PASSWORD};Encrypt=no;'
+
+def _es_error_de_driver(e: Exception) -> bool:
+    """Errores del administrador ODBC (SQLSTATE IMxxx): driver inexistente o que no carga."""
+    sqlstate = e.args[0] if getattr(e, 'args', None) else ''
+    return isinstance(sqlstate, str) and sqlstate.startswith('IM')
+
+def _sqlstate(e: Exception) -> str:
+    sqlstate = e.args[0] if getattr(e, 'args', None) else ''
+    return sqlstate if isinstance(sqlstate, str) else ''
+
+def es_error_transitorio(e: Exception) -> bool:
+    """Errores de pyodbc que pueden salir bien al reintentar."""
+    return isinstance(e, pyodbc.Error) and _sqlstate(e) in _SQLSTATE_TRANSITORIOS
+
+def es_error_de_conexion(e: Exception) -> bool:
+    """No se pudo hablar con el servidor (conexión, login, driver): no es culpa de la consulta."""
+    return isinstance(e, pyodbc.Error) and _sqlstate(e)[:2] in ('08', '28', 'IM')
+
+def es_deadlock(e: Exception) -> bool:
+    """Víctima de deadlock: el servidor ya deshizo la transacción."""
+    return isinstance(e, pyodbc.Error) and _sqlstate(e) == _SQLSTATE_DEADLOCK
+
+def _leer_driver_persistido() -> str:
+    if not PERSIST_DRIVER:
+        return None
+    try:
+        with open(DRIVER_CACHE_FILE, encoding='utf-8') as f:
+            drv = f.read().strip()
+        return drv or None
+    except OSError:
+        return None
+
+def _guardar_driver_persistido(drv: str):
+    if not PERSIST_DRIVER:
+        return
+    try:
+        tmp = DRIVER_CACHE_FILE + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(drv)
+        os.replace(tmp, DRIVER_CACHE_FILE)
+    except OSError:
+        pass
+
+def _olvidar_driver():
+    global _driver_resuelto
+    _driver_resuelto = None
+    if PERSIST_DRIVER:
+        try:
+            os.remove(DRIVER_CACHE_FILE)
+        except OSError:
+            pass
+
+def _sondear_driver(database: str) -> pyodbc.Connection:
+    """Probar los drivers en orden (el persistido primero) y recordar el que funcione."""
+    global _driver_resuelto
+    candidatos = list(_DRIVERS)
+    persistido = _leer_driver_persistido()
+    if persistido:
+        candidatos = [persistido] + [d for d in candidatos if d != persistido]
+
+    last_error = None
+    for drv in candidatos:
+        try:
+            conn = pyodbc.connect(_conn_str(drv, database), timeout=5)
+        except Exception as e:
+            last_error = e
+            continue
+        _driver_resuelto = drv
+        if drv != persistido:
+            _guardar_driver_persistido(drv)
+        return conn
+    if isinstance(last_error, pyodbc.Error) and not _es_error_de_driver(last_error):
+        # Servidor inalcanzable: el error original, para que se pueda reintentar
+        raise last_error
+    raise RuntimeError(f"No se pudo conectar a SQL Server. Último error: {last_error}")
+
+def _connect(database: str) -> pyodbc.Connection:
+    drv = _driver_resuelto
+    if drv is not None:
+        try:
+            return pyodbc.connect(_conn_str(drv, database), timeout=5)
+        except Exception as e:
+            # Sólo se vuelve a sondear si falló el driver; un servidor caído
+            # fallaría igual con cualquier otro driver. El error de pyodbc se
+            # propaga tal cual: es_error_transitorio lo reconoce (08001).
+            if not _es_error_de_driver(e):
+                raise
+            with _driver_lock:
+                if _driver_resuelto == drv:
+                    _olvidar_driver()
+
+    with _driver_lock:
+        if _driver_resuelto is not None:
+            return pyodbc.connect(_conn_str(_driver_resuelto, database), timeout=5)
+        return _sondear_driver(database)
+
+def driver_actual() -> str:
+    """Driver ODBC en uso (None si todavía no se conectó)."""
+    return _driver_resuelto
+
+class _PooledConnection:
+    """Conexión prestada por el pool: close() la devuelve en lugar de cerrarla."""
+
+    __slots__ = ('_pool', '_raw', '_refs')
+
+    def __init__(self, pool, raw):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_raw', raw)
+        object.__setattr__(self, '_refs', 1)
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise RuntimeError("La conexión ya fue devuelta al pool")
+        return getattr(self._raw, name)
+
+    def __setattr__(self, name, value):
+        if name in _PooledConnection.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._raw, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Igual que pyodbc: commit si no hubo error, rollback si lo hubo
+        try:
+            if self._raw is not None:
+                if exc_type is None:
+                    self._raw.commit()
+                else:
+                    self._raw.rollback()
+        finally:
+            self.close()
+        return False
+
+    def close(self):
+        if self._raw is not None:
+            self._pool._release(self)
+
+class ConnectionPool:
+    """
+    Pool acotado y thread-safe de conexiones pyodbc.
+    Cada hilo tiene a lo sumo una conexión prestada: las llamadas anidadas
+    a acquire() en el mismo hilo reutilizan la misma conexión.
+    """
+
+    def __init__(self, factory, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                 idle_timeout=POOL_IDLE_TIMEOUT, healthcheck_after=POOL_HEALTHCHECK_AFTER):
+        self._factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.healthcheck_after = healthcheck_after
+        self._cond = threading.Condition()
+        self._idle = []      # [(conexion, ultimo_uso)] - se reutiliza la más reciente
+        self._abiertas = 0
+        self._local = threading.local()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "esperas": 0,
+            "espera_total_ms": 0.0,
+            "espera_max_ms": 0.0,
+            "timeouts": 0,
+            "descartadas": 0,
+        }
+
+    def acquire(self, exclusiva: bool = False) -> _PooledConnection:
+        """
+        exclusiva=True presta una conexión propia aunque el hilo ya tenga una
+        (p. ej. para un cursor que queda abierto mientras se itera: SQL Server
+        no admite otra consulta en la misma conexión hasta leerlo entero).
+        """
+        actual = None if exclusiva else getattr(self._local, 'conn', None)
+        if actual is not None and actual._raw is not None:
+            actual._refs += 1
+            with self._cond:
+                self._stats["hits"] += 1
+            return actual
+
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+        raw = None
+        ultimo_uso = 0.0
+        expiradas = []
+        esperado = False
+        with self._cond:
+            while True:
+                expiradas.extend(self._evict_idle_locked())
+                if self._idle:
+                    raw, ultimo_uso = self._idle.pop()
+                    self._stats["hits"] += 1
+                    break
+                if self._abiertas < self.max_size:
+                    self._abiertas += 1
+                    self._stats["misses"] += 1
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._stats["timeouts"] += 1
+                    self._close_quietly(expiradas)
+                    raise RuntimeError(
+                        f"No hay conexiones libres en el pool ({self.max_size}) tras {self.timeout:.0f}s")
+                esperado = True
+                self._cond.wait(restante)
+            espera_ms = (time.monotonic() - inicio) * 1000
+            if esperado:
+                self._stats["esperas"] += 1
+            self._stats["espera_total_ms"] += espera_ms
+            self._stats["espera_max_ms"] = max(self._stats["espera_max_ms"], espera_ms)
+        self._close_quietly(expiradas)
+
+        if raw is not None and time.monotonic() - ultimo_uso > self.healthcheck_after:
+            if not self._is_alive(raw):
+                self._close_quietly([raw])
+                with self._cond:
+                    self._stats["descartadas"] += 1
+                raw = None
+
+        if raw is None:
+            try:
+                raw = self._factory()
+            except Exception:
+                with self._cond:
+                    self._abiertas -= 1
+                    self._cond.notify()
+                raise
+
+        proxy = _PooledConnection(self, raw)
+        if not exclusiva:
+            self._local.conn = proxy
+        return proxy
+
+    def _release(self, proxy: _PooledConnection):
+        proxy._refs -= 1
+        if proxy._refs > 0:
+            return
+        raw = proxy._raw
+        proxy._raw = None
+        if getattr(self._local, 'conn', None) is proxy:
+            self._local.conn = None
+
+        sana = True
+        try:
+            # Deja la conexión limpia para el próximo hilo
+            raw.rollback()
+            raw.autocommit = False
+        except Exception:
+            sana = False
+
+        with self._cond:
+            if sana:
+                self._idle.append((raw, time.monotonic()))
+            else:
+                self._abiertas -= 1
+                self._stats["descartadas"] += 1
+            self._cond.notify()
+        if not sana:
+            self._close_quietly([raw])
+
+    def _evict_idle_locked(self):
+        ahora = time.monotonic()
+        vivas, expiradas = [], []
+        for raw, ultimo_uso in self._idle:
+            if ahora - ultimo_uso > self.idle_timeout:
+                expiradas.append(raw)
+            else:
+                vivas.append((raw, ultimo_uso))
+        if expiradas:
+            self._idle = vivas
+            self._abiertas -= len(expiradas)
+        return expiradas
+
+    @staticmethod
+    def _is_alive(raw) -> bool:
+        try:
+            cur = raw.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conexiones):
+        for raw in conexiones:
+            try:
+                raw.close()
+            except Exception:
+                pass
+
+    def precalentar(self, cantidad: int = 2):
+        """Abrir conexiones por adelantado hasta tener 'cantidad' ociosas (sin pasar max_size)."""
+        for _ in range(cantidad):
+            with self._cond:
+                if len(self._idle) >= cantidad or self._abiertas >= self.max_size:
+                    return
+                self._abiertas += 1
+            try:
+                raw = self._factory()
+            except Exception:
+                with self._cond:
+                    self._abiertas -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((raw, time.monotonic()))
+                self._cond.notify()
+
+    def close_all(self):
+        """Cerrar todas las conexiones ociosas (las prestadas se cierran al devolverse)."""
+        with self._cond:
+            ociosas = [raw for raw, _ in self._idle]
+            self._idle = []
+            self._abiertas -= len(ociosas)
+            self._cond.notify_all()
+        self._close_quietly(ociosas)
+
+    def stats(self) -> dict:
+        with self._cond:
+            datos = dict(self._stats)
+            datos["abiertas"] = self._abiertas
+            datos["ociosas"] = len(self._idle)
+            datos["max_size"] = self.max_size
+        total = datos["hits"] + datos["misses"]
+        datos["hit_ratio"] = datos["hits"] / total if total else 0.0
+        datos["espera_prom_ms"] = datos["espera_total_ms"] / total if total else 0.0
+        return datos
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(lambda: _connect(DATABASE))
+    return _pool
+
+def get_connection(exclusiva: bool = False) -> _PooledConnection:
+    return get_pool().acquire(exclusiva)
+
+def pool_stats() -> dict:
+    """Contadores del pool (hits/misses/tiempos de espera) para dimensionarlo."""
+    return get_pool().stats()
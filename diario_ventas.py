@@ -0,0 +1,258 @@
+"""
+Diario local de ventas (SQLite en modo WAL).
+
+Las ventas se graban primero acá, con un id generado en la PC, y se confirman
+al cajero sin esperar a SQL Server. Un hilo de fondo las reenvía en orden a
+VentaRepo.crear_venta usando ese id como clave de idempotencia, así un reenvío
+después de un corte nunca duplica la venta.
+
+Estados: PENDIENTE (falta enviarla), SINCRONIZADA (ya está en el servidor,
+con su venta_id), CONFLICTO (el servidor la rechazó: stock, producto borrado,
+dato inválido; queda para revisar y reintentar o descartar a mano) y
+DESCARTADA (conflicto que el cajero decidió no enviar).
+"""
+
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from typing import List, Dict, Any, Optional
+
+import pyodbc
+
+from config import es_error_transitorio, es_error_de_conexion
+from repos import VentaRepo
+
+logger = logging.getLogger("DiarioVentas")
+
+DIARIO_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.ventas_diario.db')
+
+PENDIENTE = "PENDIENTE"
+SINCRONIZADA = "SINCRONIZADA"
+CONFLICTO = "CONFLICTO"
+DESCARTADA = "DESCARTADA"
+
+INTERVALO = 5.0          # segundos entre pasadas sin ventas nuevas
+ESPERA_MAX = 300.0       # tope del backoff cuando el servidor no responde
+LOTE = 50                # ventas por pasada
+DIAS_SINCRONIZADAS = 30  # las sincronizadas y descartadas se borran pasados estos días
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS ventas_locales (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    creada TEXT NOT NULL,
+    punto_venta_id INTEGER NOT NULL,
+    forma_pago TEXT NOT NULL,
+    descuento REAL NOT NULL,
+    items TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    venta_id INTEGER,
+    error TEXT,
+    actualizada TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_ventas_locales_estado ON ventas_locales (estado, seq);
+"""
+
+def nueva_clave() -> str:
+    """Clave de idempotencia para una venta (también es su id local)"""
+    return uuid.uuid4().hex
+
+def es_rechazo(e: Exception) -> bool:
+    """
+    El servidor rechazó esta venta en particular (stock, clave foránea, dato
+    inválido): reenviarla igual no la arregla. Los errores transitorios y los
+    que no vienen del servidor (sin conexión, falta una migración) no lo son.
+    """
+    if isinstance(e, ValueError):
+        return True
+    return isinstance(e, pyodbc.Error) and not (es_error_transitorio(e) or es_error_de_conexion(e))
+
+def _ahora() -> str:
+    return datetime.datetime.now().isoformat(sep=' ', timespec='milliseconds')
+
+def _antiguedad(creada: str) -> float:
+    """
+    Segundos desde que se grabó la venta. Se mide con el reloj de la PC de
+    punta a punta y el servidor la resta de su propia hora: un reloj de PC
+    adelantado o atrasado no cambia la fecha de la venta.
+    """
+    return max(0.0, (datetime.datetime.now() - datetime.datetime.fromisoformat(creada)).total_seconds())
+
+class DiarioVentas:
+    """Diario durable de ventas con su hilo de sincronización"""
+
+    def __init__(self, ruta: str = DIARIO_FILE):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        # Autocommit: cada sentencia es su propia transacción durable
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(_ESQUEMA)
+        self._despertar = threading.Event()
+        self._detenido = False
+        self._hilo = None
+        self._espera = INTERVALO
+
+    # ------------------------------------------------------------------ ventas
+    def registrar(self, punto_venta_id: int, items: List[Dict[str, Any]],
+                  forma_pago: str = "EFECTIVO", descuento: float = 0.0,
+                  clave: Optional[str] = None) -> str:
+        """
+        Grabar la venta en el diario y devolver su id local. clave: la del
+        carrito; registrar dos veces la misma clave graba la venta una sola vez.
+        """
+        local_id = clave or nueva_clave()
+        with self._lock:
+            self._conn.execute("""
+                INSERT OR IGNORE INTO ventas_locales (id, creada, punto_venta_id, forma_pago, descuento, items, estado)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (local_id, _ahora(), punto_venta_id, forma_pago, float(descuento),
+                  json.dumps(items, default=float), PENDIENTE))
+        self._despertar.set()
+        return local_id
+
+    def resumen(self) -> Dict[str, int]:
+        """Cantidad de ventas del diario por estado"""
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT estado, COUNT(*) FROM ventas_locales GROUP BY estado").fetchall()
+        datos = {PENDIENTE: 0, SINCRONIZADA: 0, CONFLICTO: 0, DESCARTADA: 0}
+        datos.update({estado: cantidad for estado, cantidad in filas})
+        return datos
+
+    def pendientes(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM ventas_locales WHERE estado = ?", (PENDIENTE,)).fetchone()[0]
+
+    def conflictos(self) -> List[Dict[str, Any]]:
+        """Ventas rechazadas por el servidor, con el motivo (en 'error')"""
+        with self._lock:
+            filas = self._conn.execute("""
+                SELECT id, creada, punto_venta_id, forma_pago, descuento, items, intentos, error
+                FROM ventas_locales WHERE estado = ? ORDER BY seq
+            """, (CONFLICTO,)).fetchall()
+        resultado = []
+        for fila in filas:
+            venta = dict(fila)
+            venta['items'] = json.loads(venta['items'])
+            resultado.append(venta)
+        return resultado
+
+    def reintentar(self, local_id: str):
+        """Volver a encolar una venta en conflicto (p. ej. después de corregir el stock)"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ventas_locales SET estado = ?, actualizada = ? WHERE id = ? AND estado = ?",
+                (PENDIENTE, _ahora(), local_id, CONFLICTO))
+        self._espera = INTERVALO
+        self._despertar.set()
+
+    def descartar(self, local_id: str):
+        """No enviar una venta en conflicto; queda en el diario como DESCARTADA"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ventas_locales SET estado = ?, actualizada = ? WHERE id = ? AND estado = ?",
+                (DESCARTADA, _ahora(), local_id, CONFLICTO))
+
+    def purgar(self, dias: int = DIAS_SINCRONIZADAS) -> int:
+        """Borrar las ventas sincronizadas o descartadas hace más de 'dias' días"""
+        limite = (datetime.datetime.now() - datetime.timedelta(days=dias)).isoformat(sep=' ')
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM ventas_locales WHERE estado IN (?, ?) AND actualizada < ?",
+                (SINCRONIZADA, DESCARTADA, limite))
+            return cur.rowcount
+
+    # ----------------------------------------------------------- sincronización
+    def sincronizar(self) -> int:
+        """
+        Enviar al servidor las ventas pendientes, en orden. Devuelve cuántas se
+        sincronizaron. Una venta rechazada (es_rechazo) pasa a CONFLICTO y la
+        pasada sigue con las demás; cualquier otro error corta la pasada, deja
+        la venta PENDIENTE y se propaga.
+        """
+        with self._lock:
+            filas = self._conn.execute("""
+                SELECT id, creada, punto_venta_id, forma_pago, descuento, items
+                FROM ventas_locales WHERE estado = ? ORDER BY seq LIMIT ?
+            """, (PENDIENTE, LOTE)).fetchall()
+
+        enviadas = 0
+        for fila in filas:
+            try:
+                venta_id = VentaRepo.crear_venta(
+                    fila['punto_venta_id'], json.loads(fila['items']),
+                    forma_pago=fila['forma_pago'], descuento=fila['descuento'],
+                    clave=fila['id'], antiguedad=_antiguedad(fila['creada']))
+            except Exception as e:
+                if not es_rechazo(e):
+                    self._marcar(fila['id'], PENDIENTE, error=str(e))
+                    raise
+                # Si quedara PENDIENTE trabaría a todas las que vienen detrás
+                logger.warning(f"Venta local {fila['id']} en conflicto: {e}")
+                self._marcar(fila['id'], CONFLICTO, error=str(e))
+                continue
+            self._marcar(fila['id'], SINCRONIZADA, venta_id=venta_id)
+            enviadas += 1
+        return enviadas
+
+    def _marcar(self, local_id: str, estado: str, venta_id: Optional[int] = None, error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute("""
+                UPDATE ventas_locales
+                SET estado = ?, venta_id = ?, error = ?, intentos = intentos + 1, actualizada = ?
+                WHERE id = ?
+            """, (estado, venta_id, error, _ahora(), local_id))
+
+    def iniciar(self):
+        """Lanzar el hilo de sincronización (sólo la primera vez)"""
+        with self._lock:
+            if self._hilo is not None:
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="diario-ventas", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._detenido = True
+        self._despertar.set()
+
+    def _bucle(self):
+        try:
+            self.purgar()
+        except sqlite3.Error as e:
+            logger.warning(f"No se pudo purgar el diario de ventas: {e}")
+        while not self._detenido:
+            self._despertar.wait(self._espera)
+            self._despertar.clear()
+            if self._detenido:
+                return
+            try:
+                while self.sincronizar() >= LOTE:
+                    pass
+                self._espera = INTERVALO
+            except Exception as e:
+                # Servidor caído o lento: se reintenta cada vez más espaciado
+                self._espera = min(self._espera * 2, ESPERA_MAX)
+                logger.warning(f"Sincronización de ventas pospuesta {self._espera:.0f}s: {e}")
+
+_diario = None
+_diario_lock = threading.Lock()
+
+def get_diario() -> DiarioVentas:
+    """Diario compartido, con la sincronización ya en marcha"""
+    global _diario
+    if _diario is None:
+        with _diario_lock:
+            if _diario is None:
+                diario = DiarioVentas()
+                diario.iniciar()
+                _diario = diario
+    return _diario
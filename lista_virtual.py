@@ -0,0 +1,305 @@
+"""
+Lista virtualizada sobre ttk.Treeview.
+
+El Treeview tiene sólo las filas que entran en pantalla; los datos quedan en
+una secuencia en memoria (lista de dicts o Fila) y al desplazarse se
+reescriben los valores de esas mismas filas. Filtrar y
+ordenar trabajan sobre la secuencia y no sobre el widget, así que cuesta lo
+mismo mostrar cien productos que cien mil.
+"""
+
+import tkinter as tk
+from tkinter import ttk
+from typing import Any, Callable, Optional, Sequence
+
+def _clave_orden(valor):
+    # None al final y texto sin distinguir mayúsculas
+    if valor is None:
+        return (1, "")
+    if isinstance(valor, str):
+        return (0, valor.lower())
+    return (0, valor)
+
+class ListaVirtual(ttk.Frame):
+    """
+    columnas: [(col_id, encabezado, ancho, anchor, campo, formato), ...]
+    'campo' es la clave de la fila que se muestra (y por la que se ordena al
+    hacer clic en el encabezado); 'formato' convierte el valor a texto.
+    tags_fila(fila, posicion) agrega tags a las de estría even/odd.
+    al_final() se llama al acercarse a la última fila (para paginar).
+    al_ordenar(campo, descendente) reemplaza el orden local: para datos
+    paginados, que sólo se pueden ordenar en el servidor (campo None = sin orden).
+    """
+
+    ALTO_FILA = 20          # se corrige midiendo la primera fila
+    ALTO_ENCABEZADO = 25
+    MARGEN_FINAL = 20       # filas antes del final en que se llama a al_final
+    FILAS_RUEDA = 3
+
+    def __init__(self, parent, columnas, height: int = 15,
+                 tags_fila: Optional[Callable[[Any, int], tuple]] = None,
+                 al_final: Optional[Callable[[], None]] = None,
+                 al_ordenar: Optional[Callable[[Optional[str], bool], None]] = None):
+        super().__init__(parent)
+        self._columnas = [tuple(c) + (None,) * (6 - len(c)) for c in columnas]
+        self._tags_fila = tags_fila
+        self.al_final = al_final
+        self.al_ordenar = al_ordenar
+        self._orden_servidor = None      # orden que muestran los encabezados con al_ordenar
+        self._datos: Sequence = []
+        self._vista: Sequence = []
+        self._datos_propios = False      # agregar() no modifica listas ajenas
+        self._filtro: Optional[Callable[[Any], bool]] = None
+        self._orden = None               # (col_id, descendente)
+        self._inicio = 0
+        self._visibles = height
+        self._sel_idx: Optional[int] = None
+        self._sel_fila = None
+        self._mensaje = False
+        self._alto_fila = self.ALTO_FILA
+        self._alto_encabezado = self.ALTO_ENCABEZADO
+
+        self.tree = ttk.Treeview(self, columns=[c[0] for c in self._columnas], show="headings",
+                                 height=height, selectmode="browse")
+        for col_id, encabezado, ancho, anchor, _, _ in self._columnas:
+            self.tree.heading(col_id, text=encabezado, command=lambda c=col_id: self._on_encabezado(c))
+            self.tree.column(col_id, width=ancho, anchor=anchor)
+
+        self.v_scroll = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.h_scroll = ttk.Scrollbar(self, orient="horizontal", command=self.tree.xview)
+        self.tree.configure(xscrollcommand=self.h_scroll.set)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.v_scroll.grid(row=0, column=1, sticky="ns")
+        self.h_scroll.grid(row=1, column=0, sticky="ew")
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        self.tree.bind("<Configure>", self._on_configure)
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+        self.tree.bind("<MouseWheel>", self._on_rueda)
+        self.tree.bind("<Button-4>", lambda e: self._rueda(-self.FILAS_RUEDA))
+        self.tree.bind("<Button-5>", lambda e: self._rueda(self.FILAS_RUEDA))
+        for tecla, paso in (("<Up>", -1), ("<Down>", 1), ("<Prior>", "-pagina"),
+                            ("<Next>", "pagina"), ("<Home>", "inicio"), ("<End>", "fin")):
+            self.tree.bind(tecla, lambda e, p=paso: self._on_tecla(p))
+
+    # ------------------------------------------------------------------- datos
+    def set_datos(self, filas: Sequence):
+        """Reemplazar los datos (se mantienen filtro, orden y, si sigue, la selección)"""
+        self._datos = filas
+        self._datos_propios = False
+        self._recalcular(reiniciar=True)
+
+    def agregar(self, filas: Sequence):
+        """Sumar filas al final (p. ej. la página siguiente) sin perder la posición"""
+        if not filas:
+            return
+        if not self._datos_propios:
+            self._datos = list(self._datos)
+            self._datos_propios = True
+        self._datos.extend(filas)
+        if self._filtro is None and self._orden is None:
+            self._vista = self._datos
+            self._render()
+        else:
+            self._recalcular(reiniciar=False)
+
+    def filtrar(self, predicado: Optional[Callable[[Any], bool]]):
+        self._filtro = predicado
+        self._recalcular(reiniciar=True)
+
+    def ordenar(self, col_id: Optional[str], descendente: bool = False):
+        """Ordenar por una columna (None vuelve al orden de los datos)"""
+        self._orden = (col_id, descendente) if col_id is not None else None
+        self._actualizar_encabezados()
+        self._recalcular(reiniciar=False)
+
+    def filas(self) -> Sequence:
+        """Filas mostradas, en orden, después del filtro"""
+        return self._vista
+
+    def __len__(self):
+        return len(self._vista)
+
+    def seleccionada(self):
+        """Fila seleccionada o None"""
+        return self._sel_fila
+
+    def mostrar_mensaje(self, texto: str, col_id: Optional[str] = None):
+        """Vaciar la lista y mostrar un aviso en una fila (p. ej. 'Cargando...')"""
+        self._datos = []
+        self._datos_propios = False
+        self._vista = []
+        self._inicio = 0
+        self._sel_idx = self._sel_fila = None
+        self.tree.delete(*self.tree.get_children())
+        ids = [c[0] for c in self._columnas]
+        valores = ["" for _ in ids]
+        valores[ids.index(col_id) if col_id in ids else 0] = texto
+        self.tree.insert("", tk.END, iid="mensaje", values=valores)
+        self._mensaje = True
+        self.v_scroll.set(0.0, 1.0)
+
+    def _recalcular(self, reiniciar: bool):
+        datos = self._datos
+        if self._filtro is not None:
+            datos = [f for f in datos if self._filtro(f)]
+        if self._orden is not None:
+            col_id, descendente = self._orden
+            campo = self._campo(col_id)
+            datos = sorted(datos, key=lambda f: _clave_orden(f.get(campo)), reverse=descendente)
+        anterior = self._sel_fila
+        self._vista = datos
+        self._sel_idx = self._sel_fila = None
+        if anterior is not None:
+            for i, fila in enumerate(datos):
+                if fila is anterior:
+                    self._sel_idx, self._sel_fila = i, fila
+                    break
+        if reiniciar:
+            self._inicio = 0
+        self._render()
+
+    def _campo(self, col_id: str):
+        for columna in self._columnas:
+            if columna[0] == col_id:
+                return columna[4] if columna[4] is not None else col_id
+        raise KeyError(col_id)
+
+    # ------------------------------------------------------------------ render
+    def _valores(self, fila) -> tuple:
+        valores = []
+        for col_id, _, _, _, campo, formato in self._columnas:
+            valor = fila.get(campo if campo is not None else col_id)
+            if formato is not None:
+                valor = formato(valor)
+            valores.append("" if valor is None else valor)
+        return tuple(valores)
+
+    def _render(self):
+        if self._mensaje:
+            self.tree.delete("mensaje")
+            self._mensaje = False
+        total = len(self._vista)
+        self._inicio = max(0, min(self._inicio, total - self._visibles))
+        cantidad = min(self._visibles, total - self._inicio)
+        existentes = len(self.tree.get_children())
+        for i in range(existentes, cantidad):
+            self.tree.insert("", tk.END, iid=f"f{i}")
+        if existentes > cantidad:
+            self.tree.delete(*[f"f{i}" for i in range(cantidad, existentes)])
+
+        seleccion = None
+        for i in range(cantidad):
+            posicion = self._inicio + i
+            fila = self._vista[posicion]
+            tags = ("even",) if posicion % 2 == 0 else ("odd",)
+            if self._tags_fila is not None:
+                tags += tuple(self._tags_fila(fila, posicion))
+            self.tree.item(f"f{i}", values=self._valores(fila), tags=tags)
+            if posicion == self._sel_idx:
+                seleccion = f"f{i}"
+        if seleccion is not None:
+            self.tree.selection_set(seleccion)
+            self.tree.focus(seleccion)
+        elif self.tree.selection():
+            self.tree.selection_remove(*self.tree.selection())
+
+        if total:
+            self.v_scroll.set(self._inicio / total, (self._inicio + cantidad) / total)
+        else:
+            self.v_scroll.set(0.0, 1.0)
+        if self.al_final is not None and total and self._inicio + self._visibles >= total - self.MARGEN_FINAL:
+            # Fuera del render para no cargar mientras Tk redibuja
+            self.after_idle(self.al_final)
+
+    def _actualizar_encabezados(self):
+        orden = self._orden if self.al_ordenar is None else self._orden_servidor
+        for col_id, encabezado, *_ in self._columnas:
+            texto = encabezado
+            if orden is not None and orden[0] == col_id:
+                texto += " ▼" if orden[1] else " ▲"
+            self.tree.heading(col_id, text=texto)
+
+    # ----------------------------------------------------------------- eventos
+    def _desplazar(self, inicio: int):
+        inicio = max(0, min(inicio, len(self._vista) - self._visibles))
+        if inicio != self._inicio:
+            self._inicio = inicio
+            self._render()
+
+    def _on_configure(self, event):
+        bbox = self.tree.bbox("f0") if self.tree.exists("f0") else None
+        if bbox:
+            self._alto_encabezado, self._alto_fila = bbox[1], bbox[3]
+        visibles = max(1, (event.height - self._alto_encabezado) // max(1, self._alto_fila))
+        if visibles != self._visibles:
+            self._visibles = visibles
+            self._render()
+
+    def _on_scrollbar(self, accion, cantidad, unidad=None):
+        if accion == "moveto":
+            self._desplazar(int(float(cantidad) * len(self._vista)))
+        elif accion == "scroll":
+            paso = self._visibles if unidad == "pages" else 1
+            self._desplazar(self._inicio + int(cantidad) * paso)
+
+    def _on_rueda(self, event):
+        self._rueda(-self.FILAS_RUEDA if event.delta > 0 else self.FILAS_RUEDA)
+        return "break"
+
+    def _rueda(self, filas: int):
+        self._desplazar(self._inicio + filas)
+        return "break"
+
+    def _on_select(self, event=None):
+        # La selección que pone _render dispara este evento otra vez: sin efecto
+        seleccion = self.tree.selection()
+        if not seleccion or not seleccion[0].startswith("f"):
+            return
+        posicion = self._inicio + int(seleccion[0][1:])
+        if posicion < len(self._vista):
+            self._sel_idx, self._sel_fila = posicion, self._vista[posicion]
+
+    def _on_tecla(self, paso):
+        total = len(self._vista)
+        if not total:
+            return "break"
+        actual = self._sel_idx if self._sel_idx is not None else self._inicio - 1
+        if paso == "pagina":
+            destino = actual + self._visibles
+        elif paso == "-pagina":
+            destino = actual - self._visibles
+        elif paso == "inicio":
+            destino = 0
+        elif paso == "fin":
+            destino = total - 1
+        else:
+            destino = actual + paso
+        destino = max(0, min(destino, total - 1))
+        self._sel_idx, self._sel_fila = destino, self._vista[destino]
+        if destino < self._inicio:
+            self._inicio = destino
+        elif destino >= self._inicio + self._visibles:
+            self._inicio = destino - self._visibles + 1
+        self._render()
+        return "break"
+
+    def _on_encabezado(self, col_id: str):
+        # Primer clic ascendente, segundo descendente, tercero vuelve al orden original
+        actual = self._orden if self.al_ordenar is None else self._orden_servidor
+        if actual is None or actual[0] != col_id:
+            nuevo = (col_id, False)
+        elif not actual[1]:
+            nuevo = (col_id, True)
+        else:
+            nuevo = None
+        if self.al_ordenar is None:
+            self.ordenar(*(nuevo or (None,)))
+            return
+        self._orden_servidor = nuevo
+        self._actualizar_encabezados()
+        if nuevo is None:
+            self.al_ordenar(None, False)
+        else:
+            self.al_ordenar(self._campo(col_id), nuevo[1])
@@ -3,10 +3,19 @@ from tkinter import ttk, messagebox, simpledialog
 from dataclasses import dataclass
 from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from typing import List, Dict, Any, Optional
+from collections import deque, OrderedDict
 import datetime
 import os
+import time
 import logging
-from repos import ProductoRepo, VentaRepo, PuntoVentaRepo
+from repos import ProductoRepo, VentaRepo, PuntoVentaRepo, StockInsuficiente
+from catalogo import get_catalogo
+from busqueda import buscar_productos, CacheSugerencias
+from tareas import EjecutorTk
+from lista_virtual import ListaVirtual
+from diario_ventas import get_diario, nueva_clave
+import arranque
+import precarga
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("NuevaVentaPro")
@@ -20,6 +29,13 @@ def money(v) -> str:
         d = Decimal('0.00')
     return f"${d:,.2f}"
 
+def elegir_punto_venta(puntos: List[Dict[str, Any]]) -> int:
+    """ID del punto de venta para esta PC cliente"""
+    for punto in puntos:
+        if 'cliente' in punto['nombre'].lower() or 'pc' in punto['nombre'].lower():
+            return punto['id']
+    return puntos[0]['id']
+
 @dataclass
 class VentaItem:
     producto_id: int
@@ -176,11 +192,22 @@ class PagoDialog(tk.Toplevel):
             self.destroy()
 
 class AutoCompleteEntry(ttk.Entry):
-    def __init__(self, parent, suggestions_callback, on_select_callback, **kwargs):
+    DEBOUNCE_MS = 150   # silencio antes de pedir sugerencias
+    RAFAGA_MS = 35      # entre teclas más rápido que esto es un lector de barras
+    RAFAGA_MIN = 4      # teclas seguidas así para tratarlo como lector
+
+    def __init__(self, parent, suggestions_callback, on_select_callback,
+                 cancel_callback=None, debounce_ms=None, **kwargs):
         super().__init__(parent, **kwargs)
         self.suggestions_callback = suggestions_callback
         self.on_select_callback = on_select_callback
+        self.cancel_callback = cancel_callback
+        self.debounce_ms = self.DEBOUNCE_MS if debounce_ms is None else debounce_ms
         self.listbox = None
+        self._after_id = None
+        self._consulta = 0          # se incrementa para descartar respuestas en vuelo
+        self._ultima_tecla = None
+        self._rafaga = 0
         self.bind('<KeyRelease>', self._on_keyrelease)
         self.bind('<FocusOut>', self._on_focus_out)
         self.bind('<Down>', self._on_down)
@@ -191,16 +218,49 @@ class AutoCompleteEntry(ttk.Entry):
     def _on_keyrelease(self, event):
         if event.keysym in ['Down', 'Up', 'Return', 'Escape']:
             return
-        
-        self._show_suggestions()
+
+        if self._es_rafaga(event):
+            # Lector de barras tipeando un código: no hay nada que sugerir
+            self._cancelar_consulta()
+            self._hide_listbox()
+            return
+
+        self._cancelar_consulta()
+        self._after_id = self.after(self.debounce_ms, self._show_suggestions)
+
+    def _es_rafaga(self, event) -> bool:
+        ahora = event.time or int(time.monotonic() * 1000)
+        if self._ultima_tecla is not None and 0 <= ahora - self._ultima_tecla <= self.RAFAGA_MS:
+            self._rafaga += 1
+        else:
+            self._rafaga = 1
+        self._ultima_tecla = ahora
+        return self._rafaga >= self.RAFAGA_MIN
+
+    def _cancelar_consulta(self):
+        """Descartar el debounce pendiente y la consulta que esté en vuelo"""
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        self._consulta += 1
+        if self.cancel_callback:
+            self.cancel_callback()
 
     def _show_suggestions(self):
+        self._after_id = None
         query = self.get().strip()
         if not query or len(query) < 2:
             self._hide_listbox()
             return
 
-        suggestions = self.suggestions_callback(query)
+        # El callback puede responder más tarde (consulta en segundo plano)
+        consulta = self._consulta
+        self.suggestions_callback(
+            query, lambda sugerencias, q=query: self._mostrar_sugerencias(consulta, q, sugerencias))
+
+    def _mostrar_sugerencias(self, consulta, query, suggestions):
+        if consulta != self._consulta or self.get().strip() != query:
+            return  # Respuesta de una consulta ya superada
         if not suggestions:
             self._hide_listbox()
             return
@@ -252,6 +312,8 @@ class AutoCompleteEntry(ttk.Entry):
             return "break"
 
     def _on_return(self, event):
+        self._cancelar_consulta()
+        self._rafaga = 0
         if self.listbox and self.listbox.winfo_ismapped() and self.listbox.curselection():
             self._on_listbox_select(event)
             return "break"
@@ -260,6 +322,7 @@ class AutoCompleteEntry(ttk.Entry):
             self.master._add_from_entry()
 
     def _on_escape(self, event):
+        self._cancelar_consulta()
         self._hide_listbox()
 
     def _on_listbox_select(self, event):
@@ -283,11 +346,27 @@ class NuevaVentaFrame(ttk.Frame):
     COLOR_SECONDARY = "#3498db"
     COLOR_SUCCESS = "#27ae60"
     COLOR_WARNING = "#e74c3c"
+    INTERVALO_DIARIO_MS = 3000
 
     def __init__(self, master: Optional[tk.Misc] = None) -> None:
         super().__init__(master)
-        self.items: List[VentaItem] = []
-        self.punto_venta_id = self._obtener_punto_venta()
+        # Carrito: producto_id -> item, en orden de carga, y su fila en el Treeview
+        self._carrito: "OrderedDict[int, VentaItem]" = OrderedDict()
+        self._filas: Dict[int, str] = {}
+        self._ultima_estria = 'odd'         # la próxima fila insertada es 'even'
+        self._producto_por_fila: Dict[str, int] = {}
+        self._total_items = 0
+        self._total = Decimal('0.00')
+        self.punto_venta_id: Optional[int] = None
+        # Lecturas/entradas en orden de llegada; se aplican al carrito de a una
+        self._entradas = deque()
+        self._consulta_en_vuelo = False
+        self._venta_en_curso = False
+        # Clave de idempotencia del carrito: se fija al primer intento de
+        # finalizar y se conserva hasta vaciarlo, así reenviar nunca duplica
+        self._clave_venta: Optional[str] = None
+        self.ejecutor = EjecutorTk(self, on_pendientes=self._on_pendientes)
+        self._cache_sugerencias = CacheSugerencias(limite=10)
         self._setup_advanced_style()
         self._build_professional_ui()
         self._bind_advanced_shortcuts()
@@ -295,6 +374,8 @@ class NuevaVentaFrame(ttk.Frame):
         self.lector_activo = True
         self.buffer_lector = ""
         self.bind('<Key>', self._capturar_lector_barras)
+        self.bind('<Destroy>', lambda e: self.ejecutor.cerrar() if e.widget is self else None)
+        self._obtener_punto_venta()
 
     def _capturar_lector_barras(self, event):
         """Capturar entrada del lector de código de barras"""
@@ -310,24 +391,67 @@ class NuevaVentaFrame(ttk.Frame):
             if len(codigo) >= 3:  # Mínimo 3 caracteres para código
                 self._procesar_codigo_barras(codigo)
 
-    def _obtener_punto_venta(self) -> int:
-        """Obtener el ID del punto de venta para esta PC cliente"""
+    @property
+    def items(self) -> List[VentaItem]:
+        return list(self._carrito.values())
+
+    def _obtener_punto_venta(self):
+        """Obtener en segundo plano el ID del punto de venta para esta PC cliente"""
+        puntos = precarga.puntos_venta()
+        if puntos:
+            # Ya leídos mientras se mostraba el login
+            self.punto_venta_id = precarga.punto_venta_id() or elegir_punto_venta(puntos)
+            return
+        self.ejecutor.enviar(PuntoVentaRepo.listar,
+                             on_ok=self._on_puntos_venta,
+                             on_error=self._on_error_puntos_venta)
+
+    def _on_puntos_venta(self, puntos: List[Dict[str, Any]]):
+        if not puntos:
+            self.punto_venta_id = 1
+            messagebox.showerror("Error", "No hay puntos de venta configurados. Contacte al administrador.")
+            return
+        self.punto_venta_id = elegir_punto_venta(puntos)
+
+    def _on_error_puntos_venta(self, e: Exception):
+        logger.error(f"Error obteniendo punto de venta: {e}")
+        self.punto_venta_id = 1
+        messagebox.showerror("Error", f"No se pudo obtener el punto de venta: {e}")
+
+    def _on_pendientes(self, pendientes: int):
+        """Mostrar si hay consultas o una venta en proceso"""
+        if not hasattr(self, 'lbl_pendiente'):
+            return
+        if self._venta_en_curso:
+            texto = "⏳ Procesando venta... (el lector sigue capturando)"
+        elif pendientes:
+            texto = "⏳ Consultando..."
+        else:
+            texto = ""
+        self.lbl_pendiente.config(text=texto)
+
+    def _actualizar_estado_diario(self):
+        """Mostrar las ventas locales que todavía no llegaron al servidor"""
         try:
-            puntos = PuntoVentaRepo.listar()
-            if not puntos:
-                messagebox.showerror("Error", "No hay puntos de venta configurados. Contacte al administrador.")
-                return 1
-                
-            for punto in puntos:
-                if 'cliente' in punto['nombre'].lower() or 'pc' in punto['nombre'].lower():
-                    return punto['id']
-                    
-            return puntos[0]['id']
-            
+            resumen = get_diario().resumen()
         except Exception as e:
-            logger.error(f"Error obteniendo punto de venta: {e}")
-            messagebox.showerror("Error", f"No se pudo obtener el punto de venta: {e}")
-            return 1
+            logger.error(f"Error leyendo el diario de ventas: {e}")
+            resumen = None
+        textos = []
+        if resumen and resumen["PENDIENTE"]:
+            textos.append(f"📤 {resumen['PENDIENTE']} venta(s) sin sincronizar")
+        if resumen and resumen["CONFLICTO"]:
+            textos.append(f"⚠️ {resumen['CONFLICTO']} rechazada(s) por el servidor")
+            if not self.btn_conflictos.winfo_ismapped():
+                self.btn_conflictos.pack(side="left")
+        elif self.btn_conflictos.winfo_ismapped():
+            self.btn_conflictos.pack_forget()
+        self.lbl_diario.config(text="  ".join(textos))
+        self.after(self.INTERVALO_DIARIO_MS, self._actualizar_estado_diario)
+
+    def _ver_conflictos(self):
+        dialog = ConflictosVentasDialog(self)
+        self.wait_window(dialog)
 
     def _setup_advanced_style(self) -> None:
         s = ttk.Style(self)
@@ -389,6 +513,7 @@ class NuevaVentaFrame(ttk.Frame):
             input_row, 
             suggestions_callback=self._get_suggestions,
             on_select_callback=self._on_suggestion_selected,
+            cancel_callback=lambda: self.ejecutor.cancelar("sugerencias"),
             width=45,
             font=self.FONT_NORMAL
         )
@@ -409,6 +534,18 @@ class NuevaVentaFrame(ttk.Frame):
                                       foreground=self.COLOR_SUCCESS, font=("Segoe UI", 9, "bold"))
         self.lector_status.pack(side="left")
         
+        self.lbl_pendiente = ttk.Label(lector_frame, text="", foreground=self.COLOR_SECONDARY,
+                                       font=("Segoe UI", 9, "bold"))
+        self.lbl_pendiente.pack(side="left", padx=15)
+
+        self.lbl_diario = ttk.Label(lector_frame, text="", foreground=self.COLOR_WARNING,
+                                    font=("Segoe UI", 9, "bold"))
+        self.lbl_diario.pack(side="left", padx=15)
+        
+        # Sólo visible mientras haya ventas rechazadas por el servidor
+        self.btn_conflictos = ttk.Button(lector_frame, text="⚠️ Ver conflictos",
+                                         command=self._ver_conflictos)
+        
         ttk.Button(lector_frame, text="⏸️ Pausar Lector", 
                   command=self._toggle_lector, width=12).pack(side="right", padx=5)
 
@@ -489,6 +626,7 @@ class NuevaVentaFrame(ttk.Frame):
         self._setup_context_menu()
         self._actualizar_totales()
         self.entry_codigo.focus()
+        self.after(1000, self._actualizar_estado_diario)
 
     def _setup_context_menu(self):
         """Configurar menú contextual avanzado"""
@@ -522,80 +660,50 @@ class NuevaVentaFrame(ttk.Frame):
         for key, func in shortcuts:
             self.bind_all(key, func)
 
-    def _get_suggestions(self, query: str) -> List[Dict]:
+    def _get_suggestions(self, query: str, entregar):
         """Obtener sugerencias para autocompletado - SOLO PRODUCTOS ACTIVOS"""
-        try:
-            if not query or len(query) < 2:
-                return []
-                
-            productos = ProductoRepo.listar()
-            query_lower = query.lower()
-            
-            resultados = []
-            for prod in productos:
-                if prod.get('activo', True) and (query_lower in prod['nombre'].lower() or 
-                    query_lower in prod.get('codigo_barras', '').lower()):
-                    resultados.append(prod)
-                    
-            return resultados[:10]
-            
-        except Exception as e:
+        if not query or len(query) < 2:
+            entregar([])
+            return
+
+        # Repetida o más angosta que una ya resuelta: sin ir al índice
+        version = get_catalogo().version
+        cacheadas = self._cache_sugerencias.obtener(query, version)
+        if cacheadas is not None:
+            entregar(cacheadas)
+            return
+
+        def _ok(resultados):
+            self._cache_sugerencias.guardar(query, version, resultados)
+            entregar(resultados)
+
+        def _error(e):
             logger.error(f"Error en búsqueda: {e}")
-            return []
+            entregar([])
+
+        # Una consulta nueva reemplaza a la anterior que todavía no respondió
+        self.ejecutor.enviar(buscar_productos, query, limite=self._cache_sugerencias.limite,
+                             filtro=lambda prod: prod.get('activo', True),
+                             clave="sugerencias", on_ok=_ok, on_error=_error)
 
     def _procesar_entrada_producto(self, entrada: str):
         """Procesar entrada de producto (código o nombre) - VERIFICAR ACTIVO"""
-        try:
-            producto = ProductoRepo.buscar(entrada)
-            if not producto:
-                self._actualizar_status(f"Producto no encontrado: {entrada}")
-                messagebox.showwarning("No encontrado", f"No se encontró el producto: {entrada}")
-                return
-            
-            if not producto.get('activo', True):
-                self._actualizar_status(f"Producto inactivo: {producto['nombre']}")
-                messagebox.showwarning("Producto Inactivo", 
-                                    f"El producto '{producto['nombre']}' está inactivo y no se puede vender")
-                return
-                    
-            item = VentaItem(
-                producto_id=producto['id'],
-                codigo_barras=producto.get('codigo_barras', ''),
-                nombre=producto['nombre'],
-                precio=Decimal(str(producto['precio'])),
-                cantidad=1,
-                stock=producto.get('stock', 0)
-            )
-            
-            self._agregar_item(item)
-            
-        except Exception as e:
-            logger.error(f"Error procesando entrada: {e}")
-            messagebox.showerror("Error", f"Error al procesar producto: {e}")
+        self._encolar_entrada({
+            'origen': 'entrada',
+            'texto': entrada,
+            'buscar': lambda texto: get_catalogo().buscar_por_codigo(texto) or ProductoRepo.buscar(texto),
+        })
 
     def _procesar_codigo_barras(self, codigo: str):
         """Procesar código de barras escaneado - VERIFICAR ACTIVO"""
         if not self.lector_activo:
             return
             
-        try:
-            producto = ProductoRepo.buscar(codigo)
-            if producto and producto.get('codigo_barras') == codigo:
-                if not producto.get('activo', True):
-                    self._actualizar_status(f"Producto inactivo: {producto['nombre']}")
-                    messagebox.showwarning("Producto Inactivo", 
-                                        f"El producto '{producto['nombre']}' está inactivo")
-                    return
-                    
-                self._agregar_producto_desde_datos(producto, 1)
-                self._actualizar_status(f"Escaneado: {producto['nombre']}")
-            else:
-                self._actualizar_status(f"Código no encontrado: {codigo}")
-                messagebox.showwarning("Código inválido", f"No se encontró producto para código: {codigo}")
-                
-        except Exception as e:
-            logger.error(f"Error procesando código de barras: {e}")
-            messagebox.showerror("Error", f"Error al procesar código: {e}")
+        self._encolar_entrada({
+            'origen': 'escaneo',
+            'texto': codigo,
+            'buscar': get_catalogo().buscar_por_codigo,
+        })
 
     def _on_suggestion_selected(self, product_data: Dict):
         """Cuando se selecciona una sugerencia del autocompletado"""
@@ -607,62 +715,219 @@ class NuevaVentaFrame(ttk.Frame):
 
     def _agregar_producto_desde_datos(self, product_data: Dict, cantidad: int = 1):
         """Agregar producto a la venta desde datos del producto"""
+        self._encolar_entrada({
+            'origen': 'directo',
+            'texto': product_data.get('nombre', ''),
+            'producto': product_data,
+            'cantidad': cantidad,
+        })
+
+    # ---------------------------------------------------- cola de entradas
+    # Escaneos, entradas manuales y selecciones se aplican al carrito en el
+    # orden en que llegaron. Las que necesitan la BD se resuelven en segundo
+    # plano de a una; mientras se confirma una venta sólo se acumulan.
+    def _encolar_entrada(self, entrada: Dict[str, Any]):
+        entrada.setdefault('cantidad', 1)
+        entrada['resuelto'] = 'producto' in entrada
+        self._entradas.append(entrada)
+        if self._venta_en_curso:
+            self._actualizar_status(f"Venta en proceso - en espera: {entrada['texto']}")
+        self._drenar_entradas()
+
+    def _drenar_entradas(self):
+        while self._entradas and not self._venta_en_curso:
+            entrada = self._entradas[0]
+            if not entrada['resuelto']:
+                if self._consulta_en_vuelo:
+                    return
+                if entrada['origen'] == 'escaneo':
+                    # Código ya conocido: sale del índice sin ir a la BD
+                    producto = get_catalogo().buscar_por_codigo_local(entrada['texto'])
+                    if producto is not None:
+                        entrada['producto'] = producto
+                        entrada['resuelto'] = True
+                if not entrada['resuelto']:
+                    self._consulta_en_vuelo = True
+                    self.ejecutor.enviar(entrada['buscar'], entrada['texto'],
+                                         on_ok=lambda producto, e=entrada: self._on_entrada_resuelta(e, producto),
+                                         on_error=lambda error, e=entrada: self._on_entrada_error(e, error))
+                    return
+            self._entradas.popleft()
+            self._aplicar_entrada(entrada)
+
+    def _on_entrada_resuelta(self, entrada: Dict[str, Any], producto: Optional[Dict]):
+        self._consulta_en_vuelo = False
+        entrada['producto'] = producto
+        entrada['resuelto'] = True
+        self._drenar_entradas()
+
+    def _on_entrada_error(self, entrada: Dict[str, Any], error: Exception):
+        self._consulta_en_vuelo = False
+        if entrada in self._entradas:
+            self._entradas.remove(entrada)
+        if entrada['origen'] == 'escaneo':
+            logger.error(f"Error procesando código de barras: {error}")
+            messagebox.showerror("Error", f"Error al procesar código: {error}")
+        else:
+            logger.error(f"Error procesando entrada: {error}")
+            messagebox.showerror("Error", f"Error al procesar producto: {error}")
+        self._drenar_entradas()
+
+    def _aplicar_entrada(self, entrada: Dict[str, Any]):
+        """Agregar al carrito una entrada ya resuelta"""
+        producto = entrada['producto']
+        texto = entrada['texto']
         try:
-            item = VentaItem(
-                producto_id=product_data['id'],
-                codigo_barras=product_data.get('codigo_barras', ''),
-                nombre=product_data['nombre'],
-                precio=Decimal(str(product_data['precio'])),
-                cantidad=cantidad,
-                stock=product_data.get('stock', 0)
-            )
-            
-            self._agregar_item(item)
-            
+            if entrada['origen'] == 'escaneo':
+                if producto:
+                    if not producto.get('activo', True):
+                        self._actualizar_status(f"Producto inactivo: {producto['nombre']}")
+                        messagebox.showwarning("Producto Inactivo", 
+                                            f"El producto '{producto['nombre']}' está inactivo")
+                        return
+                        
+                    self._agregar_item(self._crear_item(producto, 1))
+                    self._actualizar_status(f"Escaneado: {producto['nombre']}")
+                    arranque.registrar("primer escaneo")
+                else:
+                    self._actualizar_status(f"Código no encontrado: {texto}")
+                    messagebox.showwarning("Código inválido", f"No se encontró producto para código: {texto}")
+
+            elif entrada['origen'] == 'entrada':
+                if not producto:
+                    self._actualizar_status(f"Producto no encontrado: {texto}")
+                    messagebox.showwarning("No encontrado", f"No se encontró el producto: {texto}")
+                    return
+                
+                if not producto.get('activo', True):
+                    self._actualizar_status(f"Producto inactivo: {producto['nombre']}")
+                    messagebox.showwarning("Producto Inactivo", 
+                                        f"El producto '{producto['nombre']}' está inactivo y no se puede vender")
+                    return
+                        
+                self._agregar_item(self._crear_item(producto, 1))
+                # El lector suele tipear en el campo de código y mandar Enter
+                arranque.registrar("primer escaneo")
+
+            else:
+                self._agregar_item(self._crear_item(producto, entrada['cantidad']))
+
         except Exception as e:
             logger.error(f"Error agregando producto: {e}")
-            raise
+            messagebox.showerror("Error", f"No se pudo agregar el producto: {e}")
+
+    def _crear_item(self, product_data: Dict, cantidad: int = 1) -> VentaItem:
+        return VentaItem(
+            producto_id=product_data['id'],
+            codigo_barras=product_data.get('codigo_barras', ''),
+            nombre=product_data['nombre'],
+            precio=Decimal(str(product_data['precio'])),
+            cantidad=cantidad,
+            stock=product_data.get('stock', 0)
+        )
+
+    def _carrito_bloqueado(self) -> bool:
+        """True (y avisa) si hay una venta confirmándose"""
+        if self._venta_en_curso:
+            self._actualizar_status("Espere: se está procesando la venta")
+            return True
+        return False
 
     def _agregar_item(self, item: VentaItem):
         """Agregar o actualizar item en la venta"""
-        for existing_item in self.items:
-            if existing_item.producto_id == item.producto_id:
-                existing_item.cantidad += item.cantidad
-                self._actualizar_treeview()
-                self._actualizar_totales()
-                self._actualizar_status(f"Cantidad actualizada: {existing_item.nombre}")
-                return
+        existing_item = self._carrito.get(item.producto_id)
+        if existing_item is not None:
+            self._cambiar_cantidad(existing_item, existing_item.cantidad + item.cantidad)
+            self._actualizar_status(f"Cantidad actualizada: {existing_item.nombre}")
+            return
         
-        self.items.append(item)
-        self._actualizar_treeview()
-        self._actualizar_totales()
+        self._carrito[item.producto_id] = item
+        # Estría alternada por inserción; al quitar filas no se recalcula
+        # (vuelve a quedar pareja en el próximo refresco completo)
+        self._ultima_estria = 'odd' if self._ultima_estria == 'even' else 'even'
+        iid = self.tree.insert('', tk.END, values=self._valores_fila(item),
+                               tags=self._tags_fila(item, estria=self._ultima_estria))
+        self._filas[item.producto_id] = iid
+        self._producto_por_fila[iid] = item.producto_id
+        self._actualizar_totales(item.cantidad, item.subtotal)
         self._actualizar_status(f"Agregado: {item.nombre}")
 
-    def _actualizar_treeview(self):
-        """Actualizar completamente el treeview"""
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        for idx, item in enumerate(self.items):
-            tags = ('even',) if idx % 2 == 0 else ('odd',)
-            if not item.tiene_stock:
-                tags += ('sin_stock',)
-                
-            values = (
-                item.codigo_barras,
-                item.nombre,
-                item.cantidad,
-                money(item.precio),
-                money(item.subtotal),
-                item.stock
-            )
-            
-            self.tree.insert('', tk.END, values=values, tags=tags)
+    def _cambiar_cantidad(self, item: VentaItem, cantidad: int):
+        """Cambiar la cantidad de un item tocando sólo su fila"""
+        subtotal_anterior = item.subtotal
+        delta_items = cantidad - item.cantidad
+        item.cantidad = cantidad
+        self._repintar_fila(item)
+        self._actualizar_totales(delta_items, item.subtotal - subtotal_anterior)
+
+    def _repintar_fila(self, item: VentaItem):
+        iid = self._filas[item.producto_id]
+        estria = 'even' if 'even' in self.tree.item(iid, 'tags') else 'odd'
+        self.tree.item(iid, values=self._valores_fila(item), tags=self._tags_fila(item, estria=estria))
+
+    def _refrescar_stock(self, stock_por_id: Dict[int, Optional[int]]):
+        """Actualizar el stock de los items del carrito y sus filas"""
+        for producto_id, stock in stock_por_id.items():
+            item = self._carrito.get(producto_id)
+            if item is None or item.stock == (stock or 0):
+                continue
+            item.stock = stock or 0
+            self._repintar_fila(item)
+
+    def _quitar_item(self, item: VentaItem):
+        """Quitar un item del carrito y su fila"""
+        del self._carrito[item.producto_id]
+        iid = self._filas.pop(item.producto_id)
+        del self._producto_por_fila[iid]
+        self.tree.delete(iid)
+        self._actualizar_totales(-item.cantidad, -item.subtotal)
+
+    def _item_seleccionado(self) -> Optional[VentaItem]:
+        seleccion = self.tree.selection()
+        if not seleccion:
+            return None
+        producto_id = self._producto_por_fila.get(seleccion[0])
+        return self._carrito.get(producto_id)
+
+    def _valores_fila(self, item: VentaItem) -> tuple:
+        return (
+            item.codigo_barras,
+            item.nombre,
+            item.cantidad,
+            money(item.precio),
+            money(item.subtotal),
+            item.stock
+        )
+
+    def _tags_fila(self, item: VentaItem, estria: str) -> tuple:
+        tags = (estria,)
+        if not item.tiene_stock:
+            tags += ('sin_stock',)
+        return tags
 
-    def _actualizar_totales(self):
-        """Actualizar display de totales"""
-        total_items = sum(item.cantidad for item in self.items)
-        subtotal = sum(float(item.subtotal) for item in self.items)
+    def _actualizar_treeview(self):
+        """Reconstruir completamente el treeview desde el carrito"""
+        self.tree.delete(*self.tree.get_children())
+        self._filas.clear()
+        self._producto_por_fila.clear()
+        
+        self._ultima_estria = 'odd'
+        for idx, item in enumerate(self._carrito.values()):
+            self._ultima_estria = 'even' if idx % 2 == 0 else 'odd'
+            iid = self.tree.insert('', tk.END, values=self._valores_fila(item),
+                                   tags=self._tags_fila(item, estria=self._ultima_estria))
+            self._filas[item.producto_id] = iid
+            self._producto_por_fila[iid] = item.producto_id
+
+        self._total_items = sum(item.cantidad for item in self._carrito.values())
+        self._total = sum((item.subtotal for item in self._carrito.values()), Decimal('0.00'))
+
+    def _actualizar_totales(self, delta_items: int = 0, delta_total: Decimal = Decimal('0.00')):
+        """Aplicar la variación de totales y actualizar el display"""
+        self._total_items += delta_items
+        self._total += delta_total
+        total_items = self._total_items
+        subtotal = self._total
         total = subtotal
         
         self.lbl_items.config(text=f"Items: {total_items}")
@@ -700,20 +965,27 @@ class NuevaVentaFrame(ttk.Frame):
         """Mostrar diálogo de búsqueda avanzada"""
         dialogo = BusquedaAvanzadaDialog(self)
         self.wait_window(dialogo)
-        if hasattr(dialogo, 'producto_seleccionado'):
+        if getattr(dialogo, 'producto_seleccionado', None):
             self._agregar_producto_desde_datos(dialogo.producto_seleccionado)
 
     def _show_lista_productos(self):
         """Mostrar diálogo con lista completa de productos"""
         dialogo = ListaProductosDialog(self)
         self.wait_window(dialogo)
-        if hasattr(dialogo, 'producto_seleccionado'):
+        if getattr(dialogo, 'producto_seleccionado', None):
             self._agregar_producto_desde_datos(dialogo.producto_seleccionado)
 
     def _actualizar_lista_productos(self):
         """Actualizar cache de productos"""
         self._actualizar_status("Actualizando lista de productos...")
-        self._actualizar_status("Lista de productos actualizada")
+
+        def _error(e):
+            logger.error(f"Error actualizando catálogo: {e}")
+            self._actualizar_status("No se pudo actualizar la lista de productos")
+
+        self.ejecutor.enviar(get_catalogo().refrescar, clave="catalogo",
+                             on_ok=lambda _: self._actualizar_status("Lista de productos actualizada"),
+                             on_error=_error)
 
     def _on_doble_clic(self, event):
         """Al hacer doble clic en un item"""
@@ -728,50 +1000,37 @@ class NuevaVentaFrame(ttk.Frame):
 
     def _menu_editar_cantidad(self):
         """Editar cantidad del item seleccionado"""
-        seleccion = self.tree.selection()
-        if not seleccion:
+        item = self._item_seleccionado()
+        if not item or self._carrito_bloqueado():
             return
             
-        idx = self.tree.index(seleccion[0])
-        if 0 <= idx < len(self.items):
-            item = self.items[idx]
-            nueva_cantidad = tk.simpledialog.askinteger(
-                "Editar cantidad",
-                f"Nueva cantidad para {item.nombre}:",
-                parent=self,
-                initialvalue=item.cantidad,
-                minvalue=1
-            )
-            if nueva_cantidad:
-                item.cantidad = nueva_cantidad
-                self._actualizar_treeview()
-                self._actualizar_totales()
-                self._actualizar_status(f"Cantidad actualizada: {item.nombre}")
+        nueva_cantidad = tk.simpledialog.askinteger(
+            "Editar cantidad",
+            f"Nueva cantidad para {item.nombre}:",
+            parent=self,
+            initialvalue=item.cantidad,
+            minvalue=1
+        )
+        if nueva_cantidad and item.producto_id in self._carrito:
+            self._cambiar_cantidad(item, nueva_cantidad)
+            self._actualizar_status(f"Cantidad actualizada: {item.nombre}")
 
     def _menu_aumentar_1(self):
         """Aumentar cantidad en 1"""
-        seleccion = self.tree.selection()
-        if not seleccion:
+        item = self._item_seleccionado()
+        if not item or self._carrito_bloqueado():
             return
             
-        idx = self.tree.index(seleccion[0])
-        if 0 <= idx < len(self.items):
-            self.items[idx].cantidad += 1
-            self._actualizar_treeview()
-            self._actualizar_totales()
+        self._cambiar_cantidad(item, item.cantidad + 1)
 
     def _menu_disminuir_1(self):
         """Disminuir cantidad en 1"""
-        seleccion = self.tree.selection()
-        if not seleccion:
+        item = self._item_seleccionado()
+        if not item or self._carrito_bloqueado():
             return
             
-        idx = self.tree.index(seleccion[0])
-        if 0 <= idx < len(self.items):
-            if self.items[idx].cantidad > 1:
-                self.items[idx].cantidad -= 1
-                self._actualizar_treeview()
-                self._actualizar_totales()
+        if item.cantidad > 1:
+            self._cambiar_cantidad(item, item.cantidad - 1)
 
     def _menu_eliminar_item(self):
         """Eliminar item seleccionado"""
@@ -779,49 +1038,46 @@ class NuevaVentaFrame(ttk.Frame):
 
     def _menu_ver_info(self):
         """Ver información detallada del producto"""
-        seleccion = self.tree.selection()
-        if not seleccion:
+        item = self._item_seleccionado()
+        if not item:
             return
             
-        idx = self.tree.index(seleccion[0])
-        if 0 <= idx < len(self.items):
-            item = self.items[idx]
-            info = f"""
-            Información del Producto:
-            
-            Nombre: {item.nombre}
-            Código: {item.codigo_barras}
-            Precio: {money(item.precio)}
-            Cantidad: {item.cantidad}
-            Stock disponible: {item.stock}
-            Subtotal: {money(item.subtotal)}
-            
-            Estado: {'✅ Stock suficiente' if item.tiene_stock else '⚠️ Stock insuficiente'}
-            """
-            messagebox.showinfo("Información del Producto", info.strip())
+        info = f"""
+        Información del Producto:
+        
+        Nombre: {item.nombre}
+        Código: {item.codigo_barras}
+        Precio: {money(item.precio)}
+        Cantidad: {item.cantidad}
+        Stock disponible: {item.stock}
+        Subtotal: {money(item.subtotal)}
+        
+        Estado: {'✅ Stock suficiente' if item.tiene_stock else '⚠️ Stock insuficiente'}
+        """
+        messagebox.showinfo("Información del Producto", info.strip())
 
     def _eliminar_seleccionado(self):
         """Eliminar item seleccionado"""
-        seleccion = self.tree.selection()
-        if not seleccion:
+        if self._carrito_bloqueado():
+            return
+        item = self._item_seleccionado()
+        if not item:
             self._actualizar_status("Seleccione un item para eliminar")
             return
             
-        idx = self.tree.index(seleccion[0])
-        if 0 <= idx < len(self.items):
-            item = self.items[idx]
-            self.items.pop(idx)
-            self._actualizar_treeview()
-            self._actualizar_totales()
-            self._actualizar_status(f"Eliminado: {item.nombre}")
+        self._quitar_item(item)
+        self._actualizar_status(f"Eliminado: {item.nombre}")
 
-    def _limpiar_venta(self):
+    def _limpiar_venta(self, confirmar: bool = True):
         """Limpiar toda la venta"""
-        if not self.items:
+        if not self._carrito:
+            return
+        if confirmar and self._carrito_bloqueado():
             return
             
-        if messagebox.askyesno("Limpiar venta", "¿Está seguro de que desea limpiar toda la venta?"):
-            self.items.clear()
+        if not confirmar or messagebox.askyesno("Limpiar venta", "¿Está seguro de que desea limpiar toda la venta?"):
+            self._carrito.clear()
+            self._clave_venta = None
             self._actualizar_treeview()
             self._actualizar_totales()
             self._actualizar_status("Venta limpiada")
@@ -829,32 +1085,38 @@ class NuevaVentaFrame(ttk.Frame):
 
     def _finalizar_venta(self):
         """Finalizar y procesar la venta con pago real"""
-        if not self.items:
+        if self._carrito_bloqueado():
+            return
+        if not self._carrito:
             messagebox.showwarning("Venta vacía", "No hay productos en la venta")
             return
+        if self.punto_venta_id is None:
+            messagebox.showwarning("Punto de venta", "Todavía se está obteniendo el punto de venta. Intente nuevamente.")
+            return
 
-        # Verificar stock
-        sin_stock = []
+        # Verificar stock con el catálogo en memoria (el stock del item es el
+        # de cuando se agregó); crear_venta lo vuelve a validar al grabar
+        catalogo = get_catalogo()
+        actual = {}
         for item in self.items:
-            if item.stock < item.cantidad:
-                sin_stock.append({
-                    'item': item,
-                    'stock_actual': item.stock,
-                    'cantidad_solicitada': item.cantidad
-                })
+            producto = catalogo.obtener_local(item.producto_id)
+            if producto is not None:
+                actual[item.producto_id] = producto.get('stock')
+        self._refrescar_stock(actual)
 
+        sin_stock = [item for item in self.items if not item.tiene_stock]
         if sin_stock:
-            productos_sin_stock = "\n".join([
-                f"- {item['item'].nombre}: Stock {item['stock_actual']}, Solicitado {item['cantidad_solicitada']}" 
+            productos_sin_stock = "\n".join(
+                f"- {item.nombre}: Stock {item.stock}, Solicitado {item.cantidad}"
                 for item in sin_stock
-            ])
-            
-            if not messagebox.askyesno("Stock insuficiente", 
-                                    f"Los siguientes productos no tienen stock suficiente:\n\n{productos_sin_stock}\n\n¿Desea continuar igualmente?"):
-                return
+            )
+            messagebox.showwarning("Stock insuficiente",
+                                   f"Los siguientes productos no tienen stock suficiente:\n\n{productos_sin_stock}\n\n"
+                                   "Ajuste las cantidades antes de cobrar.")
+            return
 
         # Calcular total
-        total = sum(float(item.subtotal) for item in self.items)
+        total = float(self._total)
         
         # Mostrar diálogo de pago
         dialogo_pago = PagoDialog(self, Decimal(total))
@@ -864,42 +1126,82 @@ class NuevaVentaFrame(ttk.Frame):
             return  # Usuario canceló
 
         # Procesar la venta
+        items_payload = [
+            {
+                "producto_id": item.producto_id,
+                "cantidad": item.cantidad,
+                "precio": float(item.precio),
+                "nombre": item.nombre
+            }
+            for item in self.items
+        ]
+        datos_pago = dialogo_pago.resultado
+        if self._clave_venta is None:
+            self._clave_venta = nueva_clave()
+
+        # La venta se graba en el diario local y se confirma en el acto; el
+        # hilo del diario la envía a SQL Server cuando pueda
         try:
-            items_payload = [
-                {
-                    "producto_id": item.producto_id,
-                    "cantidad": item.cantidad,
-                    "precio": float(item.precio),
-                    "nombre": item.nombre
-                }
-                for item in self.items
-            ]
-
-            # Crear venta en la base de datos
-            venta_id = VentaRepo.crear_venta(
-                punto_venta_id=self.punto_venta_id,
-                items=items_payload,
-                forma_pago=dialogo_pago.resultado["forma_pago"],
-                monto_recibido=dialogo_pago.resultado["monto_recibido"],
-                vuelto=dialogo_pago.resultado["vuelto"]
-            )
+            local_id = get_diario().registrar(self.punto_venta_id, items_payload,
+                                              forma_pago=datos_pago["forma_pago"],
+                                              clave=self._clave_venta)
+        except Exception as e:
+            logger.error(f"No se pudo grabar la venta en el diario local: {e}")
+        else:
+            self._on_venta_creada(local_id[:8].upper(), datos_pago)
+            return
+
+        # Sin diario: crear venta en la base de datos sin bloquear la interfaz; el carrito
+        # queda congelado y lo que se escanee se acumula hasta que termine
+        self._venta_en_curso = True
+        self._on_pendientes(self.ejecutor.pendientes)
+        self.ejecutor.enviar(
+            VentaRepo.crear_venta,
+            punto_venta_id=self.punto_venta_id,
+            items=items_payload,
+            forma_pago=datos_pago["forma_pago"],
+            clave=self._clave_venta,
+            on_ok=lambda venta_id: self._on_venta_creada(venta_id, datos_pago),
+            on_error=self._on_venta_error
+        )
 
+    def _on_venta_creada(self, venta_id: int, datos_pago: Dict):
+        try:
             # Mostrar resumen de venta
-            self._mostrar_resumen_venta(venta_id, dialogo_pago.resultado)
+            self._mostrar_resumen_venta(venta_id, datos_pago)
             
             # Limpiar venta
-            self._limpiar_venta()
-            
-        except ValueError as e:
+            self._limpiar_venta(confirmar=False)
+        finally:
+            self._venta_en_curso = False
+            self._on_pendientes(self.ejecutor.pendientes)
+            self._drenar_entradas()
+
+    def _on_venta_error(self, e: Exception):
+        self._venta_en_curso = False
+        self._on_pendientes(self.ejecutor.pendientes)
+        if isinstance(e, StockInsuficiente):
+            # El servidor dice cuánto hay de verdad: se corrige el carrito
+            logger.error(f"Error de stock en venta: {e}")
+            self._refrescar_stock({l['producto_id']: l['disponible'] for l in e.lineas})
+            detalle = "\n".join(
+                f"- {l['nombre'] or l['producto_id']}: Stock "
+                f"{l['disponible'] if l['disponible'] is not None else 'producto inexistente'}, "
+                f"Solicitado {l['solicitado']}"
+                for l in e.lineas
+            )
+            messagebox.showerror("Error de Stock", f"No se puede procesar la venta:\n\n{detalle}")
+        elif isinstance(e, ValueError):
             logger.error(f"Error de stock en venta: {e}")
             messagebox.showerror("Error de Stock", f"No se puede procesar la venta:\n{e}")
-        except Exception as e:
+        else:
             logger.error(f"Error finalizando venta: {e}")
             messagebox.showerror("Error", f"No se pudo procesar la venta: {e}")
+        self._drenar_entradas()
 
     def _mostrar_resumen_venta(self, venta_id: int, datos_pago: Dict):
         """Mostrar resumen completo de la venta procesada"""
-        total = sum(float(item.subtotal) for item in self.items)
+        total = float(self._total)
         
         resumen = f"""
         ✅ VENTA PROCESADA EXITOSAMENTE
@@ -908,7 +1210,7 @@ class NuevaVentaFrame(ttk.Frame):
         -------------------------
         Ticket: #{venta_id}
         Fecha: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-        Items vendidos: {sum(item.cantidad for item in self.items)}
+        Items vendidos: {self._total_items}
         
         💰 INFORMACIÓN DE PAGO:
         -----------------------
@@ -933,7 +1235,7 @@ class NuevaVentaFrame(ttk.Frame):
     def _mostrar_ticket(self, venta_id: int, datos_pago: Dict):
         """Mostrar ticket de venta"""
         try:
-            total = sum(float(item.subtotal) for item in self.items)
+            total = float(self._total)
             
             ticket_window = tk.Toplevel(self)
             ticket_window.title(f"Ticket de Venta #{venta_id}")
@@ -1050,13 +1352,99 @@ class NuevaVentaFrame(ttk.Frame):
 
 
 
+class ConflictosVentasDialog(tk.Toplevel):
+    """Ventas del diario local rechazadas por el servidor: reintentar o descartar"""
+    
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+        self.ventas = {}
+        
+        self.title("⚠️ Ventas con Conflicto")
+        self.geometry("800x400")
+        self.transient(parent)
+        self.grab_set()
+        
+        self._construir_ui()
+        self._cargar()
+        
+    def _construir_ui(self):
+        ttk.Label(self, text="Estas ventas se cobraron pero el servidor las rechazó. "
+                             "Corrija el problema (p. ej. el stock) y reintente, o descártelas.",
+                  font=("Segoe UI", 9), padding="10", wraplength=760).pack(fill="x")
+        
+        frame = ttk.Frame(self, padding=(10, 0))
+        frame.pack(fill="both", expand=True)
+        
+        columnas = [("creada", "Fecha", 140), ("productos", "Productos", 260),
+                    ("total", "Total", 90), ("error", "Motivo", 300)]
+        self.tree = ttk.Treeview(frame, columns=[c[0] for c in columnas], show="headings",
+                                 selectmode="browse")
+        for col_id, texto, ancho in columnas:
+            self.tree.heading(col_id, text=texto)
+            self.tree.column(col_id, width=ancho, anchor="w")
+        scroll = ttk.Scrollbar(frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scroll.set)
+        self.tree.pack(side="left", fill="both", expand=True)
+        scroll.pack(side="right", fill="y")
+        
+        btn_frame = ttk.Frame(self, padding="10")
+        btn_frame.pack(fill="x")
+        
+        ttk.Button(btn_frame, text="🔄 Reintentar", command=self._reintentar).pack(side="left", padx=5)
+        ttk.Button(btn_frame, text="🗑️ Descartar", command=self._descartar).pack(side="left", padx=5)
+        ttk.Button(btn_frame, text="Cerrar", command=self.destroy).pack(side="right", padx=5)
+        
+    def _cargar(self):
+        self.tree.delete(*self.tree.get_children())
+        try:
+            conflictos = get_diario().conflictos()
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo leer el diario de ventas: {e}", parent=self)
+            return
+        self.ventas = {venta['id']: venta for venta in conflictos}
+        for venta in conflictos:
+            total = sum(Decimal(str(it['precio'])) * it['cantidad'] for it in venta['items'])
+            total *= 1 - Decimal(str(venta['descuento'])) / 100
+            productos = ", ".join(f"{it['cantidad']} x {it.get('nombre') or it['producto_id']}"
+                                  for it in venta['items'])
+            self.tree.insert("", tk.END, iid=venta['id'], values=(
+                venta['creada'][:16], productos, money(total), venta['error'] or ""))
+        
+    def _seleccionada(self):
+        seleccion = self.tree.selection()
+        if not seleccion:
+            messagebox.showwarning("Selección", "Seleccione una venta", parent=self)
+            return None
+        return self.ventas.get(seleccion[0])
+        
+    def _reintentar(self):
+        venta = self._seleccionada()
+        if venta is None:
+            return
+        get_diario().reintentar(venta['id'])
+        self._cargar()
+        
+    def _descartar(self):
+        venta = self._seleccionada()
+        if venta is None:
+            return
+        if not messagebox.askyesno("Descartar venta",
+                                   "La venta no se enviará al servidor y su stock no se descontará.\n\n"
+                                   "¿Descartarla?", parent=self):
+            return
+        get_diario().descartar(venta['id'])
+        self._cargar()
+
 class BusquedaAvanzadaDialog(tk.Toplevel):
     """Diálogo de búsqueda avanzada de productos"""
+    DEBOUNCE_MS = AutoCompleteEntry.DEBOUNCE_MS
     
     def __init__(self, parent):
         super().__init__(parent)
         self.parent = parent
         self.producto_seleccionado = None
+        self._after_id = None
         
         self.title("🔍 Búsqueda Avanzada de Productos")
         self.geometry("600x400")
@@ -1080,28 +1468,12 @@ class BusquedaAvanzadaDialog(tk.Toplevel):
         ttk.Button(search_frame, text="Buscar", 
                   command=self._filtrar_productos).pack(side="left", padx=5)
         
-        tree_frame = ttk.Frame(self)
-        tree_frame.pack(fill="both", expand=True, padx=10, pady=5)
-        
-        columns = ("codigo", "nombre", "precio", "stock")
-        self.tree = ttk.Treeview(tree_frame, columns=columns, show="headings", height=15)
-        
-        for col, text, width in [
-            ("codigo", "Código", 120),
-            ("nombre", "Nombre", 250),
-            ("precio", "Precio", 100),
-            ("stock", "Stock", 80)
-        ]:
-            self.tree.heading(col, text=text)
-            self.tree.column(col, width=width, anchor="center")
-        
-    
-        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
-        
-        self.tree.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
-        
+        self._crear_lista([
+            ("codigo", "Código", 120, "center", "codigo_barras"),
+            ("nombre", "Nombre", 250, "center", "nombre"),
+            ("precio", "Precio", 100, "center", "precio", self._formato_precio),
+            ("stock", "Stock", 80, "center", "stock")
+        ], height=15)
 
         self.tree.bind("<Double-1>", self._seleccionar_producto)
         self.tree.bind("<Return>", self._seleccionar_producto)
@@ -1117,60 +1489,105 @@ class BusquedaAvanzadaDialog(tk.Toplevel):
         
         self.entry_busqueda.focus()
         
+    def _crear_lista(self, columnas, height):
+        """Lista virtualizada: sólo se dibujan las filas visibles del catálogo"""
+        self.lista = ListaVirtual(self, columnas, height=height)
+        self.lista.pack(fill="both", expand=True, padx=10, pady=5)
+        self.tree = self.lista.tree
+
+    @staticmethod
+    def _formato_precio(precio):
+        return f"${float(precio):.2f}" if precio is not None else ""
+
     def _cargar_productos(self):
-        """Cargar lista de productos"""
-        try:
-            self.productos = ProductoRepo.listar()
+        """Cargar lista de productos (en segundo plano si el padre tiene ejecutor)"""
+        self.productos = []
+        ejecutor = getattr(self.parent, 'ejecutor', None)
+        if ejecutor is None:
+            try:
+                self._on_productos_cargados(get_catalogo().productos())
+            except Exception as e:
+                self._on_error_carga(e)
+            return
+        self.lista.mostrar_mensaje("⏳ Cargando productos...", "nombre")
+        ejecutor.enviar(get_catalogo().productos, clave="dialogo_productos",
+                        on_ok=self._on_productos_cargados, on_error=self._on_error_carga)
+
+    def _on_productos_cargados(self, productos):
+        if not self.winfo_exists():
+            return
+        self.productos = productos
+        if self.entry_busqueda.get().strip():
+            self._filtrar_productos()
+        else:
             self._mostrar_productos(self.productos)
-        except Exception as e:
-            messagebox.showerror("Error", f"No se pudieron cargar los productos: {e}")
+
+    def _on_error_carga(self, e: Exception):
+        messagebox.showerror("Error", f"No se pudieron cargar los productos: {e}")
             
     def _mostrar_productos(self, productos):
-        """Mostrar productos en el treeview"""
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-            
-        for prod in productos:
-            self.tree.insert("", tk.END, values=(
-                prod.get('codigo_barras', ''),
-                prod['nombre'],
-                f"${float(prod['precio']):.2f}",
-                prod.get('stock', 0)
-            ))
+        """Mostrar productos en la lista"""
+        self.lista.set_datos(productos)
             
     def _filtrar_productos(self, event=None):
-        """Filtrar productos según búsqueda"""
-        query = self.entry_busqueda.get().lower().strip()
+        """Filtrar productos según búsqueda (al dejar de tipear)"""
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        ejecutor = getattr(self.parent, 'ejecutor', None)
+        if ejecutor is not None:
+            ejecutor.cancelar("dialogo_busqueda")
+        query = self.entry_busqueda.get().strip()
         if not query:
             self._mostrar_productos(self.productos)
             return
-            
-        resultados = []
-        for prod in self.productos:
-            if (query in prod['nombre'].lower() or 
-                query in prod.get('codigo_barras', '').lower()):
-                resultados.append(prod)
-                
-        self._mostrar_productos(resultados)
+        if event is None:
+            self._buscar()
+        else:
+            self._after_id = self.after(self.DEBOUNCE_MS, self._buscar)
+
+    def _buscar(self):
+        """Buscar en segundo plano; sólo se muestra la respuesta a la última búsqueda"""
+        self._after_id = None
+        query = self.entry_busqueda.get().strip()
+        ejecutor = getattr(self.parent, 'ejecutor', None)
+        if ejecutor is None:
+            try:
+                self._on_resultados(query, buscar_productos(query, limite=None))
+            except Exception as e:
+                self._on_error_busqueda(e)
+            return
+        ejecutor.enviar(buscar_productos, query, limite=None, clave="dialogo_busqueda",
+                        on_ok=lambda productos, q=query: self._on_resultados(q, productos),
+                        on_error=self._on_error_busqueda)
+
+    def _on_resultados(self, query, productos):
+        if not self.winfo_exists() or self.entry_busqueda.get().strip() != query:
+            return  # Respuesta de una búsqueda ya superada
+        self._mostrar_productos(productos)
+
+    def _on_error_busqueda(self, e: Exception):
+        if self.winfo_exists():
+            messagebox.showerror("Error", f"Error en búsqueda: {e}")
+
+    def destroy(self):
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        ejecutor = getattr(self.parent, 'ejecutor', None)
+        if ejecutor is not None:
+            ejecutor.cancelar("dialogo_busqueda")
+        super().destroy()
         
     def _seleccionar_producto(self, event=None):
         """Seleccionar producto"""
-        seleccion = self.tree.selection()
-        if not seleccion:
+        producto = self.lista.seleccionada()
+        if producto is None:
             messagebox.showwarning("Selección", "Seleccione un producto")
             return
             
-        item = self.tree.item(seleccion[0])
-        valores = item['values']
-        
-        codigo = valores[0]
-        for prod in self.productos:
-            if prod.get('codigo_barras') == codigo:
-                self.producto_seleccionado = prod
-                self.destroy()
-                return
-                
-        messagebox.showerror("Error", "No se pudo encontrar el producto seleccionado")
+        self.producto_seleccionado = producto
+        self.destroy()
 
 class ListaProductosDialog(BusquedaAvanzadaDialog):
     """Diálogo de lista completa de productos (herencia de búsqueda)"""
@@ -1198,28 +1615,14 @@ class ListaProductosDialog(BusquedaAvanzadaDialog):
         self.entry_busqueda.pack(side="left", padx=5, fill="x", expand=True)
         self.entry_busqueda.bind("<KeyRelease>", self._filtrar_productos)
         
-        # Treeview (igual que el padre)
-        tree_frame = ttk.Frame(self)
-        tree_frame.pack(fill="both", expand=True, padx=10, pady=5)
-        
-        columns = ("codigo", "nombre", "precio", "stock", "categoria")
-        self.tree = ttk.Treeview(tree_frame, columns=columns, show="headings", height=18)
-        
-        for col, text, width in [
-            ("codigo", "Código", 120),
-            ("nombre", "Nombre", 220),
-            ("precio", "Precio", 100),
-            ("stock", "Stock", 80),
-            ("categoria", "Categoría", 120)
-        ]:
-            self.tree.heading(col, text=text)
-            self.tree.column(col, width=width, anchor="center")
-        
-        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
-        
-        self.tree.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
+        # Lista (igual que el padre, con categoría)
+        self._crear_lista([
+            ("codigo", "Código", 120, "center", "codigo_barras"),
+            ("nombre", "Nombre", 220, "center", "nombre"),
+            ("precio", "Precio", 100, "center", "precio", self._formato_precio),
+            ("stock", "Stock", 80, "center", "stock"),
+            ("categoria", "Categoría", 120, "center", "categoria")
+        ], height=18)
         
         self.tree.bind("<Double-1>", self._seleccionar_producto)
         self.tree.bind("<Return>", self._seleccionar_producto)
@@ -0,0 +1,80 @@
+"""
+Precarga en segundo plano mientras se muestra el login: conexiones del pool,
+catálogo con su índice de búsqueda, puntos de venta, el punto de venta de
+esta PC y las métricas del dashboard. Así el POS puede escanear apenas se ingresa.
+"""
+
+import threading
+import logging
+from typing import List, Dict, Any, Optional
+
+import arranque
+from config import get_pool
+from repos import PuntoVentaRepo, MetricasRepo
+
+logger = logging.getLogger("Precarga")
+
+CONEXIONES = 2   # conexiones que se dejan abiertas en el pool
+
+_hilo = None
+_lock = threading.Lock()
+_lista = threading.Event()
+_puntos: Optional[List[Dict[str, Any]]] = None
+_punto_venta_id: Optional[int] = None
+
+def iniciar():
+    """Lanzar la precarga (sólo la primera vez que se llama)"""
+    global _hilo
+    with _lock:
+        if _hilo is not None:
+            return
+        _hilo = threading.Thread(target=_precargar, name="precarga", daemon=True)
+        _hilo.start()
+
+def lista() -> bool:
+    return _lista.is_set()
+
+def esperar(timeout: Optional[float] = None) -> bool:
+    """Bloquear hasta que termine la precarga (True si terminó)"""
+    return _lista.wait(timeout)
+
+def puntos_venta() -> Optional[List[Dict[str, Any]]]:
+    """Puntos de venta ya leídos, o None si la precarga no llegó a leerlos"""
+    return _puntos
+
+def punto_venta_id() -> Optional[int]:
+    """Punto de venta de esta PC ya calculado, o None"""
+    return _punto_venta_id
+
+def _precargar():
+    # Cada paso es independiente: si uno falla, los demás igual sirven
+    pasos = [
+        ("conexiones", lambda: get_pool().precalentar(CONEXIONES)),
+        ("puntos de venta", _cargar_puntos),
+        ("catálogo", _cargar_catalogo),
+        ("métricas", MetricasRepo.obtener),
+    ]
+    try:
+        for nombre, paso in pasos:
+            try:
+                paso()
+                arranque.marcar(f"precarga: {nombre}")
+            except Exception as e:
+                logger.warning(f"Precarga de {nombre} falló: {e}")
+    finally:
+        _lista.set()
+
+def _cargar_puntos():
+    global _puntos, _punto_venta_id
+    # Import diferido: nueva_venta importa este módulo
+    from nueva_venta import elegir_punto_venta
+    puntos = PuntoVentaRepo.listar()
+    # El id antes que la lista: quien ya ve la lista debe ver también el id
+    if puntos:
+        _punto_venta_id = elegir_punto_venta(puntos)
+    _puntos = puntos
+
+def _cargar_catalogo():
+    # get_indice() carga el catálogo y arma el índice del autocompletado
+    from busqueda import get_indice
+    get_indice()
@@ -1,6 +1,44 @@
-from typing import List, Dict, Optional, Any
-from config import get_connection
+from typing import List, Dict, Optional, Any, Callable, Iterable
+from collections.abc import Mapping
+from config import (get_connection, es_error_transitorio, es_deadlock,
+                    RETRY_INTENTOS, RETRY_ESPERA, VENTA_TIMEOUT)
+import datetime
+import random
+import threading
 import time 
+# ----------------- Notificaciones de escritura -----------------
+# Las cachés (p. ej. catalogo.py) se suscriben para enterarse de las
+# escrituras hechas por este proceso sin que repos dependa de ellas.
+_suscriptores: List[Callable[[str, Optional[List[int]]], None]] = []
+
+def suscribir_cambios(callback: Callable[[str, Optional[List[int]]], None]):
+    """callback(tabla, ids) tras cada commit; ids=None significa 'toda la tabla'"""
+    if callback not in _suscriptores:
+        _suscriptores.append(callback)
+
+def _notificar(tabla: str, ids: Optional[Iterable[int]] = None):
+    ids = list(ids) if ids is not None else None
+    for callback in list(_suscriptores):
+        try:
+            callback(tabla, ids)
+        except Exception as e:
+            print(f"Error notificando cambios en {tabla}: {e}")
+
+class StockInsuficiente(ValueError):
+    """
+    crear_venta rechazó la venta: alguna línea pide más stock del que hay.
+    lineas = [{"producto_id", "nombre", "solicitado", "disponible"}, ...]
+    (disponible es None si el producto ya no existe).
+    """
+
+    def __init__(self, lineas: List[Dict[str, Any]]):
+        self.lineas = lineas
+        detalle = "; ".join(
+            f"{l['nombre'] or l['producto_id']}: solicitado {l['solicitado']}, "
+            f"disponible {l['disponible'] if l['disponible'] is not None else 'producto inexistente'}"
+            for l in lineas)
+        super().__init__(f"Stock insuficiente - {detalle}")
+
 # ----------------- Helpers -----------------
 def _dict_rows(cur) -> List[Dict[str, Any]]:
     cols = [c[0] for c in cur.description]
@@ -13,6 +51,156 @@ def _dict_one(cur) -> Optional[Dict[str, Any]]:
     cols = [c[0] for c in cur.description]
     return dict(zip(cols, row))
 
+# ----------------- Esquema -----------------
+# Los cambios de esquema están en sql/migraciones y los aplica un usuario con
+# permisos de DDL; la aplicación sólo verifica, una vez por proceso, que estén.
+_migraciones_verificadas = set()
+_migraciones_lock = threading.Lock()
+
+def _requerir_migracion(archivo: str, consulta: str):
+    """consulta devuelve 1 si la migración 'archivo' ya está aplicada"""
+    if archivo in _migraciones_verificadas:
+        return
+    with _migraciones_lock:
+        if archivo in _migraciones_verificadas:
+            return
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(consulta)
+            fila = cur.fetchone()
+        finally:
+            conn.close()
+        if not fila or not fila[0]:
+            raise RuntimeError(f"Falta aplicar sql/migraciones/{archivo} en la base de datos")
+        _migraciones_verificadas.add(archivo)
+
+# ----------------- Filas compactas -----------------
+# Para resultados grandes (catálogo): en vez de un dict por fila con las
+# claves repetidas, una clase con __slots__ por conjunto de columnas.
+
+class Fila(Mapping):
+    """
+    Fila con __slots__ que se usa como un dict de sólo lectura: p['x'],
+    p.get('x'), dict(p), == contra dicts. Las clases concretas salen de clase_fila().
+    """
+
+    __slots__ = ()
+    _columnas: tuple = ()
+    _slots: tuple = ()
+    _pos: Dict[str, str] = {}
+
+    def __init__(self, *valores):
+        for slot, valor in zip(self._slots, valores):
+            setattr(self, slot, valor)
+
+    def __getitem__(self, columna):
+        try:
+            return getattr(self, self._pos[columna])
+        except KeyError:
+            raise KeyError(columna) from None
+
+    def __contains__(self, columna):
+        return columna in self._pos
+
+    def __iter__(self):
+        return iter(self._columnas)
+
+    def __len__(self):
+        return len(self._columnas)
+
+    def valores(self) -> tuple:
+        return tuple(getattr(self, slot) for slot in self._slots)
+
+    def __eq__(self, otra):
+        if type(otra) is type(self):
+            return self.valores() == otra.valores()
+        return Mapping.__eq__(self, otra)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Fila({dict(self)!r})"
+
+    def __reduce__(self):
+        return (_fila, (self._columnas, self.valores()))
+
+_clases_fila: Dict[tuple, type] = {}
+
+def clase_fila(columnas: Iterable[str]) -> type:
+    """Subclase de Fila para estas columnas (una sola por conjunto de columnas)"""
+    columnas = tuple(columnas)
+    clase = _clases_fila.get(columnas)
+    if clase is None:
+        # Los nombres que chocan con métodos o no son identificadores usan un slot genérico
+        reservados = set(dir(Fila))
+        slots = []
+        for i, columna in enumerate(columnas):
+            valido = columna.isidentifier() and not columna.startswith('_') \
+                and columna not in reservados and columna not in slots
+            slots.append(columna if valido else f"_c{i}")
+        clase = type("Fila", (Fila,), {
+            "__slots__": tuple(slots),
+            "_columnas": columnas,
+            "_slots": tuple(slots),
+            "_pos": dict(zip(columnas, slots)),
+        })
+        _clases_fila[columnas] = clase
+    return clase
+
+def _fila(columnas, valores) -> Fila:
+    return clase_fila(columnas)(*valores)
+
+def _compact_rows(cur) -> List[Fila]:
+    clase = clase_fila(c[0] for c in cur.description)
+    return [clase(*row) for row in cur.fetchall()]
+
+# Filas por fetchmany() en las lecturas por streaming
+STREAM_ARRAYSIZE = 500
+
+# Ids por IN (...) en buscar_por_ids; SQL Server admite hasta 2100 parámetros
+IDS_POR_CONSULTA = 1000
+
+def _stream(sql: str, params=(), arraysize: Optional[int] = None,
+            filas: str = "dict", lotes: bool = False):
+    """
+    Generador sobre una consulta: trae las filas de a 'arraysize' con
+    fetchmany() y las entrega a medida que llegan (de a una, o la lista del
+    lote si lotes=True). La conexión es exclusiva y se devuelve al pool al
+    terminar de iterar o al cerrar el generador.
+    filas: "dict" o "compacta" (Fila).
+    """
+    arraysize = arraysize or STREAM_ARRAYSIZE
+    conn = get_connection(exclusiva=True)
+    try:
+        cur = conn.cursor()
+        cur.arraysize = arraysize
+        cur.execute(sql, params)
+        columnas = [c[0] for c in cur.description]
+        if filas == "compacta":
+            fabrica = clase_fila(columnas)
+            convertir = lambda row: fabrica(*row)
+        else:
+            convertir = lambda row: dict(zip(columnas, row))
+        while True:
+            lote = cur.fetchmany(arraysize)
+            if not lote:
+                break
+            if lotes:
+                yield [convertir(row) for row in lote]
+            else:
+                for row in lote:
+                    yield convertir(row)
+        cur.close()
+    finally:
+        conn.close()
+
+def _rows(cur, filas: str = "dict"):
+    """Filas del cursor en el formato pedido: "dict" o "compacta" (Fila)"""
+    if filas == "compacta":
+        return _compact_rows(cur)
+    return _dict_rows(cur)
+
 # ----------------- Categorías -----------------
 # En repos.py, agregar estos métodos a la clase CategoriaRepo
 class CategoriaRepo:
@@ -26,6 +214,27 @@ class CategoriaRepo:
         finally:
             conn.close()
 
+    @staticmethod
+    def listar_con_conteos() -> List[Dict[str, Any]]:
+        """Categorías con la cantidad de productos de cada una ('productos'), en una consulta"""
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            # Se agrupa aparte para no agrupar por descripcion (puede ser texto largo)
+            cur.execute("""
+                SELECT c.id, c.nombre, c.descripcion, ISNULL(n.productos, 0) AS productos
+                FROM categorias c
+                LEFT JOIN (
+                    SELECT categoria_id, COUNT(*) AS productos
+                    FROM productos
+                    GROUP BY categoria_id
+                ) n ON n.categoria_id = c.id
+                ORDER BY c.nombre
+            """)
+            return _dict_rows(cur)
+        finally:
+            conn.close()
+
     @staticmethod
     def agregar(nombre: str, descripcion: str = None):
         conn = get_connection()
@@ -35,6 +244,7 @@ class CategoriaRepo:
             conn.commit()
         finally:
             conn.close()
+        _notificar("categorias")
 
     @staticmethod
     def actualizar(categoria_id: int, nombre: str, descripcion: str = None):
@@ -50,6 +260,7 @@ class CategoriaRepo:
             conn.commit()
         finally:
             conn.close()
+        _notificar("categorias", [categoria_id])
 
     @staticmethod
     def eliminar(categoria_id: int):
@@ -68,6 +279,7 @@ class CategoriaRepo:
             conn.commit()
         finally:
             conn.close()
+        _notificar("categorias", [categoria_id])
 
     @staticmethod
     def buscar_por_id(categoria_id: int) -> Optional[Dict[str, Any]]:
@@ -81,6 +293,15 @@ class CategoriaRepo:
             conn.close()
 
 # ----------------- Productos -----------------
+# Columnas del catálogo (catalogo.py): las de listar() + categoria_id y fecha_modificacion
+_SELECT_CATALOGO = """
+    SELECT p.id, p.codigo_barras, p.nombre, p.precio, p.stock, 
+           ISNULL(c.nombre,'') AS categoria, p.activo,
+           p.categoria_id, p.fecha_modificacion
+    FROM productos p
+    LEFT JOIN categorias c ON p.categoria_id = c.id
+"""
+
 class ProductoRepo:
     @staticmethod
     def listar() -> List[Dict[str, Any]]:
@@ -99,37 +320,129 @@ class ProductoRepo:
             conn.close()
 
     @staticmethod
-    def buscar(codigo_o_nombre: str) -> Optional[Dict[str, Any]]:
+    def iterar_catalogo(arraysize: Optional[int] = None, filas: str = "dict", lotes: bool = False):
+        """Como listar_catalogo() sin 'desde' pero por streaming (ver _stream), para la carga completa"""
+        return _stream(_SELECT_CATALOGO, arraysize=arraysize, filas=filas, lotes=lotes)
+
+    @staticmethod
+    def listar_catalogo(desde=None, desde_id: Optional[int] = None, filas: str = "dict") -> List[Dict[str, Any]]:
+        """
+        Catálogo con categoria_id y fecha_modificacion para catalogo.py.
+        Con 'desde' devuelve sólo lo modificado a partir de esa fecha o con
+        id mayor a 'desde_id' (altas que no traen fecha_modificacion).
+        filas: "dict" o "compacta" (ver _rows).
+        """
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            sql = _SELECT_CATALOGO
+            condiciones, params = [], []
+            if desde is not None:
+                condiciones.append("p.fecha_modificacion >= ?")
+                params.append(desde)
+            if desde_id is not None:
+                condiciones.append("p.id > ?")
+                params.append(desde_id)
+            if condiciones:
+                sql += " WHERE " + " OR ".join(condiciones)
+            cur.execute(sql, params)
+            return _rows(cur, filas)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def firma_catalogo() -> Dict[str, Any]:
+        """Cantidad y mayor id de productos y checksum de categorías, para validar copias locales"""
         conn = get_connection()
         try:
             cur = conn.cursor()
             cur.execute("""
-                SELECT id, codigo_barras, nombre, precio, stock, activo
-                FROM productos
-                WHERE codigo_barras = ? OR nombre LIKE ?
-            """, (codigo_o_nombre, f"%{codigo_o_nombre}%"))
+                SELECT (SELECT COUNT(*) FROM productos) AS cantidad,
+                       (SELECT ISNULL(MAX(id), 0) FROM productos) AS max_id,
+                       (SELECT ISNULL(CHECKSUM_AGG(CHECKSUM(id, nombre)), 0) FROM categorias) AS categorias
+            """)
             return _dict_one(cur)
         finally:
             conn.close()
 
+    # Columnas por las que buscar_filtrado puede ordenar
+    _ORDENES_FILTRADO = {
+        "id": "p.id",
+        "codigo_barras": "p.codigo_barras",
+        "nombre": "p.nombre",
+        "precio": "p.precio",
+        "stock": "p.stock",
+        "categoria": "c.nombre",
+        "activo": "p.activo",
+    }
     @staticmethod
-    def buscar_por_id(producto_id: int) -> Optional[Dict[str, Any]]:
-        """Buscar producto por ID específico"""
+    def buscar_filtrado(query: Optional[str] = None, estado: Optional[bool] = None,
+                        categoria: Optional[int] = None, limit: int = 200, offset: int = 0,
+                        orden: str = "nombre", descendente: bool = False) -> Dict[str, Any]:
+        """
+        Página de productos filtrada en el servidor, con el total de coincidencias:
+        {"filas": [...], "total": n}. query coincide con el código de barras
+        exacto o con el inicio del nombre (predicados que usan índices; el de
+        nombre está en sql/migraciones/003); estado: True activos, False
+        inactivos, None todos; categoria: id.
+        """
+        condiciones, params = [], []
+        query = (query or "").strip()
+        if query:
+            # Los comodines de LIKE que escriba el usuario se buscan literales
+            prefijo = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("[", "\\[")
+            condiciones.append("(p.codigo_barras = ? OR p.nombre LIKE ? ESCAPE '\\')")
+            params.extend([query, prefijo + "%"])
+        if estado is not None:
+            condiciones.append("p.activo = ?")
+            params.append(1 if estado else 0)
+        if categoria is not None:
+            condiciones.append("p.categoria_id = ?")
+            params.append(categoria)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        columna = ProductoRepo._ORDENES_FILTRADO.get(orden, "p.nombre")
+        sentido = "DESC" if descendente else "ASC"
+
         conn = get_connection()
         try:
             cur = conn.cursor()
-            cur.execute("""
-                SELECT p.id, p.codigo_barras, p.nombre, p.precio, p.stock, 
-                       p.stock_minimo, p.proveedor, p.activo, p.categoria_id,
-                       ISNULL(c.nombre, '') AS categoria
+            cur.execute(f"""
+                SELECT p.id, p.codigo_barras, p.nombre, p.precio, p.stock,
+                       ISNULL(c.nombre,'') AS categoria, p.activo, p.categoria_id,
+                       COUNT(*) OVER () AS total_filtrado
                 FROM productos p
                 LEFT JOIN categorias c ON p.categoria_id = c.id
-                WHERE p.id = ?
-            """, (producto_id,))
+                {where}
+                ORDER BY {columna} {sentido}, p.id {sentido}
+                OFFSET ? ROWS FETCH NEXT ? ROWS ONLY
+            """, params + [offset, limit])
+            filas = _dict_rows(cur)
+            if filas:
+                total = filas[0]["total_filtrado"]
+                for fila in filas:
+                    del fila["total_filtrado"]
+            elif offset:
+                # Página más allá del final: el total sale aparte
+                cur.execute(f"""
+                    SELECT COUNT(*) FROM productos p
+                    LEFT JOIN categorias c ON p.categoria_id = c.id
+                    {where}
+                """, params)
+                total = cur.fetchone()[0]
+            else:
+                total = 0
+            return {"filas": filas, "total": total}
+        finally:
+            conn.close()
+
+    @staticmethod
+    def buscar_por_codigo(codigo_barras: str) -> Optional[Dict[str, Any]]:
+        """Búsqueda exacta por código de barras (usa el índice de codigo_barras)"""
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(_SELECT_CATALOGO + " WHERE p.codigo_barras = ?", (codigo_barras,))
             return _dict_one(cur)
-        except Exception as e:
-            print(f"Error buscando producto por ID: {e}")
-            return None
         finally:
             conn.close()
 
@@ -147,6 +460,39 @@ class ProductoRepo:
         finally:
             conn.close()
 
+    @staticmethod
+    def buscar_por_id(producto_id: int) -> Optional[Dict[str, Any]]:
+        """Buscar producto por ID específico"""
+        try:
+            return ProductoRepo.buscar_por_ids([producto_id]).get(producto_id)
+        except Exception as e:
+            print(f"Error buscando producto por ID: {e}")
+            return None
+
+    @staticmethod
+    def buscar_por_ids(ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """Varios productos en una consulta: {id: producto}; los que no existen no aparecen"""
+        pedidos = list(dict.fromkeys(ids))
+        productos: Dict[int, Dict[str, Any]] = {}
+        if pedidos:
+            conn = get_connection()
+            try:
+                cur = conn.cursor()
+                for i in range(0, len(pedidos), IDS_POR_CONSULTA):
+                    tanda = pedidos[i:i + IDS_POR_CONSULTA]
+                    cur.execute(f"""
+                        SELECT p.id, p.codigo_barras, p.nombre, p.precio, p.stock, 
+                               p.stock_minimo, p.proveedor, p.activo, p.categoria_id,
+                               ISNULL(c.nombre, '') AS categoria
+                        FROM productos p
+                        LEFT JOIN categorias c ON p.categoria_id = c.id
+                        WHERE p.id IN ({', '.join('?' * len(tanda))})
+                    """, tanda)
+                    productos.update((p['id'], p) for p in _dict_rows(cur))
+            finally:
+                conn.close()
+        return productos
+
     @staticmethod
     def agregar(nombre, precio, stock, categoria_id=None, codigo=None):
         if not codigo:  # si no se pasa código, generar uno automático
@@ -159,6 +505,7 @@ class ProductoRepo:
                 VALUES (?, ?, ?, ?, ?)
             """, (codigo, nombre, precio, stock, categoria_id))
             conn.commit()
+        _notificar("productos")
 
     @staticmethod
     def actualizar_precio(producto_id: int, nuevo_precio: float):
@@ -169,23 +516,9 @@ class ProductoRepo:
             conn.commit()
         finally:
             conn.close()
+        _notificar("productos", [producto_id])
+
 
-     
-    @staticmethod
-    def buscar_por_id(producto_id: int) -> Optional[Dict[str, Any]]:
-        """Buscar producto por ID específico"""
-        conn = get_connection()
-        try:
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT id, codigo_barras, nombre, precio, stock, activo
-                FROM productos
-                WHERE id = ?
-            """, (producto_id,))
-            return _dict_one(cur)
-        finally:
-            conn.close()
-            
     @staticmethod
     def actualizar_completo(producto_id: int, nombre: str, precio: float, codigo_barras: str = None,
                           categoria_id: int = None, stock: int = None, stock_minimo: int = None,
@@ -240,6 +573,7 @@ class ProductoRepo:
             raise e
         finally:
             conn.close()
+        _notificar("productos", [producto_id])
 
     @staticmethod
     def actualizar_stock(producto_id: int, nuevo_stock: int):
@@ -258,27 +592,7 @@ class ProductoRepo:
             raise e
         finally:
             conn.close()
-
-    @staticmethod
-    def buscar_por_id(producto_id: int) -> Optional[Dict[str, Any]]:
-        """Buscar producto por ID específico"""
-        conn = get_connection()
-        try:
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT p.id, p.codigo_barras, p.nombre, p.precio, p.stock, 
-                       p.stock_minimo, p.proveedor, p.activo, p.categoria_id,
-                       ISNULL(c.nombre, '') AS categoria
-                FROM productos p
-                LEFT JOIN categorias c ON p.categoria_id = c.id
-                WHERE p.id = ?
-            """, (producto_id,))
-            return _dict_one(cur)
-        except Exception as e:
-            print(f"Error buscando producto por ID: {e}")
-            return None
-        finally:
-            conn.close()
+        _notificar("productos", [producto_id])
 
 class PuntoVentaRepo:
     @staticmethod
@@ -302,53 +616,155 @@ class PuntoVentaRepo:
             conn.close()
 
 class VentaRepo:
+    # Filas por INSERT ... VALUES (SQL Server admite 1000 filas y 2100 parámetros)
+    _LOTE_ITEMS = 900
+
+    @staticmethod
+    def _verificar_esquema():
+        """Columna ventas.clave_idempotencia con su índice único y tablas de resumen"""
+        ResumenRepo._verificar_tablas()
+        _requerir_migracion("002_ventas_clave_idempotencia.sql", """
+            SELECT CASE WHEN EXISTS (SELECT 1 FROM sys.indexes
+                                     WHERE name = 'UX_ventas_clave_idempotencia'
+                                       AND object_id = OBJECT_ID('ventas')) THEN 1 ELSE 0 END
+        """)
+
     @staticmethod
-    def crear_venta(punto_venta_id: int, items: List[Dict[str, Any]], forma_pago="EFECTIVO", descuento=0.0) -> int:
+    def crear_venta(punto_venta_id: int, items: List[Dict[str, Any]], forma_pago="EFECTIVO", descuento=0.0,
+                    clave: Optional[str] = None, antiguedad: float = 0) -> int:
         """
         Crea una venta con sus detalles, descuenta stock e inserta movimientos_stock.
         items = [{"producto_id":1,"nombre":"X","precio":100,"cantidad":2}, ...]
+        La cantidad de round-trips es constante: el detalle va en un solo
+        executemany y el stock se descuenta con un UPDATE ... FROM cuyo OUTPUT
+        alimenta movimientos_stock. Los resúmenes diarios (ResumenRepo) se
+        actualizan en la misma transacción.
+        El descuento es condicional (stock >= cantidad) y valida y reserva en
+        el mismo round-trip: si alguna línea no alcanza se deshace todo y se
+        lanza StockInsuficiente con el resultado de cada línea rechazada.
+        clave: clave de idempotencia; si ya hay una venta con esa clave se
+        devuelve su id sin volver a grabarla. antiguedad: segundos desde que se
+        hizo la venta (ventas que se envían tarde); la fecha se calcula con el
+        reloj del servidor, así el reloj de la PC no importa.
+        Los errores transitorios (deadlock, conexión caída, timeout) se
+        reintentan con backoff; sin clave sólo el deadlock, porque en los demás
+        no se sabe si el commit llegó al servidor.
         """
+        VentaRepo._verificar_esquema()
+        for intento in range(1, RETRY_INTENTOS + 1):
+            try:
+                return VentaRepo._grabar_venta(punto_venta_id, items, forma_pago, descuento, clave, antiguedad)
+            except Exception as e:
+                reintentable = es_deadlock(e) or (clave is not None and es_error_transitorio(e))
+                if not reintentable or intento == RETRY_INTENTOS:
+                    raise
+                espera = RETRY_ESPERA * 2 ** (intento - 1) * random.uniform(0.5, 1.5)
+                print(f"Reintentando venta ({intento}/{RETRY_INTENTOS - 1}) en {espera:.2f}s: {e}")
+                time.sleep(espera)
+
+    @staticmethod
+    def _grabar_venta(punto_venta_id, items, forma_pago, descuento, clave, antiguedad) -> int:
+        """Un intento de crear_venta, en una transacción"""
         conn = get_connection()
         try:
             conn.autocommit = False
+            # Timeout corto: si el servidor no responde se reintenta o la venta
+            # queda en el diario local, en vez de colgar la caja
+            conn.timeout = VENTA_TIMEOUT
             cur = conn.cursor()
 
+            if clave is not None:
+                # El lock sobre la clave dura hasta el commit: dos envíos
+                # simultáneos de la misma venta se serializan
+                cur.execute("SELECT id FROM ventas WITH (UPDLOCK, HOLDLOCK) WHERE clave_idempotencia = ?",
+                            (clave,))
+                existente = cur.fetchone()
+                if existente:
+                    conn.rollback()
+                    # Ya grabada por un envío anterior (quizá de otro proceso):
+                    # se avisa igual, las cachés de este pueden no haberla visto
+                    _notificar("productos", list({it['producto_id'] for it in items}))
+                    _notificar("ventas", [existente[0]])
+                    return existente[0]
+
             subtotal = sum(it['cantidad'] * it['precio'] for it in items)
             total = round(subtotal * (1 - descuento/100.0), 2)
 
             cur.execute("""
-                INSERT INTO ventas (fecha, total, descuento, forma_pago, punto_venta_id)
+                INSERT INTO ventas (fecha, total, descuento, forma_pago, punto_venta_id, clave_idempotencia)
                 OUTPUT INSERTED.id
-                VALUES (GETDATE(), ?, ?, ?, ?)
-            """, (total, descuento, forma_pago, punto_venta_id))
+                VALUES (DATEADD(SECOND, -?, GETDATE()), ?, ?, ?, ?, ?)
+            """, (max(0, int(antiguedad or 0)), total, descuento, forma_pago, punto_venta_id, clave))
             venta_id = cur.fetchone()[0]
 
-            for it in items:
-                
-                cur.execute("""
+            if items:
+                cur.fast_executemany = True
+                cur.executemany("""
                     INSERT INTO detalle_venta (venta_id, producto_id, cantidad, precio_unitario, precio_final, subtotal)
                     VALUES (?, ?, ?, ?, ?, ?)
-                """, (venta_id, it['producto_id'], it['cantidad'], it['precio'],
-                      it['precio']*it['cantidad'], it['precio']*it['cantidad']))
+                """, [(venta_id, it['producto_id'], it['cantidad'], it['precio'],
+                       it['precio']*it['cantidad'], it['precio']*it['cantidad']) for it in items])
+                cur.fast_executemany = False
 
-           
-                cur.execute("UPDATE productos SET stock = stock - ? WHERE id = ?", (it['cantidad'], it['producto_id']))
+            # Una fila por producto aunque aparezca en varias líneas
+            cantidades: Dict[int, int] = {}
+            for it in items:
+                cantidades[it['producto_id']] = cantidades.get(it['producto_id'], 0) + it['cantidad']
+
+            pares = list(cantidades.items())
+            rechazadas = []
+            for i in range(0, len(pares), VentaRepo._LOTE_ITEMS):
+                lote = pares[i:i + VentaRepo._LOTE_ITEMS]
+                valores = ", ".join("(?, ?)" for _ in lote)
+                cur.execute(f"""
+                    SET NOCOUNT ON;
+                    DECLARE @items TABLE (producto_id INT PRIMARY KEY, cantidad INT NOT NULL);
+                    DECLARE @mov TABLE (producto_id INT, cantidad INT, stock_anterior INT, stock_nuevo INT);
+
+                    INSERT INTO @items (producto_id, cantidad) VALUES {valores};
+
+                    UPDATE p SET p.stock = p.stock - i.cantidad, p.fecha_modificacion = GETDATE()
+                    OUTPUT INSERTED.id, i.cantidad, DELETED.stock, INSERTED.stock
+                        INTO @mov (producto_id, cantidad, stock_anterior, stock_nuevo)
+                    FROM productos p
+                    JOIN @items i ON i.producto_id = p.id
+                    WHERE p.stock >= i.cantidad;
 
-             
-                cur.execute("""
                     INSERT INTO movimientos_stock (producto_id, tipo, cantidad, stock_anterior, stock_nuevo)
-                    VALUES (?, 'VENTA', ?, 
-                        (SELECT stock + ? FROM productos WHERE id=?),
-                        (SELECT stock FROM productos WHERE id=?))
-                """, (it['producto_id'], it['cantidad'], it['cantidad'], it['producto_id'], it['producto_id']))
+                    SELECT producto_id, 'VENTA', cantidad, stock_anterior, stock_nuevo FROM @mov;
+
+                    -- Líneas que no se pudieron descontar
+                    SELECT i.producto_id, i.cantidad, p.stock
+                    FROM @items i
+                    LEFT JOIN productos p ON p.id = i.producto_id
+                    WHERE NOT EXISTS (SELECT 1 FROM @mov m WHERE m.producto_id = i.producto_id);
+                """, [v for par in lote for v in par])
+                rechazadas.extend(cur.fetchall())
+
+            if rechazadas:
+                nombres = {it['producto_id']: it.get('nombre') for it in items}
+                raise StockInsuficiente([
+                    {"producto_id": pid, "nombre": nombres.get(pid), "solicitado": cantidad, "disponible": stock}
+                    for pid, cantidad, stock in rechazadas])
 
+            cur.execute(ResumenRepo._SQL_ACUMULAR_VENTA, (venta_id, venta_id))
             conn.commit()
-            return venta_id
         except:
-            conn.rollback()
+            # Con la conexión caída el rollback también falla; se conserva el error original
+            try:
+                conn.rollback()
+            except Exception:
+                pass
             raise
         finally:
+            try:
+                conn.timeout = 0
+            except Exception:
+                pass
             conn.close()
+        _notificar("productos", list(cantidades))
+        _notificar("ventas", [venta_id])
+        return venta_id
 
     @staticmethod
     def listar(limit=50) -> List[Dict[str, Any]]:
@@ -359,3 +775,200 @@ class VentaRepo:
             return _dict_rows(cur)
         finally:
             conn.close()
+
+    @staticmethod
+    def _filtros(desde=None, hasta=None, punto_venta_id=None, forma_pago=None):
+        """Condiciones WHERE y parámetros comunes a las consultas de ventas"""
+        condiciones, params = [], []
+        if desde is not None:
+            condiciones.append("fecha >= ?")
+            params.append(desde)
+        if hasta is not None:
+            condiciones.append("fecha < ?")
+            params.append(hasta)
+        if punto_venta_id is not None:
+            condiciones.append("punto_venta_id = ?")
+            params.append(punto_venta_id)
+        if forma_pago:
+            condiciones.append("forma_pago = ?")
+            params.append(forma_pago)
+        return condiciones, params
+
+    @staticmethod
+    def listar_pagina(limit=100, despues=None, desde=None, hasta=None,
+                      punto_venta_id=None, forma_pago=None) -> List[Dict[str, Any]]:
+        """
+        Página de ventas de la más nueva a la más vieja, por keyset sobre
+        (fecha, id): despues=(fecha, id) de la última fila de la página
+        anterior. desde inclusive, hasta exclusivo.
+        """
+        condiciones, params = VentaRepo._filtros(desde, hasta, punto_venta_id, forma_pago)
+        if despues is not None:
+            fecha, venta_id = despues
+            # pyodbc manda la fecha como DATETIME2: sin el CAST no vuelve a
+            # redondearse a los 1/300 s de la columna y 'fecha = ?' puede fallar
+            condiciones.append("(fecha < CAST(? AS DATETIME) OR (fecha = CAST(? AS DATETIME) AND id < ?))")
+            params.extend([fecha, fecha, venta_id])
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT TOP (?) id, fecha, total, forma_pago, punto_venta_id
+                FROM ventas
+                {where}
+                ORDER BY fecha DESC, id DESC
+            """, [limit] + params)
+            return _dict_rows(cur)
+        finally:
+            conn.close()
+
+# ----------------- Resúmenes diarios -----------------
+class ResumenRepo:
+    """
+    Ventas pre-agregadas por día: por punto de venta y forma de pago
+    (resumen_ventas_diario) y por producto (resumen_productos_diario).
+    crear_venta las acumula en su transacción, así los reportes leen
+    O(días) filas en lugar de recorrer ventas y detalle_venta.
+    Las tablas y la carga del historial están en sql/migraciones/001.
+    """
+    # Suma una venta ya insertada (parámetros: venta_id, venta_id)
+    _SQL_ACUMULAR_VENTA = """
+        SET NOCOUNT ON;
+        MERGE resumen_ventas_diario WITH (HOLDLOCK) AS r
+        USING (
+            SELECT CAST(fecha AS DATE) AS fecha, ISNULL(punto_venta_id, 0) AS punto_venta_id,
+                   ISNULL(forma_pago, '') AS forma_pago, total
+            FROM ventas WHERE id = ?
+        ) AS s
+        ON r.fecha = s.fecha AND r.punto_venta_id = s.punto_venta_id AND r.forma_pago = s.forma_pago
+        WHEN MATCHED THEN
+            UPDATE SET cantidad_ventas = r.cantidad_ventas + 1, total = r.total + s.total
+        WHEN NOT MATCHED THEN
+            INSERT (fecha, punto_venta_id, forma_pago, cantidad_ventas, total)
+            VALUES (s.fecha, s.punto_venta_id, s.forma_pago, 1, s.total);
+
+        MERGE resumen_productos_diario WITH (HOLDLOCK) AS r
+        USING (
+            SELECT CAST(v.fecha AS DATE) AS fecha, d.producto_id,
+                   SUM(d.cantidad) AS cantidad, SUM(d.subtotal) AS importe
+            FROM detalle_venta d
+            JOIN ventas v ON v.id = d.venta_id
+            WHERE d.venta_id = ?
+            GROUP BY CAST(v.fecha AS DATE), d.producto_id
+        ) AS s
+        ON r.fecha = s.fecha AND r.producto_id = s.producto_id
+        WHEN MATCHED THEN
+            UPDATE SET cantidad = r.cantidad + s.cantidad, importe = r.importe + s.importe
+        WHEN NOT MATCHED THEN
+            INSERT (fecha, producto_id, cantidad, importe)
+            VALUES (s.fecha, s.producto_id, s.cantidad, s.importe);
+    """
+
+    @staticmethod
+    def _verificar_tablas():
+        _requerir_migracion("001_resumenes_diarios.sql", """
+            SELECT CASE WHEN OBJECT_ID('resumen_ventas_diario', 'U') IS NOT NULL
+                         AND OBJECT_ID('resumen_productos_diario', 'U') IS NOT NULL THEN 1 ELSE 0 END
+        """)
+
+    @staticmethod
+    def _filtros(desde=None, hasta=None, punto_venta_id=None, forma_pago=None):
+        """Como VentaRepo._filtros pero por día: desde y hasta inclusive"""
+        condiciones, params = [], []
+        if desde is not None:
+            condiciones.append("fecha >= ?")
+            params.append(desde.date() if isinstance(desde, datetime.datetime) else desde)
+        if hasta is not None:
+            condiciones.append("fecha <= ?")
+            params.append(hasta.date() if isinstance(hasta, datetime.datetime) else hasta)
+        if punto_venta_id is not None:
+            condiciones.append("punto_venta_id = ?")
+            params.append(punto_venta_id)
+        if forma_pago:
+            condiciones.append("forma_pago = ?")
+            params.append(forma_pago)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        return where, params
+
+    @staticmethod
+    def totales(desde=None, hasta=None, punto_venta_id=None, forma_pago=None) -> Dict[str, Any]:
+        """{cantidad_ventas, total} del período"""
+        ResumenRepo._verificar_tablas()
+        where, params = ResumenRepo._filtros(desde, hasta, punto_venta_id, forma_pago)
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT ISNULL(SUM(cantidad_ventas), 0) AS cantidad_ventas, ISNULL(SUM(total), 0) AS total
+                FROM resumen_ventas_diario
+                {where}
+            """, params)
+            return _dict_one(cur)
+        finally:
+            conn.close()
+
+# ----------------- Métricas -----------------
+class MetricasRepo:
+    """KPIs del dashboard y del header en una sola consulta, con caché corta compartida"""
+    TTL = 15.0          # segundos que se reutiliza el último resultado
+    STOCK_BAJO = 10     # stock por debajo del cual un producto cuenta como bajo
+
+    _cache: Optional[Dict[str, Any]] = None
+    _cache_momento = 0.0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def consultar(stock_bajo: int = STOCK_BAJO) -> Dict[str, Any]:
+        """Todas las métricas directo del servidor (sin caché)"""
+        ResumenRepo._verificar_tablas()
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT p.total_productos, p.productos_activos, p.stock_bajo,
+                       v.ventas_hoy, v.ingresos_hoy, v.ventas_total, v.ingresos_total
+                FROM (
+                    SELECT COUNT(*) AS total_productos,
+                           ISNULL(SUM(CASE WHEN activo = 1 THEN 1 ELSE 0 END), 0) AS productos_activos,
+                           ISNULL(SUM(CASE WHEN stock < ? THEN 1 ELSE 0 END), 0) AS stock_bajo
+                    FROM productos
+                ) p
+                CROSS JOIN (
+                    -- 'Hoy' según el reloj del servidor, el mismo que fecha las ventas
+                    SELECT ISNULL(SUM(CASE WHEN fecha = CAST(GETDATE() AS DATE) THEN cantidad_ventas END), 0) AS ventas_hoy,
+                           ISNULL(SUM(CASE WHEN fecha = CAST(GETDATE() AS DATE) THEN total END), 0) AS ingresos_hoy,
+                           ISNULL(SUM(cantidad_ventas), 0) AS ventas_total,
+                           ISNULL(SUM(total), 0) AS ingresos_total
+                    FROM resumen_ventas_diario
+                ) v
+            """, (stock_bajo,))
+            return _dict_one(cur)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def obtener(max_edad: Optional[float] = None) -> Dict[str, Any]:
+        """Métricas cacheadas; se consultan de nuevo si tienen más de max_edad (TTL) segundos"""
+        max_edad = MetricasRepo.TTL if max_edad is None else max_edad
+        with MetricasRepo._lock:
+            if MetricasRepo._cache is not None and \
+                    time.monotonic() - MetricasRepo._cache_momento <= max_edad:
+                return dict(MetricasRepo._cache)
+        datos = MetricasRepo.consultar()
+        with MetricasRepo._lock:
+            MetricasRepo._cache = datos
+            MetricasRepo._cache_momento = time.monotonic()
+        return dict(datos)
+
+    @staticmethod
+    def invalidar():
+        with MetricasRepo._lock:
+            MetricasRepo._cache = None
+
+    @staticmethod
+    def _on_cambio(tabla: str, ids: Optional[List[int]]):
+        if tabla in ("productos", "ventas"):
+            MetricasRepo.invalidar()
+
+suscribir_cambios(MetricasRepo._on_cambio)
@@ -12,11 +12,9 @@ from decimal import Decimal
 import logging
 import os
 from typing import List, Dict, Any
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
 import tempfile
-from repos import ProductoRepo, VentaRepo, PuntoVentaRepo
+from repos import VentaRepo, PuntoVentaRepo, StockInsuficiente
+from catalogo import get_catalogo
 
 logger = logging.getLogger("SimulacionVentasPro")
 
@@ -35,11 +33,12 @@ class SimuladorVentasPro:
     def cargar_productos_reales(self):
         """Cargar productos reales de la base de datos - SOLO ACTIVOS Y CON STOCK"""
         try:
-            todos_productos = ProductoRepo.listar()
+            todos_productos = get_catalogo().productos()
             
-            # Filtrar solo productos activos y con stock > 0
+            # Filtrar solo productos activos y con stock > 0 (copias: abajo se
+            # modifica el precio y las filas del catálogo son compartidas)
             self.productos_disponibles = [
-                p for p in todos_productos 
+                dict(p) for p in todos_productos 
                 if p.get('activo', True) and p.get('stock', 0) > 0
             ]
             
@@ -85,29 +84,6 @@ class SimuladorVentasPro:
             probabilidad = peso * precio_factor * stock_factor
             self.probabilidades_productos[producto['id']] = probabilidad
     
-    def _obtener_producto_actualizado(self, producto_id):
-        """Obtener información actualizada del producto desde la BD"""
-        try:
-            producto_actual = ProductoRepo.buscar_por_id(producto_id)
-            if producto_actual and producto_actual.get('activo', True):
-                if isinstance(producto_actual['precio'], Decimal):
-                    producto_actual['precio'] = float(producto_actual['precio'])
-                return producto_actual
-        except Exception as e:
-            logger.error(f"Error obteniendo producto actualizado: {e}")
-        return None
-    
-    def _verificar_stock_suficiente(self, producto_id, cantidad):
-        """Verificar que el producto tenga stock suficiente"""
-        try:
-            producto = self._obtener_producto_actualizado(producto_id)
-            if producto and producto.get('stock', 0) >= cantidad:
-                return True, producto
-            return False, producto
-        except Exception as e:
-            logger.error(f"Error verificando stock: {e}")
-            return False, None
-    
     def _generar_carrito_inteligente(self):
         """Generar carrito de compra inteligente con productos de la BD"""
         num_items = random.choices([1, 2, 3, 4, 5], 
@@ -132,30 +108,20 @@ class SimuladorVentasPro:
             producto_seleccionado = random.choices(productos_posibles, weights=pesos, k=1)[0]
             productos_intentados.add(producto_seleccionado['id'])
             
-            stock_ok, producto_actual = self._verificar_stock_suficiente(
-                producto_seleccionado['id'], 1
-            )
-            
-            if not stock_ok or not producto_actual:
-                continue
-            
-            max_cantidad = min(3, producto_actual.get('stock', 1))
+            # El stock del catálogo es orientativo: crear_venta lo valida y
+            # reserva en el servidor y rechaza las líneas que no alcanzan
+            max_cantidad = min(3, producto_seleccionado.get('stock', 1))
             cantidad = random.choices([1, 2, 3], weights=[0.8, 0.15, 0.05], k=1)[0]
             cantidad = min(cantidad, max_cantidad)
             
-            stock_final_ok, producto_final = self._verificar_stock_suficiente(
-                producto_seleccionado['id'], cantidad
-            )
-            
-            if stock_final_ok and producto_final:
-                carrito.append({
-                    'producto_id': producto_final['id'],
-                    'nombre': producto_final['nombre'],
-                    'precio': producto_final['precio'],
-                    'cantidad': cantidad,
-                    'categoria': producto_final.get('categoria', 'Otros'),
-                    'codigo_barras': producto_final.get('codigo_barras', '')
-                })
+            carrito.append({
+                'producto_id': producto_seleccionado['id'],
+                'nombre': producto_seleccionado['nombre'],
+                'precio': producto_seleccionado['precio'],
+                'cantidad': cantidad,
+                'categoria': producto_seleccionado.get('categoria', 'Otros'),
+                'codigo_barras': producto_seleccionado.get('codigo_barras', '')
+            })
         
         return carrito
     
@@ -197,6 +163,9 @@ class SimuladorVentasPro:
     def generar_ticket_pdf(self, venta_info, carrito):
         """Generar ticket en PDF profesional"""
         try:
+            # reportlab se importa recién al generar el primer ticket
+            from reportlab.lib.pagesizes import A4
+            from reportlab.pdfgen import canvas
        
             tickets_dir = "tickets_simulacion"
             os.makedirs(tickets_dir, exist_ok=True)
@@ -283,8 +252,37 @@ class SimuladorVentasPro:
             logger.error(f"Error generando PDF: {e}")
             return None
     
+    def _crear_venta_real(self, punto_venta_id, carrito, forma_pago):
+        """
+        Grabar la venta; si el servidor rechaza líneas por stock se quitan y se
+        reintenta una vez. Devuelve (venta_id, carrito grabado), o (None, []) si no quedó nada.
+        """
+        for _ in range(2):
+            if not carrito:
+                break
+            items_venta = [{
+                'producto_id': item['producto_id'],
+                'nombre': item['nombre'],
+                'precio': item['precio'],
+                'cantidad': item['cantidad']
+            } for item in carrito]
+            try:
+                venta_id = VentaRepo.crear_venta(
+                    punto_venta_id=punto_venta_id,
+                    items=items_venta,
+                    forma_pago=forma_pago
+                )
+                return venta_id, carrito
+            except StockInsuficiente as e:
+                rechazados = {linea['producto_id'] for linea in e.lineas}
+                for item in carrito:
+                    if item['producto_id'] in rechazados:
+                        logger.warning(f"Stock insuficiente para {item['nombre']}")
+                carrito = [item for item in carrito if item['producto_id'] not in rechazados]
+        return None, []
+
     def simular_venta_unica(self):
-        """Simular una única venta con validación de stock en tiempo real"""
+        """Simular una única venta; el stock se valida al grabarla"""
         try:
             carrito = self._generar_carrito_inteligente()
             
@@ -292,41 +290,20 @@ class SimuladorVentasPro:
                 logger.warning("No se pudo generar carrito de compra válido")
                 return None
             
-            carrito_valido = []
-            for item in carrito:
-                stock_ok, producto_actual = self._verificar_stock_suficiente(
-                    item['producto_id'], item['cantidad']
-                )
-                if stock_ok and producto_actual:
-                    carrito_valido.append(item)
-                else:
-                    logger.warning(f"Stock insuficiente para {item['nombre']}")
-            
-            if not carrito_valido:
-                logger.warning("Carrito vacío después de validar stock")
-                return None
-            
             forma_pago = self._generar_forma_pago_realista()
-            total = sum(item['precio'] * item['cantidad'] for item in carrito_valido)
             
             puntos = PuntoVentaRepo.listar()
             punto_venta_id = puntos[0]['id'] if puntos else 1
             
-            items_venta = []
-            for item in carrito_valido:
-                items_venta.append({
-                    'producto_id': item['producto_id'],
-                    'nombre': item['nombre'],
-                    'precio': item['precio'],
-                    'cantidad': item['cantidad']
-                })
-            
+            carrito_valido = carrito
             try:
-                venta_id = VentaRepo.crear_venta(
-                    punto_venta_id=punto_venta_id,
-                    items=items_venta,
-                    forma_pago=forma_pago
-                )
+                venta_id, carrito_valido = self._crear_venta_real(punto_venta_id, carrito, forma_pago)
+                if venta_id is None:
+                    logger.warning("Carrito vacío después de validar stock")
+                    self.cargar_productos_reales()
+                    self._calcular_probabilidades()
+                    return None
+                total = sum(item['precio'] * item['cantidad'] for item in carrito_valido)
                 
                 venta_info = {
                     'venta_id': venta_id,
@@ -0,0 +1,52 @@
+-- 001: tablas de resúmenes diarios de ventas (ResumenRepo) y carga inicial
+-- con el historial existente.
+--
+-- crear_venta acumula cada venta en estas tablas dentro de su transacción;
+-- la aplicación sólo verifica que existan, no las crea. Correr una vez, con
+-- un usuario con permisos de DDL:
+--     sqlcmd -S <servidor> -d <base> -E -i sql\migraciones\001_resumenes_diarios.sql
+-- Se puede volver a correr: si las tablas ya están no hace nada.
+
+SET NOCOUNT ON;
+SET XACT_ABORT ON;
+
+BEGIN TRANSACTION;
+
+IF OBJECT_ID('resumen_ventas_diario', 'U') IS NULL
+BEGIN
+    CREATE TABLE resumen_ventas_diario (
+        fecha DATE NOT NULL,
+        punto_venta_id INT NOT NULL,
+        forma_pago VARCHAR(30) NOT NULL,
+        cantidad_ventas INT NOT NULL,
+        total DECIMAL(14, 2) NOT NULL,
+        CONSTRAINT PK_resumen_ventas_diario PRIMARY KEY (fecha, punto_venta_id, forma_pago)
+    );
+
+    -- TABLOCK + HOLDLOCK: ninguna venta se graba entre la carga y el COMMIT,
+    -- así no queda afuera del resumen ni se cuenta dos veces
+    INSERT INTO resumen_ventas_diario (fecha, punto_venta_id, forma_pago, cantidad_ventas, total)
+    SELECT CAST(fecha AS DATE), ISNULL(punto_venta_id, 0), ISNULL(forma_pago, ''), COUNT(*), ISNULL(SUM(total), 0)
+    FROM ventas WITH (TABLOCK, HOLDLOCK)
+    GROUP BY CAST(fecha AS DATE), ISNULL(punto_venta_id, 0), ISNULL(forma_pago, '');
+END;
+
+IF OBJECT_ID('resumen_productos_diario', 'U') IS NULL
+BEGIN
+    CREATE TABLE resumen_productos_diario (
+        fecha DATE NOT NULL,
+        producto_id INT NOT NULL,
+        cantidad INT NOT NULL,
+        importe DECIMAL(14, 2) NOT NULL,
+        CONSTRAINT PK_resumen_productos_diario PRIMARY KEY (fecha, producto_id)
+    );
+
+    INSERT INTO resumen_productos_diario (fecha, producto_id, cantidad, importe)
+    SELECT CAST(v.fecha AS DATE), d.producto_id, SUM(d.cantidad), ISNULL(SUM(d.subtotal), 0)
+    FROM detalle_venta d WITH (TABLOCK, HOLDLOCK)
+    JOIN ventas v WITH (TABLOCK, HOLDLOCK) ON v.id = d.venta_id
+    GROUP BY CAST(v.fecha AS DATE), d.producto_id;
+END;
+
+COMMIT TRANSACTION;
+GO
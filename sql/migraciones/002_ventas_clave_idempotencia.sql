@@ -0,0 +1,19 @@
+-- 002: clave de idempotencia de ventas (VentaRepo.crear_venta y el diario
+-- local de ventas). Un reenvío de la misma venta devuelve la ya grabada en
+-- vez de duplicarla; el índice único la garantiza aun con dos envíos a la vez.
+--
+--     sqlcmd -S <servidor> -d <base> -E -i sql\migraciones\002_ventas_clave_idempotencia.sql
+-- Se puede volver a correr: si la columna y el índice ya están no hace nada.
+
+SET NOCOUNT ON;
+
+IF COL_LENGTH('ventas', 'clave_idempotencia') IS NULL
+    ALTER TABLE ventas ADD clave_idempotencia VARCHAR(64) NULL;
+GO
+
+-- En otro batch: el índice referencia la columna recién creada
+IF NOT EXISTS (SELECT 1 FROM sys.indexes
+               WHERE name = 'UX_ventas_clave_idempotencia' AND object_id = OBJECT_ID('ventas'))
+    CREATE UNIQUE INDEX UX_ventas_clave_idempotencia ON ventas (clave_idempotencia)
+        WHERE clave_idempotencia IS NOT NULL;
+GO
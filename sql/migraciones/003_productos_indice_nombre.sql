@@ -0,0 +1,13 @@
+-- 003: índice sobre productos.nombre para las búsquedas por inicio del
+-- nombre de ProductoRepo.buscar_filtrado (pestaña Productos). Sin él las
+-- búsquedas funcionan igual, pero recorren la tabla.
+--
+--     sqlcmd -S <servidor> -d <base> -E -i sql\migraciones\003_productos_indice_nombre.sql
+-- Se puede volver a correr: si el índice ya está no hace nada.
+
+SET NOCOUNT ON;
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes
+               WHERE name = 'IX_productos_nombre' AND object_id = OBJECT_ID('productos'))
+    CREATE INDEX IX_productos_nombre ON productos (nombre);
+GO
@@ -0,0 +1,144 @@
+"""
+Ejecución de consultas fuera del hilo de Tk.
+
+Las funciones corren en hilos de fondo y los resultados vuelven al hilo de
+Tk por una cola que se sondea con after(), así los handlers de eventos
+nunca esperan a SQL Server.
+"""
+
+import queue
+import threading
+import logging
+import tkinter as tk
+from typing import Callable, Optional, Any, Dict
+
+logger = logging.getLogger("Tareas")
+
+class Tarea:
+    """Trabajo enviado al ejecutor; cancelar() descarta su resultado"""
+
+    __slots__ = ("fn", "args", "kwargs", "on_ok", "on_error", "clave", "cancelada")
+
+    def __init__(self, fn, args, kwargs, on_ok, on_error, clave):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.on_ok = on_ok
+        self.on_error = on_error
+        self.clave = clave
+        self.cancelada = False
+
+    def cancelar(self):
+        self.cancelada = True
+
+class EjecutorTk:
+    """
+    Corre funciones en hilos de fondo y entrega el resultado en el hilo de Tk.
+    Las tareas con la misma 'clave' se coalescen: una nueva cancela la anterior
+    (si no empezó no se ejecuta; si ya empezó su resultado se descarta).
+    """
+
+    def __init__(self, widget: tk.Misc, hilos: int = 2, intervalo_ms: int = 15,
+                 on_pendientes: Optional[Callable[[int], None]] = None):
+        self._widget = widget
+        self._intervalo_ms = intervalo_ms
+        self._on_pendientes = on_pendientes
+        self._entrada: "queue.Queue[Optional[Tarea]]" = queue.Queue()
+        self._salida: "queue.Queue[tuple]" = queue.Queue()
+        self._por_clave: Dict[str, Tarea] = {}
+        self._pendientes = 0
+        self._sondeando = False
+        self._cerrado = False
+        self._hilos = [threading.Thread(target=self._trabajar, daemon=True) for _ in range(hilos)]
+        for hilo in self._hilos:
+            hilo.start()
+
+    @property
+    def pendientes(self) -> int:
+        return self._pendientes
+
+    def enviar(self, fn: Callable[..., Any], *args,
+               on_ok: Optional[Callable[[Any], None]] = None,
+               on_error: Optional[Callable[[Exception], None]] = None,
+               clave: Optional[str] = None, **kwargs) -> Tarea:
+        """Ejecutar fn(*args, **kwargs) en segundo plano (llamar desde el hilo de Tk)"""
+        tarea = Tarea(fn, args, kwargs, on_ok, on_error, clave)
+        if clave is not None:
+            anterior = self._por_clave.get(clave)
+            if anterior is not None:
+                anterior.cancelar()
+            self._por_clave[clave] = tarea
+        self._pendientes += 1
+        self._notificar_pendientes()
+        self._entrada.put(tarea)
+        self._programar_sondeo()
+        return tarea
+
+    def cancelar(self, clave: str):
+        tarea = self._por_clave.pop(clave, None)
+        if tarea is not None:
+            tarea.cancelar()
+
+    def cerrar(self):
+        self._cerrado = True
+        for tarea in self._por_clave.values():
+            tarea.cancelar()
+        for _ in self._hilos:
+            self._entrada.put(None)
+
+    def _trabajar(self):
+        while True:
+            tarea = self._entrada.get()
+            if tarea is None:
+                return
+            if tarea.cancelada:
+                self._salida.put((tarea, None, None))
+                continue
+            try:
+                resultado = tarea.fn(*tarea.args, **tarea.kwargs)
+                self._salida.put((tarea, resultado, None))
+            except Exception as e:
+                self._salida.put((tarea, None, e))
+
+    def _programar_sondeo(self):
+        if self._sondeando or self._cerrado:
+            return
+        try:
+            self._widget.after(self._intervalo_ms, self._sondear)
+            self._sondeando = True
+        except tk.TclError:
+            # El widget ya fue destruido
+            self.cerrar()
+
+    def _sondear(self):
+        self._sondeando = False
+        while True:
+            try:
+                tarea, resultado, error = self._salida.get_nowait()
+            except queue.Empty:
+                break
+            self._pendientes -= 1
+            if tarea.clave is not None and self._por_clave.get(tarea.clave) is tarea:
+                del self._por_clave[tarea.clave]
+            if tarea.cancelada or self._cerrado:
+                continue
+            try:
+                if error is not None:
+                    if tarea.on_error:
+                        tarea.on_error(error)
+                    else:
+                        logger.error(f"Error en tarea de fondo {getattr(tarea.fn, '__name__', tarea.fn)}: {error}")
+                elif tarea.on_ok:
+                    tarea.on_ok(resultado)
+            except Exception as e:
+                logger.error(f"Error entregando resultado de tarea: {e}")
+        self._notificar_pendientes()
+        if self._pendientes > 0:
+            self._programar_sondeo()
+
+    def _notificar_pendientes(self):
+        if self._on_pendientes and not self._cerrado:
+            try:
+                self._on_pendientes(self._pendientes)
+            except Exception as e:
+                logger.error(f"Error actualizando estado pendiente: {e}")
@@ -1,9 +1,21 @@
+import arranque
+import precarga
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 from nueva_venta import NuevaVentaFrame
-from repos import ProductoRepo, VentaRepo, CategoriaRepo, PuntoVentaRepo
+from repos import ProductoRepo, VentaRepo, CategoriaRepo, PuntoVentaRepo, MetricasRepo, ResumenRepo
+from catalogo import get_catalogo
+from lista_virtual import ListaVirtual
 import datetime
-from simulacion_ventas import SimulacionVentasFrame
+import time
+
+arranque.marcar("imports ventas_app")
+
+def _crear_simulacion(parent):
+    # El simulador (y reportlab) se importan recién al abrir su pestaña
+    from simulacion_ventas import SimulacionVentasFrame
+    return SimulacionVentasFrame(parent)
+
 class VentasApp(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -17,6 +29,8 @@ class VentasApp(tk.Tk):
             pass
 
         self._setup_modern_styles()
+        # Sin login previo (ejecutando ventas_app directo) arranca acá
+        precarga.iniciar()
         
         self.main_frame = ttk.Frame(self)
         self.main_frame.pack(fill="both", expand=True)
@@ -31,6 +45,8 @@ class VentasApp(tk.Tk):
         self._create_status_bar()
         
         self.bind("<F5>", lambda e: self.refresh_all_tabs())
+        arranque.marcar("ventana construida")
+        self.after_idle(lambda: arranque.registrar("interfaz lista"))
         
     def _setup_modern_styles(self):
         """Configurar estilos modernos y profesionales"""
@@ -116,42 +132,71 @@ class VentasApp(tk.Tk):
         stats_frame = ttk.Frame(header, style="Header.TFrame")
         stats_frame.pack(side="right", padx=20)
         
+        self.stats_label = tk.Label(stats_frame,
+                                    text="",
+                                    font=("Segoe UI", 10, "bold"),
+                                    background="#2c3e50",
+                                    foreground="#ecf0f1")
+        self.stats_label.pack(side="right")
+        self._actualizar_stats()
+    
+    def _actualizar_stats(self):
+        """Actualizar las métricas del header (comparten caché con el dashboard)"""
         try:
-            productos = len(ProductoRepo.listar())
-            ventas_hoy = self._get_ventas_hoy()
-            
-            stats_text = f"📦 {productos} Productos | 🧾 {ventas_hoy} Ventas hoy"
-            stats_label = tk.Label(stats_frame,
-                                 text=stats_text,
-                                 font=("Segoe UI", 10, "bold"),
-                                 background="#2c3e50",
-                                 foreground="#ecf0f1")
-            stats_label.pack(side="right")
+            metricas = MetricasRepo.obtener()
+            stats_text = f"📦 {metricas['total_productos']} Productos | 🧾 {metricas['ventas_hoy']} Ventas hoy"
+            self.stats_label.config(text=stats_text)
             
         except Exception as e:
             print(f"Error cargando stats: {e}")
     
     
+    def _definicion_tabs(self):
+        """(atributo, título, constructor) de cada pestaña, en orden"""
+        return [
+            ("tab_dashboard", "📊 Dashboard", DashboardFrame),
+            ("tab_nueva_venta", "💰 Nueva Venta", NuevaVentaFrame),
+            ("tab_productos", "📦 Productos", ProductosFrame),
+            ("tab_categorias", "📂 Categorías", CategoriasFrame),
+            ("tab_historial", "🧾 Historial Ventas", HistorialVentasFrame),
+            ("tab_puntos", "🏪 Puntos de Venta", PuntosVentaFrame),
+            ("tab_simulacion", "🎮 Simular Ventas", _crear_simulacion),
+        ]
+    
+    def _tabs_permitidas(self):
+        """Títulos de las pestañas a mostrar (None = todas); las subclases filtran por rol"""
+        return None
+    
     def _create_tabs(self):
-        """Crear las pestañas del sistema"""
-        self.tab_nueva_venta = NuevaVentaFrame(self.nb)
-        self.tab_productos = ProductosFrame(self.nb)
-        self.tab_categorias = CategoriasFrame(self.nb) 
-        self.tab_historial = HistorialVentasFrame(self.nb)
-        self.tab_puntos = PuntosVentaFrame(self.nb)
-        self.tab_dashboard = DashboardFrame(self.nb)
-        self.tab_simulacion = SimulacionVentasFrame(self.nb)
-        
-        self.nb.add(self.tab_dashboard, text="📊 Dashboard")
-        self.nb.add(self.tab_nueva_venta, text="💰 Nueva Venta")
-        self.nb.add(self.tab_productos, text="📦 Productos")
-        self.nb.add(self.tab_categorias, text="📂 Categorías")
-        self.nb.add(self.tab_historial, text="🧾 Historial Ventas")
-        self.nb.add(self.tab_puntos, text="🏪 Puntos de Venta")
-        self.nb.add(self.tab_simulacion, text="🎮 Simular Ventas")
+        """Crear las pestañas del sistema (cada frame se construye al seleccionarla)"""
+        permitidas = self._tabs_permitidas()
+        self._tabs_pendientes = {}
+        
+        for atributo, titulo, constructor in self._definicion_tabs():
+            setattr(self, atributo, None)
+            if permitidas is not None and titulo not in permitidas:
+                continue
+            contenedor = ttk.Frame(self.nb)
+            self.nb.add(contenedor, text=titulo)
+            self._tabs_pendientes[str(contenedor)] = (atributo, titulo, constructor, contenedor)
         
         self.nb.bind("<<NotebookTabChanged>>", self._on_tab_change)
     
+    def _construir_tab(self, tab_id):
+        """Construir el frame de la pestaña si todavía no existe (True si lo construyó)"""
+        pendiente = self._tabs_pendientes.pop(str(tab_id), None)
+        if pendiente is None:
+            return False
+        
+        atributo, titulo, constructor, contenedor = pendiente
+        inicio = time.perf_counter()
+        frame = constructor(contenedor)
+        if not frame.winfo_manager():
+            frame.pack(fill="both", expand=True)
+        setattr(self, atributo, frame)
+        arranque.marcar(f"pestaña {titulo} construida en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+        return True
+    
     def _create_status_bar(self):
         """Crear barra de estado moderna"""
         status_frame = ttk.Frame(self.main_frame, relief="sunken")
@@ -181,18 +226,21 @@ class VentasApp(tk.Tk):
     def _get_ventas_hoy(self):
         """Obtener número de ventas de hoy"""
         try:
-            ventas = VentaRepo.listar(limit=1000)
-            hoy = datetime.datetime.now().date()
-            ventas_hoy = sum(1 for v in ventas if v['fecha'].date() == hoy)
-            return ventas_hoy
+            return MetricasRepo.obtener()['ventas_hoy']
         except:
             return 0
     
     def _on_tab_change(self, event):
         """Cuando se cambia de pestaña"""
-        tab_name = self.nb.tab(self.nb.select(), "text")
+        tab_id = self.nb.select()
+        if not tab_id:
+            return
+        tab_name = self.nb.tab(tab_id, "text")
         self.status_text.set(f"Vista activa: {tab_name}")
         
+        if self._construir_tab(tab_id):
+            return  # Recién construida: ya cargó sus datos
+        
         if "Dashboard" in tab_name and hasattr(self.tab_dashboard, 'load'):
             self.tab_dashboard.load()
         elif "Productos" in tab_name and hasattr(self.tab_productos, 'load'):
@@ -201,6 +249,9 @@ class VentasApp(tk.Tk):
     def refresh_all_tabs(self):
         """Actualizar todas las pestañas"""
         self.status_text.set("Actualizando toda la información...")
+        get_catalogo().invalidar()
+        MetricasRepo.invalidar()
+        self._actualizar_stats()
         
         tabs = [self.tab_dashboard, self.tab_productos, self.tab_categorias, 
                 self.tab_historial, self.tab_puntos]
@@ -306,6 +357,7 @@ class ModernBaseFrame(ttk.Frame):
         tree.pack(side="left", fill="both", expand=True)
         v_scroll.pack(side="right", fill="y")
         h_scroll.pack(side="bottom", fill="x")
+        tree.v_scroll = v_scroll
         
         tree.tag_configure("even", background="#f8f9fa")
         tree.tag_configure("odd", background="white")
@@ -314,53 +366,92 @@ class ModernBaseFrame(ttk.Frame):
         tree.tag_configure("inactive", background="#e9ecef", foreground="#6c757d")  # Gris para inactivos
         
         return tree
+    
+    def create_virtual_list(self, columns_config, height=15, tags_fila=None, al_final=None, al_ordenar=None):
+        """Como create_modern_treeview pero virtualizada (ver lista_virtual.py)"""
+        lista = ListaVirtual(self, columns_config, height=height, tags_fila=tags_fila,
+                             al_final=al_final, al_ordenar=al_ordenar)
+        lista.pack(fill="both", expand=True)
+        
+        lista.tree.tag_configure("even", background="#f8f9fa")
+        lista.tree.tag_configure("odd", background="white")
+        lista.tree.tag_configure("warning", background="#fff3cd")
+        lista.tree.tag_configure("danger", background="#f8d7da")
+        lista.tree.tag_configure("inactive", background="#e9ecef", foreground="#6c757d")
+        
+        return lista
 
 class DashboardFrame(ModernBaseFrame):
     """Dashboard moderno con métricas y gráficos"""
     
+    VENTAS_RECIENTES = 20
+    
     def __init__(self, parent):
         super().__init__(parent)
-        self.load()
-    
-    def load(self):
-        """Cargar datos del dashboard"""
-        for widget in self.winfo_children():
-            widget.destroy()
+        self._metricas_previas = None
         
         self.make_modern_toolbar([
-            ("📊 Actualizar Métricas", self.load, "accent"),
+            ("📊 Actualizar Métricas", self.actualizar_metricas, "accent"),
             ("📈 Reporte Completo", self.generar_reporte, "success")
         ], "📊 Dashboard de Ventas")
         
         self._create_metrics_cards()
         
         self._create_recent_sales()
+        self.load()
+    
+    def load(self, forzar=False):
+        """Cargar datos del dashboard (se omite si no cambiaron desde la última vez)"""
+        try:
+            metricas = MetricasRepo.obtener()
+        except Exception as e:
+            print(f"Error cargando métricas: {e}")
+            return
+        
+        # Las métricas cubren cantidad de ventas y stock: si son iguales,
+        # tampoco cambiaron las ventas recientes
+        if not forzar and metricas == self._metricas_previas:
+            return
+        self._metricas_previas = metricas
+        
+        self._actualizar_metricas(metricas)
+        self._actualizar_ventas_recientes()
+    
+    def actualizar_metricas(self):
+        """Recargar ignorando la caché de métricas"""
+        MetricasRepo.invalidar()
+        self.load(forzar=True)
     
     def _create_metrics_cards(self):
         """Crear tarjetas de métricas"""
         metrics_frame = ttk.Frame(self)
         metrics_frame.pack(fill="x", pady=(0, 20))
         
-        try:
-            productos = ProductoRepo.listar()
-            ventas = VentaRepo.listar(limit=100)
-            ventas_hoy = self._get_ventas_hoy()
-            total_ventas = sum(v['total'] for v in ventas)
-            productos_bajo_stock = sum(1 for p in productos if p['stock'] < 10)
-            
-            metrics = [
-                ("📦 Total Productos", len(productos), "#3498db", "productos"),
-                ("🧾 Ventas Hoy", ventas_hoy, "#27ae60", "ventas"), 
-                ("💰 Ingresos Totales", f"${total_ventas:,.2f}", "#9b59b6", "ingresos"),
-                ("⚠️ Stock Bajo", productos_bajo_stock, "#e74c3c", "stock")
-            ]
-            
-            for i, (title, value, color, key) in enumerate(metrics):
-                card = self._create_metric_card(metrics_frame, title, value, color)
-                card.pack(side="left", fill="x", expand=True, padx=5)  # CORREGIDO: usar pack en lugar de grid
-                
-        except Exception as e:
-            print(f"Error cargando métricas: {e}")
+        metrics = [
+            ("📦 Total Productos", "#3498db", "productos"),
+            ("🧾 Ventas Hoy", "#27ae60", "ventas"), 
+            ("💰 Ingresos Totales", "#9b59b6", "ingresos"),
+            ("⚠️ Stock Bajo", "#e74c3c", "stock")
+        ]
+        
+        self.metric_labels = {}
+        for title, color, key in metrics:
+            card = self._create_metric_card(metrics_frame, title, "-", color)
+            card.pack(side="left", fill="x", expand=True, padx=5)  # CORREGIDO: usar pack en lugar de grid
+            self.metric_labels[key] = card.value_label
+    
+    def _actualizar_metricas(self, metricas):
+        """Actualizar los valores de las tarjetas en el lugar"""
+        valores = {
+            "productos": metricas['total_productos'],
+            "ventas": metricas['ventas_hoy'],
+            "ingresos": f"${metricas['ingresos_total']:,.2f}",
+            "stock": metricas['stock_bajo']
+        }
+        for key, value in valores.items():
+            label = self.metric_labels[key]
+            if label.cget("text") != str(value):
+                label.config(text=value)
     
     def _create_metric_card(self, parent, title, value, color):
         """Crear tarjeta de métrica individual"""
@@ -375,6 +466,7 @@ class DashboardFrame(ModernBaseFrame):
                               font=("Segoe UI", 18, "bold"), 
                               foreground=color)
         value_label.pack(pady=(0, 15))
+        card.value_label = value_label
         
         color_bar = tk.Frame(card, bg=color, height=4)
         color_bar.pack(fill="x", side="bottom")
@@ -407,26 +499,44 @@ class DashboardFrame(ModernBaseFrame):
         
         self.sales_tree.tag_configure("even", background="#f8f9fa")
         self.sales_tree.tag_configure("odd", background="white")
-        
+    
+    def _actualizar_ventas_recientes(self):
+        """Aplicar sólo las diferencias con las filas que ya se muestran"""
         try:
-            ventas = VentaRepo.listar(limit=20)
-            for idx, venta in enumerate(ventas):
-                tag = "even" if idx % 2 == 0 else "odd"
-                self.sales_tree.insert("", tk.END, values=(
-                    venta["id"],
-                    venta["fecha"].strftime("%d/%m/%Y %H:%M"),
-                    f"${venta['total']:.2f}",
-                    venta["forma_pago"]
-                ), tags=(tag,))
+            ventas = VentaRepo.listar(limit=self.VENTAS_RECIENTES)
         except Exception as e:
             print(f"Error cargando ventas recientes: {e}")
+            return
+        
+        nuevas = {f"v{venta['id']}" for venta in ventas}
+        for iid in self.sales_tree.get_children():
+            if iid not in nuevas:
+                self.sales_tree.delete(iid)
+        
+        for idx, venta in enumerate(ventas):
+            iid = f"v{venta['id']}"
+            tag = "even" if idx % 2 == 0 else "odd"
+            values = (
+                venta["id"],
+                venta["fecha"].strftime("%d/%m/%Y %H:%M"),
+                f"${venta['total']:.2f}",
+                venta["forma_pago"]
+            )
+            if not self.sales_tree.exists(iid):
+                self.sales_tree.insert("", idx, iid=iid, values=values, tags=(tag,))
+                continue
+            if self.sales_tree.index(iid) != idx:
+                self.sales_tree.move(iid, "", idx)
+            actual = self.sales_tree.item(iid)
+            if tuple(str(v) for v in actual["values"]) != tuple(str(v) for v in values):
+                self.sales_tree.item(iid, values=values)
+            if tuple(actual["tags"]) != (tag,):
+                self.sales_tree.item(iid, tags=(tag,))
     
     def _get_ventas_hoy(self):
         """Obtener ventas de hoy"""
         try:
-            ventas = VentaRepo.listar(limit=1000)
-            hoy = datetime.datetime.now().date()
-            return sum(1 for v in ventas if v['fecha'].date() == hoy)
+            return MetricasRepo.obtener()['ventas_hoy']
         except:
             return 0
     
@@ -434,8 +544,17 @@ class DashboardFrame(ModernBaseFrame):
         """Generar reporte completo"""
         messagebox.showinfo("Reporte", "Función de reportes en desarrollo...")
 class ProductosFrame(ModernBaseFrame):
+    TAMANO_PAGINA = 200
+    
     def __init__(self, parent):
         super().__init__(parent)
+        self._query = ""
+        self._orden = ("nombre", False)
+        self._cargadas = 0
+        self._total = 0
+        self._hay_mas = False
+        self._cargando = False
+        self._pagina_pedida = False
         
         self.toolbar_buttons = [
             ("➕ Agregar Producto", self.add, "success"),
@@ -451,22 +570,55 @@ class ProductosFrame(ModernBaseFrame):
         self.search_var = self.create_search_bar("Buscar productos...", self.buscar_productos)
         
         columns = [
-            ("id", "ID", 70, "center"),
-            ("codigo", "Código", 130, "center"),
-            ("nombre", "Nombre", 250, "w"),
-            ("precio", "Precio", 100, "center"),
-            ("stock", "Stock", 80, "center"),
-            ("categoria", "Categoría", 120, "center"),
-            ("estado", "Estado", 100, "center")
+            ("id", "ID", 70, "center", "id"),
+            ("codigo", "Código", 130, "center", "codigo_barras"),
+            ("nombre", "Nombre", 250, "w", "nombre"),
+            ("precio", "Precio", 100, "center", "precio", lambda v: f"${v:.2f}"),
+            ("stock", "Stock", 80, "center", "stock"),
+            ("categoria", "Categoría", 120, "center", "categoria"),
+            ("estado", "Estado", 100, "center", "activo", self._texto_estado)
         ]
         
-        self.tree = self.create_modern_treeview(columns)
+        # Filtro, orden y paginado en el servidor; la lista sólo dibuja lo visible
+        self.lista = self.create_virtual_list(columns, tags_fila=self._tags_producto,
+                                              al_final=self._on_final, al_ordenar=self._on_ordenar)
+        self.tree = self.lista.tree
         
         self.tree.bind("<Double-1>", lambda e: self.edit())
         self.tree.bind("<Delete>", lambda e: self.toggle_estado())
         
         self.load()
 
+    @staticmethod
+    def _texto_estado(activo):
+        return "ACTIVO" if activo is None or activo else "INACTIVO"
+
+    @staticmethod
+    def _tags_producto(p, idx):
+        tags = ()
+        if p['stock'] < 5:
+            tags += ("warning",)
+        if p['stock'] == 0:
+            tags += ("danger",)
+        if not p.get('activo', True):
+            tags += ("inactive",)
+        return tags
+
+    def _estado(self):
+        """Filtro de estado para ProductoRepo.buscar_filtrado"""
+        filtro = self.filter_var.get()
+        if filtro == "ACTIVOS":
+            return True
+        if filtro == "INACTIVOS":
+            return False
+        return None
+
+    def _seleccionado(self, mensaje):
+        producto = self.lista.seleccionada()
+        if producto is None:
+            messagebox.showwarning("Selección", mensaje)
+        return producto
+
     def _create_status_filter(self):
         """Crear filtro por estado"""
         filter_frame = ttk.Frame(self)
@@ -482,124 +634,86 @@ class ProductosFrame(ModernBaseFrame):
                        value="ACTIVOS", command=self.load).pack(side="left", padx=(0, 10))
         ttk.Radiobutton(filter_frame, text="Inactivos", variable=self.filter_var, 
                        value="INACTIVOS", command=self.load).pack(side="left")
+        
+        self.lbl_resultados = ttk.Label(filter_frame, text="", font=("Segoe UI", 9), foreground="#7f8c8d")
+        self.lbl_resultados.pack(side="right")
 
     def load(self):
-        """Cargar productos con filtro de estado"""
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-            
-        try:
-            productos = ProductoRepo.listar()
-            for idx, p in enumerate(productos):
-                estado = "ACTIVO" if p.get('activo', True) else "INACTIVO"
-                filtro = self.filter_var.get()
-                
-                if filtro == "ACTIVOS" and estado != "ACTIVO":
-                    continue
-                if filtro == "INACTIVOS" and estado != "INACTIVO":
-                    continue
-                
-                tags = ("even",) if idx % 2 == 0 else ("odd",)
-                
-                if p['stock'] < 5:
-                    tags += ("warning",)
-                if p['stock'] == 0:
-                    tags += ("danger",)
-                if estado == "INACTIVO":
-                    tags += ("inactive",)
-                
-                self.tree.insert("", tk.END, values=(
-                    p["id"],
-                    p["codigo_barras"],
-                    p["nombre"],
-                    f"${p['precio']:.2f}",
-                    p["stock"],
-                    p["categoria"],
-                    estado
-                ), tags=tags)
-                
-        except Exception as e:
-            messagebox.showerror("Error", f"No se pudieron cargar los productos:\n{str(e)}")
+        """Recargar desde la primera página con la búsqueda y el filtro actuales"""
+        self.buscar_productos(self.search_var.get() if hasattr(self, 'search_var') else "")
 
     def buscar_productos(self, query):
-        """Buscar productos con filtro de estado"""
+        """Buscar productos con filtro de estado (en el servidor, de a páginas)"""
         if not query or query == "Buscar productos...":
-            self.load()
+            query = ""
+        self._query = query.strip()
+        self._cargadas = 0
+        self._total = 0
+        self._hay_mas = True
+        self._cargando = False
+        self.lista.set_datos([])
+        self._cargar_pagina()
+
+    def _cargar_pagina(self):
+        """Traer la página siguiente de la búsqueda actual"""
+        self._pagina_pedida = False
+        if self._cargando or not self._hay_mas:
             return
-            
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-            
+        self._cargando = True
         try:
-            productos = ProductoRepo.listar()
-            for idx, p in enumerate(productos):
-                if not (query.lower() in p['nombre'].lower() or 
-                       query.lower() in p.get('codigo_barras', '').lower() or
-                       query.lower() in p.get('categoria', '').lower()):
-                    continue
-                
-                # Aplicar filtro de estado
-                estado = "ACTIVO" if p.get('activo', True) else "INACTIVO"
-                filtro = self.filter_var.get()
-                
-                if filtro == "ACTIVOS" and estado != "ACTIVO":
-                    continue
-                if filtro == "INACTIVOS" and estado != "INACTIVO":
-                    continue
-                    
-                tags = ("even",) if idx % 2 == 0 else ("odd",)
-                if p['stock'] < 5:
-                    tags += ("warning",)
-                # Resaltar productos inactivos
-                if estado == "INACTIVO":
-                    tags += ("inactive",)
-                
-                self.tree.insert("", tk.END, values=(
-                    p["id"],
-                    p["codigo_barras"], 
-                    p["nombre"],
-                    f"${p['precio']:.2f}",
-                    p["stock"],
-                    p["categoria"],
-                    estado
-                ), tags=tags)
-                    
+            campo, descendente = self._orden
+            resultado = ProductoRepo.buscar_filtrado(self._query, estado=self._estado(),
+                                                     limit=self.TAMANO_PAGINA, offset=self._cargadas,
+                                                     orden=campo, descendente=descendente)
         except Exception as e:
-            messagebox.showerror("Error", f"Error en búsqueda: {str(e)}")
+            self._hay_mas = False
+            messagebox.showerror("Error", f"No se pudieron cargar los productos:\n{str(e)}")
+            return
+        finally:
+            self._cargando = False
+        
+        filas = resultado["filas"]
+        self._cargadas += len(filas)
+        self._total = resultado["total"]
+        self._hay_mas = bool(filas) and self._cargadas < self._total
+        self.lista.agregar(filas)
+        self.lbl_resultados.config(text=f"{self._cargadas} de {self._total} productos")
+
+    def _on_final(self):
+        if self._hay_mas and not self._cargando and not self._pagina_pedida:
+            self._pagina_pedida = True
+            self.after_idle(self._cargar_pagina)
+
+    def _on_ordenar(self, campo, descendente):
+        self._orden = (campo, descendente) if campo else ("nombre", False)
+        self.buscar_productos(self._query)
 
     def toggle_estado(self):
         """Activar/Desactivar producto seleccionado"""
-        seleccion = self.tree.selection()
-        if not seleccion:
-            messagebox.showwarning("Selección", "Seleccione un producto para cambiar su estado")
+        seleccionado = self._seleccionado("Seleccione un producto para cambiar su estado")
+        if seleccionado is None:
             return
             
-        producto_id = self.tree.item(seleccion[0])["values"][0]
-        producto_nombre = self.tree.item(seleccion[0])["values"][2]
-        estado_actual = self.tree.item(seleccion[0])["values"][6]
+        producto_id = seleccionado["id"]
+        producto_nombre = seleccionado["nombre"]
         
-        nuevo_estado = not (estado_actual == "ACTIVO")
+        nuevo_estado = not seleccionado.get('activo', True)
         accion = "activar" if nuevo_estado else "desactivar"
         
         if messagebox.askyesno("Confirmar", 
                              f"¿Está seguro de {accion} el producto '{producto_nombre}'?"):
             try:
-                producto = ProductoRepo.buscar_por_id(producto_id)
-                if producto:
-                    ProductoRepo.actualizar_completo(
-                        producto_id=producto_id,
-                        nombre=producto['nombre'],
-                        precio=producto['precio'],
-                        codigo_barras=producto.get('codigo_barras'),
-                        categoria_id=producto.get('categoria_id'),
-                        stock=producto.get('stock'),
-                        activo=nuevo_estado
-                    )
-                    self.load()
-                    estado_text = "activado" if nuevo_estado else "desactivado"
-                    messagebox.showinfo("Éxito", f"Producto {estado_text} correctamente")
-                else:
-                    messagebox.showerror("Error", "No se pudo encontrar el producto")
+                # Sólo cambia 'activo' (los campos en None no se tocan): releer el
+                # producto para reescribirlo pisaría el stock que vendan otras cajas
+                ProductoRepo.actualizar_completo(
+                    producto_id=producto_id,
+                    nombre=None,
+                    precio=None,
+                    activo=nuevo_estado
+                )
+                self.load()
+                estado_text = "activado" if nuevo_estado else "desactivado"
+                messagebox.showinfo("Éxito", f"Producto {estado_text} correctamente")
                     
             except Exception as e:
                 messagebox.showerror("Error", f"No se pudo cambiar el estado del producto:\n{str(e)}")
@@ -613,12 +727,11 @@ class ProductosFrame(ModernBaseFrame):
 
     def edit(self):
         """Editar producto seleccionado"""
-        seleccion = self.tree.selection()
-        if not seleccion:
-            messagebox.showwarning("Selección", "Seleccione un producto para editar")
+        seleccionado = self._seleccionado("Seleccione un producto para editar")
+        if seleccionado is None:
             return
             
-        producto_id = self.tree.item(seleccion[0])["values"][0]
+        producto_id = seleccionado["id"]
         dialog = ProductoDialog(self, "Editar Producto", producto_id)
         self.wait_window(dialog)
         if dialog.resultado:
@@ -626,23 +739,21 @@ class ProductosFrame(ModernBaseFrame):
 
     def actualizar_precio(self):
         """Actualizar precio rápido"""
-        seleccion = self.tree.selection()
-        if not seleccion:
-            messagebox.showwarning("Selección", "Seleccione un producto")
+        seleccionado = self._seleccionado("Seleccione un producto")
+        if seleccionado is None:
             return
             
-        producto_id = self.tree.item(seleccion[0])["values"][0]
-        producto_nombre = self.tree.item(seleccion[0])["values"][2]
-        estado_actual = self.tree.item(seleccion[0])["values"][6]
+        producto_id = seleccionado["id"]
+        producto_nombre = seleccionado["nombre"]
         
-        if estado_actual == "INACTIVO":
+        if not seleccionado.get('activo', True):
             messagebox.showwarning("Producto Inactivo", "No se puede actualizar el precio de un producto inactivo")
             return
         
         nuevo_precio = simpledialog.askfloat(
             "Actualizar Precio",
             f"Nuevo precio para {producto_nombre}:",
-            initialvalue=float(self.tree.item(seleccion[0])["values"][3].replace('$', '')),
+            initialvalue=float(seleccionado["precio"]),
             minvalue=0.0
         )
         
@@ -910,11 +1021,11 @@ class CategoriaDialog(tk.Toplevel):
                     if categoria.get('descripcion'):
                         self.descripcion_text.insert("1.0", categoria['descripcion'])
                     
-                    productos = ProductoRepo.listar()
-                    productos_categoria = [p for p in productos if p.get('categoria_id') == self.categoria_id]
+                    num_productos = next((c['productos'] for c in get_catalogo().categorias_con_conteos()
+                                          if c['id'] == self.categoria_id), 0)
                     
-                    if productos_categoria:
-                        info_text = f"📦 Esta categoría tiene {len(productos_categoria)} productos asociados"
+                    if num_productos:
+                        info_text = f"📦 Esta categoría tiene {num_productos} productos asociados"
                         info_label = ttk.Label(self.info_frame, text=info_text, 
                                              font=("Segoe UI", 9, "italic"),
                                              foreground="#6c757d")
@@ -987,6 +1098,7 @@ class CategoriasFrame(ModernBaseFrame):
             ("id", "ID", 80, "center"),
             ("nombre", "Nombre", 250, "w"),
             ("descripcion", "Descripción", 400, "w"),
+            ("productos", "Productos", 120, "center"),
         ]
         
         self.tree = self.create_modern_treeview(columns)
@@ -998,32 +1110,24 @@ class CategoriasFrame(ModernBaseFrame):
 
     def load(self):
         """Cargar categorías con conteo de productos"""
+        try:
+            self._mostrar(get_catalogo().categorias_con_conteos())
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudieron cargar las categorías:\n{str(e)}")
+
+    def _mostrar(self, categorias):
         for item in self.tree.get_children():
             self.tree.delete(item)
             
-        try:
-            categorias = CategoriaRepo.listar()
-            productos = ProductoRepo.listar()
-            
-            productos_por_categoria = {}
-            for producto in productos:
-                cat_id = producto.get('categoria_id')
-                if cat_id:
-                    productos_por_categoria[cat_id] = productos_por_categoria.get(cat_id, 0) + 1
+        for idx, categoria in enumerate(categorias):
+            tag = "even" if idx % 2 == 0 else "odd"
             
-            for idx, categoria in enumerate(categorias):
-                tag = "even" if idx % 2 == 0 else "odd"
-                num_productos = productos_por_categoria.get(categoria['id'], 0)
-                
-                self.tree.insert("", tk.END, values=(
-                    categoria["id"],
-                    categoria["nombre"],
-                    categoria["descripcion"] or "Sin descripción",
-                    f"{num_productos} productos"
-                ), tags=(tag,))
-                
-        except Exception as e:
-            messagebox.showerror("Error", f"No se pudieron cargar las categorías:\n{str(e)}")
+            self.tree.insert("", tk.END, values=(
+                categoria["id"],
+                categoria["nombre"],
+                categoria["descripcion"] or "Sin descripción",
+                f"{categoria['productos']} productos"
+            ), tags=(tag,))
 
     def buscar_categorias(self, query):
         """Buscar categorías por nombre o descripción"""
@@ -1031,34 +1135,10 @@ class CategoriasFrame(ModernBaseFrame):
             self.load()
             return
             
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-            
         try:
-            categorias = CategoriaRepo.listar()
-            productos = ProductoRepo.listar()
-            
-            productos_por_categoria = {}
-            for producto in productos:
-                cat_id = producto.get('categoria_id')
-                if cat_id:
-                    productos_por_categoria[cat_id] = productos_por_categoria.get(cat_id, 0) + 1
-            
-            for idx, categoria in enumerate(categorias):
-                if not (query.lower() in categoria['nombre'].lower() or 
-                       query.lower() in (categoria.get('descripcion') or '').lower()):
-                    continue
-                    
-                tag = "even" if idx % 2 == 0 else "odd"
-                num_productos = productos_por_categoria.get(categoria['id'], 0)
-                
-                self.tree.insert("", tk.END, values=(
-                    categoria["id"],
-                    categoria["nombre"],
-                    categoria["descripcion"] or "Sin descripción",
-                    f"{num_productos} productos"
-                ), tags=(tag,))
-                    
+            texto = query.lower()
+            self._mostrar([c for c in get_catalogo().categorias_con_conteos()
+                           if texto in c['nombre'].lower() or texto in (c.get('descripcion') or '').lower()])
         except Exception as e:
             messagebox.showerror("Error", f"Error en búsqueda: {str(e)}")
 
@@ -1116,6 +1196,10 @@ class CategoriasFrame(ModernBaseFrame):
                 messagebox.showerror("Error", f"No se pudo eliminar la categoría:\n{str(e)}")
 
 class HistorialVentasFrame(ModernBaseFrame):
+    TAMANO_PAGINA = 100
+    PERIODOS = {"Hoy": 0, "Últimos 7 días": 7, "Últimos 30 días": 30, "Todo": None}
+    FORMAS_PAGO = ["TODAS", "EFECTIVO", "TARJETA_DEBITO", "TARJETA_CREDITO", "TRANSFERENCIA"]
+
     def __init__(self, parent):
         super().__init__(parent)
         
@@ -1124,37 +1208,125 @@ class HistorialVentasFrame(ModernBaseFrame):
             ("📋 Ver Detalles", self.ver_detalles, "success")
         ], "🧾 Historial de Ventas")
         
+        self._create_filters()
+        
         columns = [
-            ("id", "ID", 80, "center"),
-            ("fecha", "Fecha y Hora", 180, "center"),
-            ("total", "Total", 120, "center"),
-            ("forma_pago", "Forma de Pago", 150, "center")
+            ("id", "ID", 80, "center", "id"),
+            ("fecha", "Fecha y Hora", 180, "center", "fecha", lambda f: f.strftime("%d/%m/%Y %H:%M")),
+            ("total", "Total", 120, "center", "total", lambda t: f"${t:.2f}"),
+            ("forma_pago", "Forma de Pago", 150, "center", "forma_pago")
         ]
         
-        self.tree = self.create_modern_treeview(columns)
+        self._hay_mas = False
+        self._cargando = False
+        self._pagina_pedida = False
+        # Al acercarse al final de la lista se trae la página siguiente
+        self.lista = self.create_virtual_list(columns, al_final=self._on_final)
+        self.tree = self.lista.tree
         self.load()
     
+    def _create_filters(self):
+        """Crear filtros por período, forma de pago y punto de venta"""
+        filter_frame = ttk.Frame(self)
+        filter_frame.pack(fill="x", pady=(0, 10))
+        
+        ttk.Label(filter_frame, text="Período:", font=("Segoe UI", 9)).pack(side="left", padx=(0, 5))
+        self.periodo_var = tk.StringVar(value="Últimos 30 días")
+        periodo = ttk.Combobox(filter_frame, textvariable=self.periodo_var, state="readonly",
+                               values=list(self.PERIODOS), width=16)
+        periodo.pack(side="left", padx=(0, 15))
+        periodo.bind("<<ComboboxSelected>>", lambda e: self.load())
+        
+        ttk.Label(filter_frame, text="Forma de pago:", font=("Segoe UI", 9)).pack(side="left", padx=(0, 5))
+        self.forma_pago_var = tk.StringVar(value="TODAS")
+        forma_pago = ttk.Combobox(filter_frame, textvariable=self.forma_pago_var, state="readonly",
+                                  values=self.FORMAS_PAGO, width=18)
+        forma_pago.pack(side="left", padx=(0, 15))
+        forma_pago.bind("<<ComboboxSelected>>", lambda e: self.load())
+        
+        ttk.Label(filter_frame, text="Punto de venta:", font=("Segoe UI", 9)).pack(side="left", padx=(0, 5))
+        self.punto_var = tk.StringVar(value="TODOS")
+        self._puntos = {"TODOS": None}
+        try:
+            for p in PuntoVentaRepo.listar():
+                self._puntos[f"{p['id']} - {p['nombre']}"] = p['id']
+        except Exception as e:
+            print(f"Error cargando puntos de venta: {e}")
+        punto = ttk.Combobox(filter_frame, textvariable=self.punto_var, state="readonly",
+                             values=list(self._puntos), width=22)
+        punto.pack(side="left")
+        punto.bind("<<ComboboxSelected>>", lambda e: self.load())
+        
+        self.lbl_cargadas = ttk.Label(filter_frame, text="", font=("Segoe UI", 9), foreground="#7f8c8d")
+        self.lbl_cargadas.pack(side="right")
+    
+    def _filtros(self):
+        filtros = {}
+        dias = self.PERIODOS.get(self.periodo_var.get())
+        if dias is not None:
+            hoy = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+            filtros["desde"] = hoy - datetime.timedelta(days=dias)
+        if self.forma_pago_var.get() != "TODAS":
+            filtros["forma_pago"] = self.forma_pago_var.get()
+        filtros["punto_venta_id"] = self._puntos.get(self.punto_var.get())
+        return filtros
+    
     def load(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-            
-        for idx, v in enumerate(VentaRepo.listar(limit=100)):
-            tag = "even" if idx % 2 == 0 else "odd"
-            self.tree.insert("", tk.END, values=(
-                v["id"],
-                v["fecha"].strftime("%d/%m/%Y %H:%M"),
-                f"${v['total']:.2f}",
-                v["forma_pago"]
-            ), tags=(tag,))
+        """Empezar de nuevo desde la venta más reciente con los filtros actuales"""
+        self.lista.set_datos([])
+        self._cursor = None
+        self._hay_mas = True
+        self._cargando = False
+        self._cargadas = 0
+        self._totales = None
+        try:
+            # Sale de los resúmenes diarios: no depende de cuántas ventas haya
+            self._totales = ResumenRepo.totales(**self._filtros())
+        except Exception as e:
+            print(f"Error cargando totales del período: {e}")
+        self._cargar_pagina()
+    
+    def _cargar_pagina(self):
+        """Traer la página siguiente a la última fila cargada"""
+        self._pagina_pedida = False
+        if self._cargando or not self._hay_mas:
+            return
+        self._cargando = True
+        try:
+            ventas = VentaRepo.listar_pagina(limit=self.TAMANO_PAGINA, despues=self._cursor,
+                                             **self._filtros())
+        except Exception as e:
+            self._hay_mas = False
+            messagebox.showerror("Error", f"No se pudo cargar el historial: {e}")
+            return
+        finally:
+            self._cargando = False
+        
+        self._cargadas += len(ventas)
+        if ventas:
+            self._cursor = (ventas[-1]["fecha"], ventas[-1]["id"])
+        self._hay_mas = len(ventas) == self.TAMANO_PAGINA
+        self.lista.agregar(ventas)
+        if self._totales is not None:
+            self.lbl_cargadas.config(
+                text=f"{self._cargadas} de {self._totales['cantidad_ventas']} ventas "
+                     f"| Total del período: ${self._totales['total']:,.2f}")
+        else:
+            sufijo = "" if self._hay_mas else " (todas)"
+            self.lbl_cargadas.config(text=f"{self._cargadas} ventas cargadas{sufijo}")
+    
+    def _on_final(self):
+        if self._hay_mas and not self._cargando and not self._pagina_pedida:
+            self._pagina_pedida = True
+            self.after_idle(self._cargar_pagina)
     
     def generar_reporte(self):
         messagebox.showinfo("Reportes", "Sistema de reportes en desarrollo")
     
     def ver_detalles(self):
-        seleccion = self.tree.selection()
-        if seleccion:
-            venta_id = self.tree.item(seleccion[0])["values"][0]
-            messagebox.showinfo("Detalles", f"Detalles de venta #{venta_id} en desarrollo")
+        venta = self.lista.seleccionada()
+        if venta is not None:
+            messagebox.showinfo("Detalles", f"Detalles de venta #{venta['id']} en desarrollo")
 
 class PuntosVentaFrame(ModernBaseFrame):
     def __init__(self, parent):